@@ -1,14 +1,43 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-from db import get_db_connection, init_db
-import bcrypt
+from db import (
+    init_db, get_user_by_email, get_user_by_whatsapp, create_user, update_user_password,
+    get_tags, get_contact_count, create_tag, update_tag, delete_tag, assign_tag, unassign_tag,
+    get_contacts, get_contact, create_contact, update_contact, delete_contact, get_data_version,
+    parse_contact_fields, get_contacts_by_ids,
+    find_contacts_by_phone, get_contact_by_phone, DuplicatePhoneError, DuplicateUserError,
+    shard_router, TenantMovingError
+)
 import jwt
-from datetime import datetime, timedelta
+import logging
+from datetime import datetime, timedelta, timezone
 from functools import wraps
 from decouple import config
+from importer import fail_stale_imports, start_import, get_import_job
+from sync import SYNC_MAX_PAGE_SIZE, SYNC_PAGE_SIZE, get_changes
+from exporter import EXPORTERS
+from audiences import resolve_audience, iter_audience_json
+from campaigns import (
+    start_workers, create_campaign, get_campaigns, get_campaign, cancel_campaign, parse_send_at
+)
+from reports import get_campaign_reports, get_summary, get_timeseries, parse_time
+from webhooks import WHATSAPP_WEBHOOK_VERIFY_TOKEN, record_callback, start_applier, verify_signature
+from auth import TokenCache
+import metrics
+import fastjson
+from passwords import (
+    PasswordHasherBusy, hash_password, check_password, needs_rehash, rehash_in_background
+)
 
 app = Flask(__name__)
 CORS(app, supports_credentials=True)
+metrics.init_app(app)
+fastjson.init_app(app)
+
+# Log to stderr at LOG_LEVEL (DEBUG adds per-login messages)
+logging.basicConfig(level=config('LOG_LEVEL', default='INFO').upper(),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
 
 # Load configuration
 app.config['SECRET_KEY'] = config('JWT_SECRET', default='your-secret-key')
@@ -17,6 +46,25 @@ app.config['JWT_EXPIRATION_DELTA'] = timedelta(days=1)
 # Initialize database
 init_db()
 
+# Imports cut short by a crash would otherwise block tenant moves forever
+fail_stale_imports()
+
+# Campaign send pipeline; off unless CAMPAIGN_WORKERS is set, normally it
+# runs in its own process (campaign_worker.py)
+start_workers()
+
+# Folds logged WhatsApp status callbacks into campaign messages (no-op when WEBHOOK_APPLIER is off)
+start_applier()
+
+# Verified tokens are cached so each request doesn't redo the HS256 check
+token_cache = TokenCache(
+    app.config['SECRET_KEY'],
+    algorithms=['HS256'],
+    maxsize=config('TOKEN_CACHE_SIZE', default=10000, cast=int),
+    ttl=config('TOKEN_CACHE_TTL', default=300.0, cast=float),
+    max_revoked=config('TOKEN_REVOKED_MAX', default=100000, cast=int)
+)
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -24,13 +72,66 @@ def token_required(f):
         if not token:
             return jsonify({'error': 'Token is missing'}), 401
         try:
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = data
-        except:
+            current_user = token_cache.verify(token)
+        except jwt.InvalidTokenError:
             return jsonify({'error': 'Token is invalid'}), 401
+        # Request-scoped user context for code that isn't handed current_user
+        g.current_user = current_user
+        try:
+            shard_router.shard_for(current_user['user_id'])
+        except TenantMovingError:
+            response = jsonify({'error': 'Your data is being moved, please try again shortly'})
+            response.status_code = 503
+            response.headers['Retry-After'] = '5'
+            return response
         return f(current_user, *args, **kwargs)
     return decorated
 
+def conditional_get(f):
+    """Answer with ETag/Last-Modified from the user's data version.
+
+    A matching If-None-Match (or, without one, If-Modified-Since) gets a 304
+    after a single lookup, before the view touches the contacts tables.
+    Last-Modified has one-second resolution, so it is only sent, and
+    If-Modified-Since only honoured, once the second of the last change is
+    over; before that another write in the same second would look unchanged.
+    Must be applied below @token_required.
+    """
+    @wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        version, updated_at = get_data_version(current_user['user_id'])
+        etag = f"{current_user['user_id']}-{version}"
+        settled = updated_at is not None and datetime.now(timezone.utc).timestamp() >= int(updated_at) + 1
+        last_modified = datetime.fromtimestamp(int(updated_at), timezone.utc) if settled else None
+
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        else:
+            not_modified = bool(last_modified and request.if_modified_since
+                                and request.if_modified_since >= last_modified)
+
+        if not_modified:
+            response = app.response_class(status=304)
+        else:
+            response = app.make_response(f(current_user, *args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        if last_modified:
+            response.last_modified = last_modified
+        # Cached per user, but always revalidated
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+        return response
+    return decorated
+
+def hasher_busy_response(e):
+    response = jsonify({'error': 'Server is busy, please try again shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
 @app.route('/api/auth/signup', methods=['POST'])
 def signup():
     try:
@@ -56,47 +157,36 @@ def signup():
         if len(password) < 6:
             return jsonify({'error': 'Password must be at least 6 characters'}), 400
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Check if user exists
-        cursor.execute('SELECT * FROM users WHERE email = ?', (email,))
-        if cursor.fetchone():
+        # Check if user exists, before paying for the hash; two indexed lookups
+        if get_user_by_email(email):
             return jsonify({'error': 'User already exists'}), 400
 
         # Check if WhatsApp number exists for the country
-        cursor.execute('SELECT * FROM users WHERE country_code = ? AND whatsapp_number = ?', 
-                      (country_code, whatsapp_number))
-        if cursor.fetchone():
+        if get_user_by_whatsapp(country_code, whatsapp_number):
             return jsonify({'error': 'WhatsApp number already registered'}), 400
 
-        # Hash password
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        # Hash password off the request thread
+        hashed_password = hash_password(password)
         
-        # Insert new user
-        cursor.execute(
-            'INSERT INTO users (email, password, full_name, country_code, whatsapp_number) VALUES (?, ?, ?, ?, ?)',
-            (email, hashed_password, full_name, country_code, whatsapp_number)
-        )
-        conn.commit()
-
-        # Get the created user
-        cursor.execute('SELECT id, email, full_name as name FROM users WHERE email = ?', (email,))
-        user = cursor.fetchone()
+        # Insert new user; the unique constraints catch a signup that raced this one
+        try:
+            created = create_user(email, hashed_password, full_name, country_code, whatsapp_number)
+        except DuplicateUserError as e:
+            return jsonify({'error': str(e)}), 400
+        user = {'id': created['id'], 'email': created['email'], 'name': created['full_name']}
 
-        print(f"User registered successfully: {email}")  # Debug log
+        logger.info("User registered successfully: %s", email)
 
         return jsonify({
             'user': user,
             'message': 'Registration successful'
         }), 201
 
-    except Exception as e:
-        print(f"Error during signup: {str(e)}")  # Debug log
+    except PasswordHasherBusy as e:
+        return hasher_busy_response(e)
+    except Exception:
+        logger.exception("Error during signup")
         return jsonify({'error': 'Internal server error'}), 500
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
 @app.route('/api/auth/login', methods=['POST'])
 def login():
@@ -112,40 +202,40 @@ def login():
         if not all([email, password]):
             return jsonify({'error': 'Missing required fields'}), 400
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
         # Find user
-        cursor.execute('SELECT * FROM users WHERE email = ?', (email,))
-        user = cursor.fetchone()
+        user = get_user_by_email(email)
 
-        print(f"Login attempt for user: {email}")  # Debug log
+        logger.debug("Login attempt for user: %s", email)
 
         # Check if user exists
         if not user:
-            print(f"User not found: {email}")  # Debug log
+            logger.info("Login for unknown user: %s", email)
             return jsonify({'error': 'Invalid email or password'}), 401
 
         # Verify password
         try:
-            stored_password = user['password']
-            if isinstance(stored_password, str):
-                stored_password = stored_password.encode('utf-8')
-            
-            is_valid = bcrypt.checkpw(password.encode('utf-8'), stored_password)
+            is_valid = check_password(password, user['password'])
             
             if not is_valid:
-                print(f"Invalid password for user: {email}")  # Debug log
+                logger.info("Invalid password for user: %s", email)
                 return jsonify({'error': 'Invalid email or password'}), 401
 
-        except Exception as e:
-            print(f"Password verification error: {str(e)}")  # Debug log
+        except PasswordHasherBusy:
+            raise
+        except Exception:
+            logger.exception("Password verification error")
             return jsonify({'error': 'Invalid email or password'}), 401
 
+        # Transparently upgrade hashes made with a different cost factor
+        if needs_rehash(user['password']):
+            user_id = user['id']
+            rehash_in_background(password, lambda hashed: update_user_password(user_id, hashed))
+
         # Generate token
         token = jwt.encode({
             'user_id': user['id'],
             'email': user['email'],
+            'name': user['full_name'],
             'exp': datetime.utcnow() + app.config['JWT_EXPIRATION_DELTA']
         }, app.config['SECRET_KEY'])
 
@@ -153,7 +243,7 @@ def login():
             'user': {
                 'id': user['id'],
                 'email': user['email'],
-                'name': user['name']
+                'name': user['full_name']
             },
             'message': 'Login successful'
         })
@@ -168,25 +258,37 @@ def login():
             max_age=86400  # 24 hours
         )
 
-        print(f"Login successful for user: {email}")  # Debug log
+        logger.debug("Login successful for user: %s", email)
         return response
 
-    except Exception as e:
-        print(f"Error during login: {str(e)}")  # Debug log
+    except PasswordHasherBusy as e:
+        return hasher_busy_response(e)
+    except Exception:
+        logger.exception("Error during login")
         return jsonify({'error': 'Internal server error'}), 500
-    finally:
-        if 'conn' in locals():
-            conn.close()
+
+@app.route('/api/auth/logout', methods=['POST'])
+def logout():
+    token = request.cookies.get('token')
+    if token:
+        token_cache.revoke(token)
+    response = jsonify({'message': 'Logout successful'})
+    response.delete_cookie('token', samesite='Strict')
+    return response
 
 # Tags endpoints
 @app.route('/api/tags', methods=['GET'])
 @token_required
+@conditional_get
 def get_user_tags(current_user):
     try:
         tags = get_tags(current_user['user_id'])
-        return jsonify({'tags': tags})
-    except Exception as e:
-        print(f"Error getting tags: {str(e)}")
+        return jsonify({
+            'tags': tags,
+            'total_contacts': get_contact_count(current_user['user_id'])
+        })
+    except Exception:
+        logger.exception("Error getting tags")
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/tags', methods=['POST'])
@@ -210,8 +312,8 @@ def create_user_tag(current_user):
                 'color': data.get('color', '#3490dc')
             }), 201
         return jsonify({'error': 'Failed to create tag'}), 500
-    except Exception as e:
-        print(f"Error creating tag: {str(e)}")
+    except Exception:
+        logger.exception("Error creating tag")
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/tags/<int:tag_id>', methods=['PUT'])
@@ -232,8 +334,8 @@ def update_user_tag(current_user, tag_id):
         if success:
             return jsonify({'message': 'Tag updated successfully'})
         return jsonify({'error': 'Tag not found'}), 404
-    except Exception as e:
-        print(f"Error updating tag: {str(e)}")
+    except Exception:
+        logger.exception("Error updating tag")
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/tags/<int:tag_id>', methods=['DELETE'])
@@ -244,19 +346,217 @@ def delete_user_tag(current_user, tag_id):
         if success:
             return jsonify({'message': 'Tag deleted successfully'})
         return jsonify({'error': 'Tag not found'}), 404
-    except Exception as e:
-        print(f"Error deleting tag: {str(e)}")
+    except Exception:
+        logger.exception("Error deleting tag")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/tags/<int:tag_id>/contacts', methods=['POST', 'DELETE'])
+@token_required
+def bulk_tag_contacts(current_user, tag_id):
+    try:
+        data = request.get_json(silent=True)
+        if not data or ('contact_ids' not in data and 'filter' not in data):
+            return jsonify({'error': 'contact_ids or filter is required'}), 400
+
+        contact_ids = data.get('contact_ids')
+        selection = {}
+        if contact_ids is not None:
+            if not isinstance(contact_ids, list) or not all(
+                    isinstance(contact_id, int) for contact_id in contact_ids):
+                return jsonify({'error': 'contact_ids must be a list of integers'}), 400
+            selection['contact_ids'] = contact_ids
+        else:
+            contact_filter = data.get('filter') or {}
+            if not isinstance(contact_filter, dict):
+                return jsonify({'error': 'filter must be an object'}), 400
+            search = contact_filter.get('search')
+            filter_tag_id = contact_filter.get('tag_id')
+            if (search is not None and not isinstance(search, str)) or \
+                    (filter_tag_id is not None and not isinstance(filter_tag_id, int)):
+                return jsonify({'error': 'Invalid filter'}), 400
+            selection['search'] = search
+            selection['filter_tag_id'] = filter_tag_id
+
+        apply = assign_tag if request.method == 'POST' else unassign_tag
+        changed = apply(tag_id, current_user['user_id'], **selection)
+        if changed is None:
+            return jsonify({'error': 'Tag not found'}), 404
+        return jsonify({'tag_id': tag_id, 'changed': changed})
+    except Exception:
+        logger.exception("Error bulk tagging contacts")
+        return jsonify({'error': 'Internal server error'}), 500
+
+# Audience endpoints
+@app.route('/api/audiences/resolve', methods=['POST'])
+@token_required
+def resolve_user_audience(current_user):
+    try:
+        data = request.get_json(silent=True)
+        if not data or not isinstance(data.get('expression'), str) or not data['expression'].strip():
+            return jsonify({'error': 'expression is required'}), 400
+
+        try:
+            audience = resolve_audience(current_user['user_id'], data['expression'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        if not data.get('include_ids', True):
+            return jsonify({'count': len(audience)})
+        return Response(stream_with_context(iter_audience_json(audience)), mimetype='application/json')
+    except Exception:
+        logger.exception("Error resolving audience")
+        return jsonify({'error': 'Internal server error'}), 500
+
+# Campaign endpoints
+@app.route('/api/campaigns', methods=['POST'])
+@token_required
+def create_user_campaign(current_user):
+    try:
+        data = request.get_json(silent=True)
+        if not data or not data.get('title') or not data.get('message'):
+            return jsonify({'error': 'title and message are required'}), 400
+
+        audience = data.get('audience')
+        contact_ids = data.get('contact_ids')
+        if (audience is None) == (contact_ids is None):
+            return jsonify({'error': 'Provide either audience or contact_ids'}), 400
+        if audience is not None and (not isinstance(audience, str) or not audience.strip()):
+            return jsonify({'error': 'audience must be a tag expression'}), 400
+        if contact_ids is not None and (not isinstance(contact_ids, list) or not all(
+                isinstance(contact_id, int) for contact_id in contact_ids)):
+            return jsonify({'error': 'contact_ids must be a list of integers'}), 400
+
+        try:
+            send_at = parse_send_at(data.get('send_at'))
+            campaign = create_campaign(
+                current_user['user_id'],
+                data['title'],
+                data['message'],
+                audience=audience,
+                contact_ids=contact_ids,
+                media_url=data.get('media_url'),
+                send_at=send_at
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+
+        if campaign:
+            return jsonify(campaign), 201
+        return jsonify({'error': 'Failed to create campaign'}), 500
+    except Exception:
+        logger.exception("Error creating campaign")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/campaigns', methods=['GET'])
+@token_required
+def get_user_campaigns(current_user):
+    try:
+        return jsonify({'campaigns': get_campaigns(current_user['user_id'])})
+    except Exception:
+        logger.exception("Error getting campaigns")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/campaigns/<int:campaign_id>', methods=['GET'])
+@token_required
+def get_user_campaign(current_user, campaign_id):
+    try:
+        campaign = get_campaign(campaign_id, current_user['user_id'])
+        if campaign:
+            return jsonify(campaign)
+        return jsonify({'error': 'Campaign not found'}), 404
+    except Exception:
+        logger.exception("Error getting campaign")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/campaigns/<int:campaign_id>/cancel', methods=['POST'])
+@token_required
+def cancel_user_campaign(current_user, campaign_id):
+    try:
+        if cancel_campaign(campaign_id, current_user['user_id']):
+            return jsonify({'message': 'Campaign cancelled'})
+        return jsonify({'error': 'Campaign not found or already finished'}), 404
+    except Exception:
+        logger.exception("Error cancelling campaign")
+        return jsonify({'error': 'Internal server error'}), 500
+
+# Report endpoints
+@app.route('/api/reports/summary', methods=['GET'])
+@token_required
+def get_report_summary(current_user):
+    try:
+        try:
+            start = parse_time(request.args.get('from'))
+            end = parse_time(request.args.get('to'))
+        except ValueError:
+            return jsonify({'error': 'from and to must be unix times or ISO 8601'}), 400
+        return jsonify(get_summary(current_user['user_id'], start, end))
+    except Exception:
+        logger.exception("Error getting report summary")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/reports/campaigns', methods=['GET'])
+@token_required
+def get_report_campaigns(current_user):
+    try:
+        return jsonify({'campaigns': get_campaign_reports(current_user['user_id'])})
+    except Exception:
+        logger.exception("Error getting campaign reports")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/reports/campaigns/<int:campaign_id>', methods=['GET'])
+@token_required
+def get_report_campaign(current_user, campaign_id):
+    try:
+        reports = get_campaign_reports(current_user['user_id'], campaign_id)
+        if reports:
+            return jsonify(reports[0])
+        return jsonify({'error': 'Campaign not found'}), 404
+    except Exception:
+        logger.exception("Error getting campaign report")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/reports/timeseries', methods=['GET'])
+@token_required
+def get_report_timeseries(current_user):
+    try:
+        try:
+            start = parse_time(request.args.get('from'))
+            end = parse_time(request.args.get('to'))
+        except ValueError:
+            return jsonify({'error': 'from and to must be unix times or ISO 8601'}), 400
+        try:
+            timeseries = get_timeseries(
+                current_user['user_id'],
+                granularity=request.args.get('granularity', 'day'),
+                start=start,
+                end=end,
+                campaign_id=request.args.get('campaign_id', type=int)
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if timeseries is None:
+            return jsonify({'error': 'Campaign not found'}), 404
+        return jsonify(timeseries)
+    except Exception:
+        logger.exception("Error getting report time series")
         return jsonify({'error': 'Internal server error'}), 500
 
 # Contacts endpoints
 @app.route('/api/contacts', methods=['GET'])
 @token_required
+@conditional_get
 def get_user_contacts(current_user):
     try:
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 20, type=int)
         search = request.args.get('search')
         tag_id = request.args.get('tag_id', type=int)
+        # ?after=<cursor> switches to keyset pagination; an empty value starts it
+        after = request.args.get('after')
+        # Cursor pages skip the COUNT(*) unless explicitly asked for
+        include_total = request.args.get(
+            'count', 'false' if after is not None else 'true'
+        ).lower() not in ('0', 'false', 'no')
         
         # Validate pagination parameters
         if page < 1:
@@ -264,29 +564,108 @@ def get_user_contacts(current_user):
         if per_page < 1 or per_page > 100:
             per_page = 20
             
-        result = get_contacts(
-            current_user['user_id'],
-            page=page,
-            per_page=per_page,
-            search=search,
-            tag_id=tag_id
-        )
+        try:
+            result = get_contacts(
+                current_user['user_id'],
+                page=page,
+                per_page=per_page,
+                search=search,
+                tag_id=tag_id,
+                after=after,
+                include_total=include_total,
+                # ?fields=name,email,tags returns only those (plus id and name)
+                fields=parse_contact_fields(request.args.get('fields'))
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         return jsonify(result)
-    except Exception as e:
-        print(f"Error getting contacts: {str(e)}")
+    except Exception:
+        logger.exception("Error getting contacts")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/contacts/lookup', methods=['GET'])
+@token_required
+def lookup_user_contact(current_user):
+    try:
+        number = request.args.get('number')
+        if not number:
+            return jsonify({'error': 'number is required'}), 400
+
+        contact = get_contact_by_phone(
+            current_user['user_id'], number, request.args.get('country_code')
+        )
+        if contact:
+            return jsonify(contact)
+        return jsonify({'error': 'Contact not found'}), 404
+    except Exception:
+        logger.exception("Error looking up contact")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/contacts/lookup', methods=['POST'])
+@token_required
+def lookup_user_contacts(current_user):
+    try:
+        data = request.get_json(silent=True)
+        numbers = data.get('numbers') if data else None
+        if not isinstance(numbers, list) or not all(isinstance(number, str) for number in numbers):
+            return jsonify({'error': 'numbers must be a list of strings'}), 400
+        if len(numbers) > 1000:
+            return jsonify({'error': 'At most 1000 numbers per lookup'}), 400
+
+        contacts = find_contacts_by_phone(
+            current_user['user_id'], numbers, data.get('country_code')
+        )
+        return jsonify({'results': [
+            {'number': number, 'contact': contacts[number]} for number in numbers
+        ]})
+    except Exception:
+        logger.exception("Error looking up contacts")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/contacts/batch-get', methods=['POST'])
+@token_required
+def batch_get_user_contacts(current_user):
+    try:
+        data = request.get_json(silent=True)
+        ids = data.get('ids') if data else None
+        if not isinstance(ids, list) or not all(isinstance(contact_id, int) for contact_id in ids):
+            return jsonify({'error': 'ids must be a list of integers'}), 400
+        if len(ids) > 5000:
+            return jsonify({'error': 'At most 5000 ids per request'}), 400
+        fields = data.get('fields')
+        if fields is not None and (not isinstance(fields, list) or
+                                   not all(isinstance(field, str) for field in fields)):
+            return jsonify({'error': 'fields must be a list of strings'}), 400
+
+        try:
+            contacts = get_contacts_by_ids(
+                current_user['user_id'], ids,
+                fields=parse_contact_fields(','.join(fields)) if fields else None
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        found = {contact['id'] for contact in contacts}
+        return jsonify({
+            'contacts': contacts,
+            'missing': [contact_id for contact_id in dict.fromkeys(ids) if contact_id not in found]
+        })
+    except Exception:
+        logger.exception("Error getting contacts by id")
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/contacts/<int:contact_id>', methods=['GET'])
 @token_required
+@conditional_get
 def get_user_contact(current_user, contact_id):
     try:
         contact = get_contact(contact_id, current_user['user_id'])
         if contact:
             return jsonify(contact)
         return jsonify({'error': 'Contact not found'}), 404
-    except Exception as e:
-        print(f"Error getting contact: {str(e)}")
+    except Exception:
+        logger.exception("Error getting contact")
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/contacts', methods=['POST'])
@@ -301,17 +680,20 @@ def create_user_contact(current_user):
         if data.get('whatsapp_number') and not data.get('country_code'):
             return jsonify({'error': 'Country code is required for WhatsApp number'}), 400
             
-        contact = create_contact(
-            current_user['user_id'],
-            data,
-            data.get('tag_ids', [])
-        )
+        try:
+            contact = create_contact(
+                current_user['user_id'],
+                data,
+                data.get('tag_ids', [])
+            )
+        except DuplicatePhoneError as e:
+            return jsonify({'error': str(e)}), 409
         
         if contact:
             return jsonify(contact), 201
         return jsonify({'error': 'Failed to create contact'}), 500
-    except Exception as e:
-        print(f"Error creating contact: {str(e)}")
+    except Exception:
+        logger.exception("Error creating contact")
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/contacts/<int:contact_id>', methods=['PUT'])
@@ -326,20 +708,76 @@ def update_user_contact(current_user, contact_id):
         if data.get('whatsapp_number') is not None and data.get('country_code') is None:
             return jsonify({'error': 'Country code is required for WhatsApp number'}), 400
             
-        contact = update_contact(
-            contact_id,
-            current_user['user_id'],
-            data,
-            data.get('tag_ids')
-        )
+        try:
+            contact = update_contact(
+                contact_id,
+                current_user['user_id'],
+                data,
+                data.get('tag_ids')
+            )
+        except DuplicatePhoneError as e:
+            return jsonify({'error': str(e)}), 409
         
         if contact:
             return jsonify(contact)
         return jsonify({'error': 'Contact not found'}), 404
-    except Exception as e:
-        print(f"Error updating contact: {str(e)}")
+    except Exception:
+        logger.exception("Error updating contact")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/contacts/import', methods=['POST'])
+@token_required
+def import_user_contacts(current_user):
+    try:
+        # Multipart uploads are spooled to disk by werkzeug; raw CSV bodies are
+        # copied straight from the request stream
+        if request.files:
+            upload = request.files.get('file') or next(iter(request.files.values()))
+            stream, filename = upload.stream, upload.filename
+        elif request.mimetype in ('text/csv', 'application/csv', 'text/plain'):
+            stream, filename = request.stream, request.args.get('filename')
+        else:
+            return jsonify({'error': 'CSV file is required'}), 400
+
+        job_id = start_import(current_user['user_id'], stream, filename)
+        return jsonify({'job_id': job_id, 'status': 'queued'}), 202
+    except Exception:
+        logger.exception("Error starting contact import")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/contacts/import/<int:job_id>', methods=['GET'])
+@token_required
+def get_contact_import(current_user, job_id):
+    try:
+        limit = request.args.get('limit', 100, type=int)
+        offset = request.args.get('offset', 0, type=int)
+        if limit < 1 or limit > 1000:
+            limit = 100
+        if offset < 0:
+            offset = 0
+
+        job = get_import_job(job_id, current_user['user_id'], limit=limit, offset=offset)
+        if job:
+            return jsonify(job)
+        return jsonify({'error': 'Import job not found'}), 404
+    except Exception:
+        logger.exception("Error getting import job")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/contacts/export', methods=['GET'])
+@token_required
+def export_user_contacts(current_user):
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in EXPORTERS:
+        return jsonify({'error': f'Unsupported format, use one of: {", ".join(EXPORTERS)}'}), 400
+
+    generate, mimetype = EXPORTERS[export_format]
+    return Response(
+        stream_with_context(generate(current_user['user_id'])),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=contacts.{export_format}'}
+    )
+
 @app.route('/api/contacts/<int:contact_id>', methods=['DELETE'])
 @token_required
 def delete_user_contact(current_user, contact_id):
@@ -348,8 +786,51 @@ def delete_user_contact(current_user, contact_id):
         if success:
             return jsonify({'message': 'Contact deleted successfully'})
         return jsonify({'error': 'Contact not found'}), 404
-    except Exception as e:
-        print(f"Error deleting contact: {str(e)}")
+    except Exception:
+        logger.exception("Error deleting contact")
+        return jsonify({'error': 'Internal server error'}), 500
+
+# Sync endpoint
+@app.route('/api/sync', methods=['GET'])
+@token_required
+def sync_user_data(current_user):
+    try:
+        limit = request.args.get('limit', SYNC_PAGE_SIZE, type=int)
+        if limit < 1 or limit > SYNC_MAX_PAGE_SIZE:
+            limit = SYNC_PAGE_SIZE
+
+        try:
+            changes = get_changes(current_user['user_id'], request.args.get('since') or None, limit)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(changes)
+    except Exception:
+        logger.exception("Error syncing data")
+        return jsonify({'error': 'Internal server error'}), 500
+
+# WhatsApp webhooks
+@app.route('/api/webhooks/whatsapp', methods=['GET'])
+def verify_whatsapp_webhook():
+    # Subscription handshake: echo the challenge if the token matches
+    if (request.args.get('hub.mode') == 'subscribe' and WHATSAPP_WEBHOOK_VERIFY_TOKEN
+            and request.args.get('hub.verify_token') == WHATSAPP_WEBHOOK_VERIFY_TOKEN):
+        return request.args.get('hub.challenge', ''), 200, {'Content-Type': 'text/plain'}
+    return jsonify({'error': 'Verification failed'}), 403
+
+@app.route('/api/webhooks/whatsapp', methods=['POST'])
+def receive_whatsapp_webhook():
+    try:
+        body = request.get_data()
+        if not verify_signature(body, request.headers.get('X-Hub-Signature-256')):
+            return jsonify({'error': 'Invalid signature'}), 401
+        if request.get_json(silent=True) is None:
+            return jsonify({'error': 'Invalid JSON'}), 400
+
+        # Only logged here; statuses are applied in the background
+        record_callback(body.decode('utf-8'))
+        return jsonify({'status': 'ok'})
+    except Exception:
+        logger.exception("Error recording WhatsApp webhook")
         return jsonify({'error': 'Internal server error'}), 500
 
 if __name__ == '__main__':
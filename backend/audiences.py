@@ -0,0 +1,349 @@
+import logging
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from decouple import config
+from db import get_tag_map, shard_router
+
+logger = logging.getLogger(__name__)
+
+# Users whose audience indexes stay in memory (per process)
+AUDIENCE_CACHE_USERS = config('AUDIENCE_CACHE_USERS', default=64, cast=int)
+# Change log entries kept for indexes catching up; older ones are pruned
+AUDIENCE_LOG_RETENTION = config('AUDIENCE_LOG_RETENTION', default=1000000, cast=int)
+
+CHUNK_BITS = 16
+CHUNK_BYTES = (1 << CHUNK_BITS) // 8
+_LOW_MASK = (1 << CHUNK_BITS) - 1
+_BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+
+class Bitmap:
+    """Set of contact ids stored as 65536-id chunks of bits.
+
+    Chunks with no members are not stored, so a tenant whose ids sit high
+    in the global id space costs nothing for the ids below it. Each chunk
+    is a Python int, which keeps AND/OR/ANDNOT and popcount in C.
+    """
+
+    __slots__ = ('chunks',)
+
+    def __init__(self, chunks=None):
+        self.chunks = chunks if chunks is not None else {}
+
+    @classmethod
+    def from_ids(cls, ids):
+        buffers = {}
+        for contact_id in ids:
+            high = contact_id >> CHUNK_BITS
+            buffer = buffers.get(high)
+            if buffer is None:
+                buffer = buffers[high] = bytearray(CHUNK_BYTES)
+            low = contact_id & _LOW_MASK
+            buffer[low >> 3] |= 1 << (low & 7)
+        return cls({high: int.from_bytes(buffer, 'little') for high, buffer in buffers.items()})
+
+    def add(self, contact_id):
+        high = contact_id >> CHUNK_BITS
+        self.chunks[high] = self.chunks.get(high, 0) | 1 << (contact_id & _LOW_MASK)
+
+    def discard(self, contact_id):
+        high = contact_id >> CHUNK_BITS
+        chunk = self.chunks.get(high, 0) & ~(1 << (contact_id & _LOW_MASK))
+        if chunk:
+            self.chunks[high] = chunk
+        else:
+            self.chunks.pop(high, None)
+
+    def __and__(self, other):
+        chunks = {}
+        for high, chunk in self.chunks.items():
+            chunk &= other.chunks.get(high, 0)
+            if chunk:
+                chunks[high] = chunk
+        return Bitmap(chunks)
+
+    def __or__(self, other):
+        chunks = dict(self.chunks)
+        for high, chunk in other.chunks.items():
+            chunks[high] = chunks.get(high, 0) | chunk
+        return Bitmap(chunks)
+
+    def __sub__(self, other):
+        chunks = {}
+        for high, chunk in self.chunks.items():
+            chunk &= ~other.chunks.get(high, 0)
+            if chunk:
+                chunks[high] = chunk
+        return Bitmap(chunks)
+
+    def __len__(self):
+        return sum(chunk.bit_count() for chunk in self.chunks.values())
+
+    def __iter__(self):
+        """Yield ids in ascending order"""
+        for high in sorted(self.chunks):
+            base = high << CHUNK_BITS
+            data = self.chunks[high].to_bytes(CHUNK_BYTES, 'little')
+            for index, byte in enumerate(data):
+                if byte:
+                    offset = base + (index << 3)
+                    for bit in _BYTE_BITS[byte]:
+                        yield offset + bit
+
+
+class AudienceIndex:
+    """One user's contacts and per-tag bitmaps, kept current from audience_changes"""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.contacts = Bitmap()
+        self.tags = {}
+        self.seq = None
+        self.lock = threading.Lock()
+
+    def refresh(self, conn):
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute('''
+            SELECT (SELECT MIN(seq) FROM audience_changes),
+                   (SELECT MAX(seq) FROM audience_changes)
+        ''')
+        min_seq, max_seq = cursor.fetchone()
+        if self.seq is None or (min_seq is not None and min_seq > self.seq + 1):
+            # First use, or the changes we still needed were pruned
+            self._load(conn)
+        elif max_seq is not None and max_seq > self.seq:
+            self._apply_changes(cursor, max_seq)
+        if min_seq is not None and max_seq - min_seq > 2 * AUDIENCE_LOG_RETENTION:
+            prune_audience_changes(conn, max_seq - AUDIENCE_LOG_RETENTION)
+
+    def _load(self, conn):
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        # One read transaction so the snapshot and the log position agree
+        cursor.execute('BEGIN')
+        try:
+            cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM audience_changes')
+            seq = cursor.fetchone()[0]
+            cursor.execute('''
+                SELECT c.id, ct.tag_id
+                FROM contacts c
+                LEFT JOIN contact_tags ct ON ct.contact_id = c.id
+                WHERE c.user_id = ?
+            ''', (self.user_id,))
+            contact_ids = []
+            tag_members = {}
+            last_id = None
+            while True:
+                rows = cursor.fetchmany(10000)
+                if not rows:
+                    break
+                for contact_id, tag_id in rows:
+                    if contact_id != last_id:
+                        contact_ids.append(contact_id)
+                        last_id = contact_id
+                    if tag_id is not None:
+                        members = tag_members.get(tag_id)
+                        if members is None:
+                            members = tag_members[tag_id] = []
+                        members.append(contact_id)
+        finally:
+            conn.rollback()
+        self.contacts = Bitmap.from_ids(contact_ids)
+        self.tags = {tag_id: Bitmap.from_ids(ids) for tag_id, ids in tag_members.items()}
+        self.seq = seq
+
+    def _apply_changes(self, cursor, max_seq):
+        cursor.execute('''
+            SELECT contact_id, tag_id, added FROM audience_changes
+            WHERE user_id = ? AND seq > ? AND seq <= ?
+            ORDER BY seq
+        ''', (self.user_id, self.seq, max_seq))
+        for contact_id, tag_id, added in cursor.fetchall():
+            if tag_id:
+                target = self.tags.get(tag_id)
+                if target is None:
+                    target = self.tags[tag_id] = Bitmap()
+            else:
+                target = self.contacts
+            if added:
+                target.add(contact_id)
+            else:
+                target.discard(contact_id)
+        self.seq = max_seq
+
+    def tag(self, tag_id):
+        return self.tags.get(tag_id) or Bitmap()
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _get_index(shard, user_id):
+    # Keyed by shard too: change log positions mean nothing in another file
+    key = (shard, user_id)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = AudienceIndex(user_id)
+        _indexes.move_to_end(key)
+        while len(_indexes) > AUDIENCE_CACHE_USERS:
+            _indexes.popitem(last=False)
+        return index
+
+
+def prune_audience_changes(conn, through_seq):
+    """Drop change log entries up to through_seq; indexes behind it reload"""
+    try:
+        conn.execute('DELETE FROM audience_changes WHERE seq <= ?', (through_seq,))
+        conn.commit()
+    except sqlite3.OperationalError as e:
+        # Busy writer; the next refresh tries again
+        conn.rollback()
+        logger.warning("Error pruning audience changes: %s", e)
+
+
+# Expressions
+
+_TOKEN_RE = re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+_KEYWORDS = {'AND', 'OR', 'NOT'}
+
+
+def tokenize(expression):
+    """Split an expression into ('(' | ')' | 'AND' | 'OR' | 'NOT' | 'TAG', value) tokens"""
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _TOKEN_RE.match(expression, position)
+        if not match:
+            raise ValueError(f'Invalid audience expression near position {position}')
+        position = match.end()
+        opening, closing, quoted, word = match.groups()
+        if opening:
+            tokens.append(('(', opening))
+        elif closing:
+            tokens.append((')', closing))
+        elif quoted is not None:
+            tokens.append(('TAG', re.sub(r'\\(.)', r'\1', quoted)))
+        elif word.upper() in _KEYWORDS:
+            tokens.append((word.upper(), word))
+        else:
+            tokens.append(('TAG', word))
+    return tokens
+
+
+def parse_expression(expression):
+    """Parse e.g. '(vip OR lead) AND NOT unsubscribed' into a nested tuple tree
+
+    Nodes are ('tag', name), ('not', node), ('and', left, right) and
+    ('or', left, right). NOT binds tighter than AND, which binds tighter
+    than OR. Tag names containing spaces or keywords go in double quotes.
+    """
+    tokens = tokenize(expression)
+    position = 0
+
+    def peek():
+        return tokens[position][0] if position < len(tokens) else None
+
+    def take(kind):
+        nonlocal position
+        if peek() != kind:
+            found = tokens[position][1] if position < len(tokens) else 'end of expression'
+            raise ValueError(f'Expected {kind} in audience expression, found {found!r}')
+        position += 1
+        return tokens[position - 1][1]
+
+    def parse_or():
+        node = parse_and()
+        while peek() == 'OR':
+            take('OR')
+            node = ('or', node, parse_and())
+        return node
+
+    def parse_and():
+        node = parse_not()
+        while peek() == 'AND':
+            take('AND')
+            node = ('and', node, parse_not())
+        return node
+
+    def parse_not():
+        if peek() == 'NOT':
+            take('NOT')
+            return ('not', parse_not())
+        if peek() == '(':
+            take('(')
+            node = parse_or()
+            take(')')
+            return node
+        return ('tag', take('TAG'))
+
+    if not tokens:
+        raise ValueError('Audience expression is empty')
+    tree = parse_or()
+    if position != len(tokens):
+        raise ValueError(f'Unexpected {tokens[position][1]!r} in audience expression')
+    return tree
+
+
+def _tag_names(tree):
+    if tree[0] == 'tag':
+        yield tree[1]
+    else:
+        for child in tree[1:]:
+            yield from _tag_names(child)
+
+
+def _evaluate(tree, index, tag_ids):
+    kind = tree[0]
+    if kind == 'tag':
+        return index.tag(tag_ids[tree[1]])
+    if kind == 'not':
+        return index.contacts - _evaluate(tree[1], index, tag_ids)
+    left = _evaluate(tree[1], index, tag_ids)
+    right = _evaluate(tree[2], index, tag_ids)
+    return left & right if kind == 'and' else left | right
+
+
+def resolve_audience(user_id, expression):
+    """Evaluate a tag expression over a user's contacts; returns a Bitmap of contact ids
+
+    Raises ValueError for malformed expressions or unknown tag names.
+    """
+    tree = parse_expression(expression)
+    names = set(_tag_names(tree))
+    shard = shard_router.shard_for(user_id)
+    index = _get_index(shard, user_id)
+    with shard_router.pool(shard).connection() as conn:
+        cursor = conn.cursor()
+        tag_ids = {tag['name']: tag_id for tag_id, tag in get_tag_map(cursor, user_id).items()}
+        if not names.issubset(tag_ids):
+            tag_ids = {tag['name']: tag_id
+                       for tag_id, tag in get_tag_map(cursor, user_id, refresh=True).items()}
+        missing = sorted(names.difference(tag_ids))
+        if missing:
+            raise ValueError(f'Unknown tag: {missing[0]}')
+
+        with index.lock:
+            index.refresh(conn)
+            return _evaluate(tree, index, tag_ids)
+
+
+def iter_audience_json(audience, batch_size=10000):
+    """Yield {"count": n, "ids": [...]} as JSON text, a batch of ids at a time"""
+    yield '{"count": %d, "ids": [' % len(audience)
+    batch = []
+    separator = ''
+    for contact_id in audience:
+        batch.append(contact_id)
+        if len(batch) >= batch_size:
+            yield separator + ','.join(map(str, batch))
+            separator = ','
+            batch = []
+    if batch:
+        yield separator + ','.join(map(str, batch))
+    yield ']}'
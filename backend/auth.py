@@ -0,0 +1,121 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+import jwt
+
+
+class UserContext:
+    """Verified identity of the user making the current request"""
+
+    __slots__ = ('user_id', 'email', 'name', 'exp', 'token_digest')
+
+    def __init__(self, claims, token_digest):
+        self.user_id = claims['user_id']
+        self.email = claims.get('email')
+        self.name = claims.get('name')
+        self.exp = claims.get('exp')
+        self.token_digest = token_digest
+
+    def __getitem__(self, key):
+        # Handlers read current_user['user_id'] like the decoded claims dict
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+
+def token_digest(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class TokenCache:
+    """Bounded LRU cache of verified JWTs keyed by token digest.
+
+    Entries expire after ``ttl`` seconds or at the token's own ``exp``,
+    whichever comes first. Revoked digests are remembered until their token
+    would have expired anyway, and are evicted from the cache immediately.
+    At most ``max_revoked`` revocations are kept; the oldest go first.
+    """
+
+    def __init__(self, secret, algorithms=('HS256',), maxsize=10000, ttl=300.0, max_revoked=100000):
+        self.secret = secret
+        self.algorithms = list(algorithms)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_revoked = max_revoked
+        self._entries = OrderedDict()
+        self._revoked = OrderedDict()
+        self._lock = threading.Lock()
+
+    def verify(self, token):
+        """Return a UserContext for token, raising jwt.InvalidTokenError if invalid"""
+        digest = token_digest(token)
+        now = time.time()
+        with self._lock:
+            if digest in self._revoked:
+                raise jwt.InvalidTokenError('Token has been revoked')
+            entry = self._entries.get(digest)
+            if entry is not None:
+                user, expires_at = entry
+                if now < expires_at:
+                    self._entries.move_to_end(digest)
+                    return user
+                del self._entries[digest]
+
+        claims = jwt.decode(token, self.secret, algorithms=self.algorithms)
+        user = UserContext(claims, digest)
+        expires_at = now + self.ttl
+        if user.exp is not None:
+            expires_at = min(expires_at, user.exp)
+
+        with self._lock:
+            # A revoke may have raced with the decode above
+            if digest in self._revoked:
+                raise jwt.InvalidTokenError('Token has been revoked')
+            self._entries[digest] = (user, expires_at)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return user
+
+    def revoke(self, token):
+        """Reject token from now on and drop it from the cache
+
+        Only tokens signed with our secret are remembered, so anonymous callers
+        cannot fill the revocation list with forged ones.
+        """
+        try:
+            claims = jwt.decode(token, self.secret, algorithms=self.algorithms,
+                                options={'verify_exp': False})
+        except jwt.InvalidTokenError:
+            return
+        exp = claims.get('exp', float('inf'))
+        if isinstance(exp, bool) or not isinstance(exp, (int, float)):
+            return
+        digest = token_digest(token)
+        with self._lock:
+            self._entries.pop(digest, None)
+            self._prune_revoked()
+            if exp <= time.time():
+                # Already rejected by its own exp
+                return
+            # Tokens without exp never expire, so neither does their revocation
+            self._revoked[digest] = exp
+            self._revoked.move_to_end(digest)
+            while len(self._revoked) > self.max_revoked:
+                self._revoked.popitem(last=False)
+
+    def evict_user(self, user_id):
+        """Drop every cached token of a user, forcing them to be re-verified"""
+        with self._lock:
+            for digest in [d for d, (user, _) in self._entries.items() if user.user_id == user_id]:
+                del self._entries[digest]
+
+    def _prune_revoked(self):
+        now = time.time()
+        for digest in [d for d, exp in self._revoked.items() if exp <= now]:
+            del self._revoked[digest]
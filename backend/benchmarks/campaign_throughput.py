@@ -0,0 +1,126 @@
+"""Campaign pipeline throughput benchmark.
+
+Seeds a tenant, points the pipeline at a local WhatsApp stub and sends one
+campaign to every contact (or to a tag expression), then reports sustained
+send rate and end-to-end queue lag percentiles as JSON.
+
+    python benchmarks/campaign_throughput.py --contacts 10k --workers 8 --rate 200
+    python benchmarks/campaign_throughput.py --audience "vip OR lead" --failure-rate 0.05
+
+Point DATABASE_PATH at a scratch file: the run recreates the database.
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+if 'DATABASE_PATH' not in os.environ:
+    os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='bench-'), 'bench.sqlite')
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run(args):
+    from benchmarks.run import reset_database
+    from benchmarks.whatsapp_stub import start_stub
+
+    stub = start_stub(latency_ms=args.latency_ms, failure_rate=args.failure_rate,
+                      rate_limit=args.stub_rate_limit, seed=args.seed)
+    # Pipeline settings are read at import time
+    os.environ['WHATSAPP_API_URL'] = f'http://127.0.0.1:{stub.server_port}'
+    os.environ['SEND_RATE_PER_NUMBER'] = str(args.rate)
+    os.environ['SEND_BURST_PER_NUMBER'] = str(max(1, int(args.rate)))
+    os.environ['CAMPAIGN_RETRY_BASE'] = str(args.retry_base)
+    os.environ['CAMPAIGN_WORKERS'] = '0'
+    reset_database(os.environ['DATABASE_PATH'])
+
+    import db
+    import campaigns
+    from benchmarks import datagen
+
+    db.init_db()
+    tenant = datagen.generate_tenant(0, datagen.parse_size(args.contacts), seed=args.seed)
+    first_id, last_id = tenant['contact_ids']
+    campaign = campaigns.create_campaign(
+        tenant['id'], 'Benchmark campaign', 'Hello from the benchmark',
+        audience=args.audience,
+        contact_ids=None if args.audience else list(range(first_id, last_id + 1)),
+    )
+
+    started = time.time()
+    campaigns.start_workers(args.workers)
+    while True:
+        campaign = campaigns.get_campaign(campaign['id'], tenant['id'])
+        if campaign['status'] not in ('scheduled', 'sending') or time.time() - started > args.timeout:
+            break
+        print(f"  {campaign['status']}: {campaign['messages']} lag={campaign['queue_lag_seconds']}s",
+              file=sys.stderr)
+        time.sleep(1.0)
+    elapsed = time.time() - started
+    campaigns.stop_workers()
+
+    with db.db_connection(tenant['id']) as conn:
+        lags = sorted(
+            row['lag'] for row in conn.execute(
+                "SELECT sent_at - enqueued_at AS lag FROM campaign_messages "
+                "WHERE campaign_id = ? AND status = 'sent'", (campaign['id'],)
+            ).fetchall()
+        )
+    campaign = campaigns.get_campaign(campaign['id'], tenant['id'])
+    sent = campaign['messages'].get('sent', 0)
+    with stub.state.lock:
+        stub_stats = dict(stub.state.stats)
+    stub.shutdown()
+    return {
+        'contacts': tenant['contacts'],
+        'audience': args.audience,
+        'workers': args.workers,
+        'rate_per_number': args.rate,
+        'status': campaign['status'],
+        'messages': campaign['messages'],
+        'elapsed_s': round(elapsed, 2),
+        'throughput_mps': round(sent / elapsed, 1) if elapsed else None,
+        'lag_p50_s': percentile(lags, 50),
+        'lag_p95_s': percentile(lags, 95),
+        'lag_p99_s': percentile(lags, 99),
+        'stub': stub_stats,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--contacts', default='1k', help='tenant size, e.g. 1k 10k 100k')
+    parser.add_argument('--audience', help='tag expression; default is every contact')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=80.0, help='messages per second per sending number')
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='stub API latency')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='stub 503 rate')
+    parser.add_argument('--stub-rate-limit', type=int, help='stub 429s above this many sends per second')
+    parser.add_argument('--retry-base', type=float, default=0.2, help='first retry delay in seconds')
+    parser.add_argument('--timeout', type=float, default=600.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write JSON results here')
+    args = parser.parse_args(argv)
+    # Logs go to stderr, but db.py still prints its startup messages; keep stdout for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        results = json.dumps(run(args), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(results + '\n')
+    print(results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
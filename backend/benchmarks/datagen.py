@@ -0,0 +1,132 @@
+"""Seeded synthetic tenant generator for benchmarks.
+
+Writes users, tags and contacts straight into the configured SQLite
+database (each tenant's shard; see shards.py) in large batches. The same seed always produces
+the same data, so runs against different versions are comparable.
+"""
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bcrypt
+from db import create_user, db_connection
+from phones import to_e164
+
+SIZES = {'1k': 1000, '10k': 10000, '100k': 100000, '1m': 1000000}
+
+BENCH_PASSWORD = 'benchmark-password'
+
+FIRST_NAMES = [
+    'Aarav', 'Aisha', 'Alex', 'Ana', 'Arjun', 'Ben', 'Carlos', 'Chen', 'Diya', 'Elena',
+    'Emma', 'Fatima', 'Grace', 'Hana', 'Ivan', 'Jia', 'Jose', 'Kavya', 'Liam', 'Maria',
+    'Mohammed', 'Noah', 'Olivia', 'Priya', 'Rahul', 'Sara', 'Sofia', 'Wei', 'Yusuf', 'Zoe',
+]
+LAST_NAMES = [
+    'Ali', 'Brown', 'Chen', 'Das', 'Garcia', 'Gupta', 'Ivanov', 'Khan', 'Kim', 'Lee',
+    'Lopez', 'Martin', 'Nair', 'Nguyen', 'Patel', 'Reddy', 'Rossi', 'Sato', 'Sharma', 'Silva',
+    'Singh', 'Smith', 'Taylor', 'Wang', 'Williams', 'Wong', 'Yadav', 'Zhang',
+]
+COMPANIES = ['Acme', 'Globex', 'Initech', 'Umbrella', 'Stark', 'Wayne', 'Hooli', 'Vandelay', None, None]
+TAG_NAMES = [
+    'lead', 'customer', 'vip', 'newsletter', 'unsubscribed', 'prospect', 'partner', 'churned',
+    'trial', 'enterprise', 'smb', 'event-2025', 'webinar', 'referral', 'india', 'usa', 'uk',
+    'uae', 'high-value', 'inactive',
+]
+COUNTRY_CODES = ['+91', '+91', '+91', '+1', '+44', '+971', '+65']
+
+# Contacts carry 0-4 tags; tag popularity follows a Zipf-like curve
+TAGS_PER_CONTACT = [0, 1, 2, 3, 4]
+TAGS_PER_CONTACT_WEIGHTS = [30, 35, 20, 10, 5]
+
+BATCH_SIZE = 10000
+
+
+def parse_size(value):
+    """Accept 1k/100k/1m style names or a plain integer"""
+    value = str(value).lower()
+    return SIZES[value] if value in SIZES else int(value)
+
+
+def _password_hash():
+    return bcrypt.hashpw(BENCH_PASSWORD.encode('utf-8'), bcrypt.gensalt(
+        int(os.environ.get('BCRYPT_ROUNDS', 12))
+    ))
+
+
+def generate_tenant(index, n_contacts, seed=0, n_tags=len(TAG_NAMES), password_hash=None):
+    """Create one tenant user with n_contacts contacts; returns the user dict"""
+    rng = random.Random(f'{seed}-{index}')
+    email = f'bench-tenant-{index}@example.com'
+    user_id = create_user(
+        email, password_hash or _password_hash(), f'Bench Tenant {index}', '+91', f'90000{index:05d}'
+    )['id']
+    with db_connection(user_id) as conn:
+        cursor = conn.cursor()
+
+        tag_names = TAG_NAMES[:n_tags]
+        cursor.executemany(
+            'INSERT INTO tags (user_id, name) VALUES (?, ?)',
+            [(user_id, name) for name in tag_names]
+        )
+        cursor.execute('SELECT id FROM tags WHERE user_id = ? ORDER BY id', (user_id,))
+        tag_ids = [row['id'] for row in cursor.fetchall()]
+        tag_weights = [1.0 / (rank + 1) for rank in range(len(tag_ids))]
+        conn.commit()
+
+        # Random numbers can repeat; like the app, only the first keeps its E.164 key
+        seen_numbers = set()
+
+        # Continue the shard's id sequence (shards start theirs at an offset)
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'contacts'")
+        row = cursor.fetchone()
+        first_id = next_id = (row['seq'] if row else 0) + 1
+
+        for start in range(0, n_contacts, BATCH_SIZE):
+            contacts = []
+            links = []
+            for i in range(start, min(start + BATCH_SIZE, n_contacts)):
+                first = rng.choice(FIRST_NAMES)
+                last = rng.choice(LAST_NAMES)
+                country_code = rng.choice(COUNTRY_CODES)
+                number = str(rng.randrange(6000000000, 9999999999))
+                e164 = to_e164(country_code, number)
+                if e164 in seen_numbers:
+                    e164 = None
+                seen_numbers.add(e164)
+                contacts.append((
+                    next_id, user_id, f'{first} {last}',
+                    f'{first}.{last}{i}@example.com'.lower(),
+                    f'{country_code} {number[:5]} {number[5:]}' if rng.random() < 0.3 else None,
+                    country_code, number, rng.choice(COMPANIES),
+                    'Generated for benchmarks' if rng.random() < 0.1 else None,
+                    e164,
+                ))
+                count = rng.choices(TAGS_PER_CONTACT, TAGS_PER_CONTACT_WEIGHTS)[0]
+                chosen = set(rng.choices(tag_ids, tag_weights, k=count)) if count else ()
+                links.extend((next_id, tag_id) for tag_id in chosen)
+                next_id += 1
+
+            cursor.executemany(
+                '''INSERT INTO contacts (
+                    id, user_id, name, email, phone, country_code, whatsapp_number, company, notes,
+                    phone_e164
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                contacts
+            )
+            cursor.executemany('INSERT INTO contact_tags (contact_id, tag_id) VALUES (?, ?)', links)
+            conn.commit()
+
+        cursor.execute('ANALYZE')
+        return {'id': user_id, 'email': email, 'password': BENCH_PASSWORD,
+                'contacts': n_contacts, 'contact_ids': (first_id, next_id - 1), 'tag_ids': tag_ids}
+
+
+def generate(sizes, seed=0):
+    """Create one tenant per entry in sizes; returns the tenant dicts"""
+    password_hash = _password_hash()
+    return [
+        generate_tenant(index, parse_size(size), seed=seed, password_hash=password_hash)
+        for index, size in enumerate(sizes)
+    ]
@@ -0,0 +1,366 @@
+"""Endpoint benchmark driver.
+
+Seeds a fresh database with synthetic tenants, then drives the Flask app
+either through the test client or a real local HTTP server and reports
+p50/p95/p99 latency, throughput and peak RSS per scenario as JSON.
+
+    python benchmarks/run.py --sizes 1k 100k --duration 5 --output before.json
+    python benchmarks/run.py --mode server --concurrency 8 --output after.json
+    python benchmarks/run.py compare before.json after.json
+
+Point DATABASE_PATH at a scratch file: the run recreates the database.
+"""
+import argparse
+import contextlib
+import http.client
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+if 'DATABASE_PATH' not in os.environ:
+    os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='bench-'), 'bench.sqlite')
+
+
+class TestClientSession:
+    """Session backed by the Flask test client (no sockets)"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        return response.status_code, response.get_data()
+
+
+class HttpSession:
+    """Keep-alive HTTP session against a local server"""
+
+    def __init__(self, host, port):
+        self.conn = http.client.HTTPConnection(host, port, timeout=60)
+        self.cookie = None
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        self.conn.request(method, path, body=payload, headers=headers)
+        response = self.conn.getresponse()
+        data = response.read()
+        set_cookie = response.getheader('Set-Cookie')
+        if set_cookie and set_cookie.startswith('token='):
+            self.cookie = set_cookie.split(';', 1)[0]
+        return response.status, data
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+# Unique suffixes for signup emails/numbers across every tenant and thread
+_signup_ids = itertools.count(1)
+# Numbers for contacts created by the CRUD scenario; below every generated one
+_crud_numbers = itertools.count(1)
+
+SEARCH_TERMS = ['sha', 'Priya', 'acme', 'Kim Lee', '98765', '+91 9']
+
+# What the contacts list view shows
+LIST_FIELDS = 'name,email,phone,company,avatar_url,created_at,tags'
+
+
+class Scenario:
+    """One benchmarked operation; run(session, rng) returns an HTTP status"""
+
+    def __init__(self, name, run, needs_login=True):
+        self.name = name
+        self.run = run
+        self.needs_login = needs_login
+
+
+def build_scenarios(tenant, per_page=20):
+    from db import encode_cursor
+
+    tag_ids = tenant['tag_ids']
+    first_id, last_id = tenant['contact_ids']
+    last_page = max(1, tenant['contacts'] // per_page)
+    # Seeds past every name starting before 'Z', i.e. near the end of the list
+    deep_cursor = encode_cursor({'name': 'Z', 'id': 0})
+
+    def get(path):
+        return lambda session, rng: session.request('GET', path(rng) if callable(path) else path)[0]
+
+    def signup(session, rng):
+        n = next(_signup_ids)
+        return session.request('POST', '/api/auth/signup', {
+            'email': f'bench-signup-{os.getpid()}-{n}@example.com',
+            'password': 'benchmark-password',
+            'fullName': 'Bench Signup',
+            'countryCode': '+1',
+            'whatsappNumber': f'{os.getpid()}{n:08d}',
+        })[0]
+
+    def login(session, rng):
+        return session.request('POST', '/api/auth/login',
+                               {'email': tenant['email'], 'password': tenant['password']})[0]
+
+    def contact_crud(session, rng):
+        status, data = session.request('POST', '/api/contacts', {
+            'name': f'Bench Contact {rng.random()}', 'email': 'crud@example.com',
+            'country_code': '+1', 'whatsapp_number': f'555{next(_crud_numbers):07d}', 'tag_ids': tag_ids[:2],
+        })
+        if status != 201:
+            return status
+        path = f"/api/contacts/{json.loads(data)['id']}"
+        for method, body in (('GET', None), ('PUT', {'notes': 'updated', 'tag_ids': tag_ids[1:3]}),
+                             ('DELETE', None)):
+            status = session.request(method, path, body)[0]
+            if status >= 400:
+                return status
+        return status
+
+    def contact_update(session, rng):
+        return session.request('PUT', f'/api/contacts/{rng.randint(first_id, last_id)}', {
+            'notes': f'updated {rng.random()}', 'tag_ids': rng.sample(tag_ids, 2),
+        })[0]
+
+    return [
+        Scenario('signup', signup, needs_login=False),
+        Scenario('login', login, needs_login=False),
+        Scenario('tags', get('/api/tags')),
+        Scenario('contacts_page1', get(f'/api/contacts?per_page={per_page}')),
+        Scenario('contacts_page100', get('/api/contacts?per_page=100&page=2')),
+        Scenario('contacts_page100_fields', get(f'/api/contacts?per_page=100&page=2&fields={LIST_FIELDS}')),
+        Scenario('contacts_deep_offset', get(lambda rng: (
+            f'/api/contacts?per_page={per_page}&page={rng.randint(max(1, last_page - 50), last_page)}'))),
+        Scenario('contacts_deep_cursor', get(f'/api/contacts?per_page={per_page}&after={deep_cursor}')),
+        Scenario('contacts_search', get(lambda rng: (
+            f'/api/contacts?per_page={per_page}&search={rng.choice(SEARCH_TERMS)}'))),
+        Scenario('contacts_tag_filter', get(lambda rng: (
+            f'/api/contacts?per_page={per_page}&tag_id={rng.choice(tag_ids)}'))),
+        Scenario('contact_get', get(lambda rng: f'/api/contacts/{rng.randint(first_id, last_id)}')),
+        Scenario('contact_update', contact_update),
+        Scenario('contact_crud', contact_crud),
+    ]
+
+
+def run_scenario(scenario, make_session, tenant, concurrency, duration, max_requests, seed):
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    remaining = [max_requests]
+
+    def worker(worker_id):
+        rng = random.Random(f'{seed}-{scenario.name}-{worker_id}')
+        session = make_session()
+        if scenario.needs_login:
+            session.request('POST', '/api/auth/login',
+                            {'email': tenant['email'], 'password': tenant['password']})
+        local = []
+        local_statuses = {}
+        while time.perf_counter() < deadline:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            start = time.perf_counter()
+            try:
+                status = scenario.run(session, rng)
+            except Exception:
+                status = 'exception'
+            local.append(time.perf_counter() - start)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+        with lock:
+            latencies.extend(local)
+            for status, count in local_statuses.items():
+                statuses[str(status)] = statuses.get(str(status), 0) + count
+
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    latencies.sort()
+    ms = lambda value: None if value is None else round(value * 1000, 3)
+    errors = sum(count for status, count in statuses.items()
+                 if not (status.isdigit() and int(status) < 400))
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'statuses': statuses,
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        # Whole process (client and server in client mode), so compare runs like for like
+        'cpu_ms_per_request': ms(cpu / len(latencies)) if latencies else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def start_server(app):
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def reset_database(path):
+    # The app migrates existing databases in place, so start from an empty file
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    shutil.rmtree(os.environ.get('SHARD_DIR', os.path.join(os.path.dirname(path), 'shards')),
+                  ignore_errors=True)
+
+
+def run(args):
+    reset_database(os.environ['DATABASE_PATH'])
+    # Importing the app migrates the fresh database; seed data afterwards
+    import app as app_module
+    from benchmarks import datagen
+
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'mode': args.mode,
+            'concurrency': args.concurrency,
+            'duration_s': args.duration,
+            'seed': args.seed,
+        },
+        'tenants': {},
+    }
+
+    for size in args.sizes:
+        print(f"Generating tenant with {size} contacts...", file=sys.stderr)
+        started = time.perf_counter()
+        tenant = datagen.generate_tenant(len(results['tenants']), datagen.parse_size(size), seed=args.seed)
+        generated_in = round(time.perf_counter() - started, 2)
+
+        server = None
+        if args.mode == 'server':
+            server = start_server(app_module.app)
+            make_session = lambda: HttpSession('127.0.0.1', server.server_port)
+        else:
+            make_session = lambda: TestClientSession(app_module.app)
+
+        scenarios = {}
+        try:
+            for scenario in build_scenarios(tenant):
+                if args.scenarios and scenario.name not in args.scenarios:
+                    continue
+                print(f"  {size}: {scenario.name}", file=sys.stderr)
+                scenarios[scenario.name] = run_scenario(
+                    scenario, make_session, tenant, args.concurrency,
+                    args.duration, args.max_requests, args.seed
+                )
+        finally:
+            if server:
+                server.shutdown()
+
+        results['tenants'][size] = {'contacts': tenant['contacts'], 'generated_in_s': generated_in,
+                                    'scenarios': scenarios}
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    return output
+
+
+def compare(args):
+    """Print per-scenario deltas between two result files and flag regressions"""
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    regressions = 0
+    for size, tenant in candidate['tenants'].items():
+        base_tenant = baseline['tenants'].get(size, {}).get('scenarios', {})
+        for name, result in tenant['scenarios'].items():
+            base = base_tenant.get(name)
+            if not base:
+                continue
+            for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+                old, new = base.get(metric), result.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old * 100
+                worse = change < -args.threshold if metric == 'throughput_rps' else change > args.threshold
+                regressions += worse
+                print(f"{size:>6} {name:<24} {metric:<15} {old:>10} -> {new:>10} "
+                      f"({change:+.1f}%){'  REGRESSION' if worse else ''}")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == 'compare':
+        parser = argparse.ArgumentParser(prog='run.py compare')
+        parser.add_argument('baseline')
+        parser.add_argument('candidate')
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help='percent change counted as a regression')
+        return compare(parser.parse_args(argv[1:]))
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', nargs='+', default=['1k'], help='tenant sizes, e.g. 1k 100k 1m')
+    parser.add_argument('--mode', choices=['client', 'server'], default='client')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per scenario')
+    parser.add_argument('--max-requests', type=int, default=100000, help='request cap per scenario')
+    parser.add_argument('--scenarios', nargs='*', help='only run these scenarios')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write JSON results here')
+    args = parser.parse_args(argv)
+    # Logs go to stderr, but db.py still prints its startup messages; keep stdout for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run(args)
+    print(results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
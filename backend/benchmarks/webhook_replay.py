@@ -0,0 +1,246 @@
+"""WhatsApp status webhook replay benchmark.
+
+Seeds a tenant with one sent campaign, then replays status callbacks
+(sent/delivered/read/failed, shuffled and with redelivered duplicates, as
+the Cloud API sends them) at POST /api/webhooks/whatsapp over local HTTP.
+Reports the ack rate and latency, how long the applier takes to drain the
+log, and checks every message ends on its furthest status. Output is JSON.
+
+    python benchmarks/webhook_replay.py --messages 10k --concurrency 16
+    python benchmarks/webhook_replay.py --file callbacks.ndjson
+
+--file replays captured callback bodies, one JSON object per line (e.g.
+``SELECT body FROM webhook_events``); the message ids they mention are
+seeded first so they all match. Point DATABASE_PATH at a scratch file: the
+run recreates the database.
+"""
+import argparse
+import contextlib
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+if 'DATABASE_PATH' not in os.environ:
+    os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='bench-'), 'bench.sqlite')
+
+APP_SECRET = 'webhook-replay'
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def callback(statuses):
+    """A Cloud API callback body carrying statuses"""
+    return {
+        'object': 'whatsapp_business_account',
+        'entry': [{
+            'id': 'benchmark',
+            'changes': [{'field': 'messages', 'value': {
+                'messaging_product': 'whatsapp',
+                'statuses': statuses,
+            }}],
+        }],
+    }
+
+
+def generate_callbacks(message_ids, rng, read_rate, failure_rate, duplicate_rate, per_callback):
+    """Shuffled callbacks for each message's status progression, with duplicates"""
+    statuses = []
+    now = int(time.time())
+    for message_id in message_ids:
+        if rng.random() < failure_rate:
+            progression = ['sent', 'failed']
+        elif rng.random() < read_rate:
+            progression = ['sent', 'delivered', 'read']
+        else:
+            progression = ['sent', 'delivered']
+        for offset, status in enumerate(progression):
+            entry = {'id': message_id, 'status': status, 'timestamp': str(now + offset),
+                     'recipient_id': '15550000000'}
+            if status == 'failed':
+                entry['errors'] = [{'code': 131026, 'title': 'Message undeliverable'}]
+            statuses.append(entry)
+            if rng.random() < duplicate_rate:
+                statuses.append(dict(entry))
+    rng.shuffle(statuses)
+    return [callback(statuses[i:i + per_callback]) for i in range(0, len(statuses), per_callback)]
+
+
+def signature(body):
+    """X-Hub-Signature-256 for a body as HttpSession sends it"""
+    digest = hmac.new(APP_SECRET.encode('utf-8'), json.dumps(body).encode('utf-8'), hashlib.sha256)
+    return 'sha256=' + digest.hexdigest()
+
+
+def expected_statuses(bodies):
+    """Message id -> status the applier should settle on"""
+    from webhooks import STATUS_RANKS, parse_statuses
+    expected = {}
+    for body in bodies:
+        for message_id, status, _, _ in parse_statuses(json.dumps(body)):
+            if STATUS_RANKS[status] > STATUS_RANKS.get(expected.get(message_id), 0):
+                expected[message_id] = status
+    return expected
+
+
+def seed_messages(tenant, message_ids):
+    """One completed campaign whose messages carry the given provider ids"""
+    import campaigns
+    import db
+    import webhooks
+    first_id, _ = tenant['contact_ids']
+    campaign = campaigns.create_campaign(tenant['id'], 'Webhook replay', 'Hello from the benchmark',
+                                         contact_ids=[first_id])
+    now = time.time()
+    with db.db_connection(tenant['id']) as conn:
+        conn.execute("UPDATE campaigns SET status = 'completed' WHERE id = ?", (campaign['id'],))
+        conn.executemany('''
+            INSERT INTO campaign_messages (
+                campaign_id, contact_id, to_number, status, attempts, next_attempt_at,
+                idempotency_key, provider_message_id, enqueued_at, sent_at
+            ) VALUES (?, ?, '+15550000000', 'sent', 1, ?, ?, ?, ?, ?)
+        ''', [(campaign['id'], index, now, f"replay-{campaign['id']}-{index}", message_id, now, now)
+              for index, message_id in enumerate(message_ids, start=1)])
+        conn.commit()
+    webhooks.record_routes([(message_id, tenant['id'], now) for message_id in message_ids])
+    return campaign
+
+
+def run(args):
+    from benchmarks.run import HttpSession, reset_database, start_server
+    from benchmarks import datagen
+
+    os.environ['CAMPAIGN_WORKERS'] = '0'
+    os.environ['WHATSAPP_APP_SECRET'] = APP_SECRET
+    reset_database(os.environ['DATABASE_PATH'])
+
+    rng = random.Random(args.seed)
+    if args.file:
+        with open(args.file) as f:
+            bodies = [json.loads(line) for line in f if line.strip()]
+    else:
+        message_ids = [f'wamid.replay.{i}' for i in range(datagen.parse_size(args.messages))]
+        bodies = generate_callbacks(message_ids, rng, args.read_rate, args.failure_rate,
+                                    args.duplicate_rate, args.statuses_per_callback)
+    expected = expected_statuses(bodies)
+
+    import db
+    import webhooks
+    from app import app
+
+    tenant = datagen.generate_tenant(0, 1, seed=args.seed)
+    campaign = seed_messages(tenant, list(expected))
+
+    server = start_server(app)
+    port = server.server_port
+    queue = list(bodies)
+    lock = threading.Lock()
+    latencies = []
+    errors = []
+
+    def worker():
+        session = HttpSession('127.0.0.1', port)
+        while True:
+            with lock:
+                if not queue:
+                    return
+                body = queue.pop()
+            start = time.perf_counter()
+            status, _ = session.request('POST', '/api/webhooks/whatsapp', body,
+                                        {'X-Hub-Signature-256': signature(body)})
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if status != 200:
+                    errors.append(status)
+
+    started = time.time()
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    acked = time.time() - started
+
+    # Drained once the applier's cursor reaches the last logged callback
+    while True:
+        with db.shard_router.catalog.connection() as conn:
+            row = conn.execute('''
+                SELECT (SELECT max(id) FROM webhook_events) AS logged,
+                       (SELECT last_id FROM webhook_cursors WHERE name = ?) AS applied
+            ''', (webhooks.CURSOR_NAME,)).fetchone()
+        if row['applied'] is not None and row['applied'] >= (row['logged'] or 0):
+            break
+        if time.time() - started > args.timeout:
+            break
+        time.sleep(0.05)
+    drained = time.time() - started
+    server.shutdown()
+    webhooks.stop_applier()
+
+    with db.db_connection(tenant['id']) as conn:
+        actual = {
+            row['provider_message_id']: row['delivery_status'] for row in conn.execute(
+                'SELECT provider_message_id, delivery_status FROM campaign_messages WHERE campaign_id = ?',
+                (campaign['id'],)
+            ).fetchall()
+        }
+    mismatched = sum(1 for message_id, status in expected.items() if actual.get(message_id) != status)
+    statuses = sum(len(change['value'].get('statuses') or [])
+                   for body in bodies for entry in body.get('entry') or []
+                   for change in entry.get('changes') or [])
+    latencies.sort()
+    return {
+        'callbacks': len(bodies),
+        'statuses': statuses,
+        'messages': len(expected),
+        'concurrency': args.concurrency,
+        'errors': len(errors),
+        'ack_s': round(acked, 2),
+        'acks_per_s': round(len(bodies) / acked, 1) if acked else None,
+        'ack_p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'ack_p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        'drain_s': round(drained, 2),
+        'statuses_per_s': round(statuses / drained, 1) if drained else None,
+        'mismatched': mismatched,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--messages', default='10k', help='messages to generate callbacks for, e.g. 1k 10k 100k')
+    parser.add_argument('--file', help='replay callback bodies from this NDJSON file instead')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--statuses-per-callback', type=int, default=1)
+    parser.add_argument('--read-rate', type=float, default=0.6)
+    parser.add_argument('--failure-rate', type=float, default=0.02)
+    parser.add_argument('--duplicate-rate', type=float, default=0.1, help='share of statuses redelivered')
+    parser.add_argument('--timeout', type=float, default=600.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write JSON results here')
+    args = parser.parse_args(argv)
+    # Logs go to stderr, but db.py still prints its startup messages; keep stdout for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        results = json.dumps(run(args), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(results + '\n')
+    print(results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""Local stand-in for the WhatsApp messaging API.
+
+Accepts POST /v1/messages like the real API, answers a repeated
+Idempotency-Key with the original message id, and can inject latency,
+transient failures and per-sender rate limiting. GET /stats reports what
+it received.
+
+    python benchmarks/whatsapp_stub.py --port 8025 --latency-ms 20 --failure-rate 0.02
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubState:
+    def __init__(self, latency_ms=0.0, failure_rate=0.0, rate_limit=None, seed=0):
+        self.latency = latency_ms / 1000.0
+        self.failure_rate = failure_rate
+        self.rate_limit = rate_limit
+        self.rng = random.Random(seed)
+        self.ids = itertools.count(1)
+        self.sent = {}
+        self.stats = {'requests': 0, 'accepted': 0, 'duplicates': 0, 'failed': 0, 'rate_limited': 0}
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def handle(self, sender, key):
+        """Return (status, body, headers) for one send"""
+        with self.lock:
+            self.stats['requests'] += 1
+            if key and key in self.sent:
+                self.stats['duplicates'] += 1
+                return 200, {'id': self.sent[key]}, {}
+            if self.rate_limit:
+                second = int(time.time())
+                window, count = self.windows.get(sender, (second, 0))
+                if window != second:
+                    window, count = second, 0
+                if count >= self.rate_limit:
+                    self.stats['rate_limited'] += 1
+                    return 429, {'error': 'rate limited'}, {'Retry-After': '1'}
+                self.windows[sender] = (window, count + 1)
+            if self.rng.random() < self.failure_rate:
+                self.stats['failed'] += 1
+                return 503, {'error': 'temporarily unavailable'}, {}
+            message_id = f'wamid.{next(self.ids)}'
+            if key:
+                self.sent[key] = message_id
+            self.stats['accepted'] += 1
+            return 200, {'id': message_id}, {}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; don't let Nagle hold the body
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            with self.server.state.lock:
+                return self._reply(200, dict(self.server.state.stats))
+        self._reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._reply(400, {'error': 'invalid JSON'})
+        if self.path != '/v1/messages':
+            return self._reply(404, {'error': 'not found'})
+        if not payload.get('to') or not payload.get('from'):
+            return self._reply(400, {'error': 'from and to are required'})
+        if self.server.state.latency:
+            time.sleep(self.server.state.latency)
+        status, body, headers = self.server.state.handle(
+            payload['from'], self.headers.get('Idempotency-Key')
+        )
+        self._reply(status, body, headers)
+
+
+def start_stub(port=0, **options):
+    """Serve the stub on a background thread; returns the server (server.state has the stats)"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    server.state = StubState(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction answered with 503')
+    parser.add_argument('--rate-limit', type=int, help='messages per second per sender before 429')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    server = start_stub(args.port, latency_ms=args.latency_ms, failure_rate=args.failure_rate,
+                        rate_limit=args.rate_limit, seed=args.seed)
+    print(f"WhatsApp stub listening on http://127.0.0.1:{server.server_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
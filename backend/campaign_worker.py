@@ -0,0 +1,51 @@
+"""Run the campaign send pipeline as its own process.
+
+    python campaign_worker.py
+    python campaign_worker.py --workers 8
+
+Web processes leave the pipeline off (CAMPAIGN_WORKERS defaults to 0), so
+scaling the web tier does not add senders. Several of these may run at
+once: message claims are leased in the database and each sending number's
+rate limit is a bucket in the catalog, so together they still send at
+SEND_RATE_PER_NUMBER. Stops cleanly on SIGTERM or Ctrl-C; claimed messages
+that were not sent go back to the queue when their lease expires.
+"""
+import argparse
+import logging
+import signal
+import threading
+
+from decouple import config
+from db import init_db
+from campaigns import start_workers, stop_workers
+
+logger = logging.getLogger('campaign_worker')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workers', type=int,
+                        default=config('CAMPAIGN_WORKER_THREADS', default=4, cast=int),
+                        help='sender threads (default CAMPAIGN_WORKER_THREADS or 4)')
+    args = parser.parse_args(argv)
+    if args.workers <= 0:
+        parser.error('--workers must be positive')
+
+    logging.basicConfig(level=config('LOG_LEVEL', default='INFO').upper(),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+
+    init_db()
+    start_workers(args.workers)
+    logger.info("Campaign worker running with %d sender threads", args.workers)
+    try:
+        stopping.wait()
+    except KeyboardInterrupt:
+        pass
+    stop_workers()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,633 @@
+import json
+import logging
+import queue
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from decouple import config
+from db import db_connection, shard_router
+from audiences import resolve_audience
+from metrics import Counter, Gauge, Histogram
+from webhooks import record_routes
+from whatsapp import WhatsAppError, send_message
+
+logger = logging.getLogger(__name__)
+
+# Sender threads started by app.py; off by default so web processes don't
+# send, run campaign_worker.py as its own process instead
+CAMPAIGN_WORKERS = config('CAMPAIGN_WORKERS', default=0, cast=int)
+CAMPAIGN_POLL_INTERVAL = config('CAMPAIGN_POLL_INTERVAL', default=0.5, cast=float)
+# Message jobs claimed from the queue per round trip
+CAMPAIGN_CLAIM_BATCH = config('CAMPAIGN_CLAIM_BATCH', default=200, cast=int)
+# Contacts turned into message jobs per transaction while expanding a campaign
+CAMPAIGN_EXPAND_BATCH = config('CAMPAIGN_EXPAND_BATCH', default=1000, cast=int)
+# Claimed messages not finished within this many seconds go back to the queue
+CAMPAIGN_LEASE_SECONDS = config('CAMPAIGN_LEASE_SECONDS', default=60.0, cast=float)
+CAMPAIGN_MAX_ATTEMPTS = config('CAMPAIGN_MAX_ATTEMPTS', default=5, cast=int)
+CAMPAIGN_RETRY_BASE = config('CAMPAIGN_RETRY_BASE', default=2.0, cast=float)
+CAMPAIGN_RETRY_MAX = config('CAMPAIGN_RETRY_MAX', default=300.0, cast=float)
+# Token bucket per sending number (messages per second and burst size),
+# shared by every process through the catalog's send_rate_limits table
+SEND_RATE_PER_NUMBER = config('SEND_RATE_PER_NUMBER', default=80.0, cast=float)
+SEND_BURST_PER_NUMBER = config('SEND_BURST_PER_NUMBER', default=80, cast=int)
+# Seconds of sends a process takes from a shared bucket per round trip
+SEND_TOKEN_LEASE = config('SEND_TOKEN_LEASE', default=0.1, cast=float)
+
+MESSAGES = Counter('campaign_messages_total', 'Campaign message send attempts by result', ('result',))
+QUEUE_LAG = Histogram('campaign_queue_lag_seconds', 'Time from a message becoming due to its send starting',
+                      buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0))
+SEND_LATENCY = Histogram('campaign_send_duration_seconds', 'WhatsApp API call latency')
+OUTBOX_DEPTH = Gauge('campaign_outbox_depth', 'Claimed messages waiting for a sender thread')
+
+# Claimed messages one sending number may have waiting in the outbox: a
+# quarter of the claim batch, so other numbers always find room, and no
+# more than it can send in a quarter of a lease
+NUMBER_BACKLOG = max(1, min(CAMPAIGN_CLAIM_BATCH // 4, int(SEND_RATE_PER_NUMBER * CAMPAIGN_LEASE_SECONDS / 4)))
+
+
+class TokenBucket:
+    """Token bucket kept in the catalog so every process sending for a number shares it
+
+    try_acquire() takes a token without waiting for one. Tokens are moved
+    from the database row a few at a time (SEND_TOKEN_LEASE seconds of
+    sends), so the database sees one short write per batch of sends rather
+    than one per message.
+    """
+
+    def __init__(self, number, rate, capacity):
+        self.number = number
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = 0
+        self.retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """Take a token if one is available: returns 0, or the seconds until one will be"""
+        with self._lock:
+            if not self.tokens:
+                now = time.time()
+                if now < self.retry_at:
+                    return self.retry_at - now
+                try:
+                    self.tokens, left = self._take(now, max(1, int(self.rate * SEND_TOKEN_LEASE)))
+                except sqlite3.Error as e:
+                    logger.warning("Error taking send tokens for %s: %s", self.number, e)
+                    self.retry_at = now + SEND_TOKEN_LEASE
+                    return SEND_TOKEN_LEASE
+                if not self.tokens:
+                    self.retry_at = now + (1 - left) / self.rate
+                    return self.retry_at - now
+            self.tokens -= 1
+            return 0.0
+
+    def _take(self, now, want):
+        """Take up to want whole tokens from the shared bucket; returns (taken, tokens left)"""
+        with db_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    'SELECT tokens, updated_at FROM send_rate_limits WHERE sender_number = ?',
+                    (self.number,)
+                ).fetchone()
+                tokens = self.capacity if row is None else min(
+                    self.capacity, row['tokens'] + max(0.0, now - row['updated_at']) * self.rate
+                )
+                taken = min(want, int(tokens))
+                conn.execute('''
+                    INSERT INTO send_rate_limits (sender_number, tokens, updated_at) VALUES (?, ?, ?)
+                    ON CONFLICT (sender_number) DO UPDATE
+                    SET tokens = excluded.tokens, updated_at = excluded.updated_at
+                ''', (self.number, tokens - taken, now))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        return taken, tokens - taken
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def _bucket(number):
+    with _buckets_lock:
+        bucket = _buckets.get(number)
+        if bucket is None:
+            bucket = _buckets[number] = TokenBucket(number, SEND_RATE_PER_NUMBER, SEND_BURST_PER_NUMBER)
+        return bucket
+
+
+class Outbox:
+    """Claimed messages waiting for a sender thread, queued per sending number
+
+    get() hands out the oldest message of the next number, round-robin,
+    that has a send token now. A number at its rate limit waits on its own
+    bucket without holding a sender thread, so one number's large campaign
+    cannot starve the others.
+    """
+
+    def __init__(self):
+        self._queues = OrderedDict()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def put(self, message):
+        with self._cond:
+            self._queues.setdefault(message['campaign']['sender_number'], deque()).append(message)
+            self._size += 1
+            self._cond.notify()
+
+    def get(self):
+        """Wait for a message that may be sent now; None once closed"""
+        with self._cond:
+            while not self._closed:
+                wait = None
+                for number, messages in self._queues.items():
+                    delay = _bucket(number).try_acquire()
+                    if not delay:
+                        message = messages.popleft()
+                        if messages:
+                            self._queues.move_to_end(number)
+                        else:
+                            del self._queues[number]
+                        self._size -= 1
+                        return message
+                    wait = delay if wait is None else min(wait, delay)
+                self._cond.wait(wait)
+            return None
+
+    def qsize(self):
+        return self._size
+
+    def backlog(self):
+        """{sending number: messages waiting}"""
+        with self._cond:
+            return {number: len(messages) for number, messages in self._queues.items()}
+
+    def open(self):
+        with self._cond:
+            self._closed = False
+
+    def close(self):
+        """Wake and stop every get(); waiting messages are dropped until their leases expire"""
+        with self._cond:
+            self._closed = True
+            self._queues.clear()
+            self._size = 0
+            self._cond.notify_all()
+
+
+# Campaigns
+
+def _serialize_campaign(campaign):
+    campaign['contact_ids'] = json.loads(campaign['contact_ids']) if campaign['contact_ids'] else None
+    return campaign
+
+
+def parse_send_at(value):
+    """Unix time for an ISO 8601 send_at (naive means UTC); None means now"""
+    if value is None:
+        return time.time()
+    moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def create_campaign(user_id, title, message, audience=None, contact_ids=None,
+                    media_url=None, send_at=None):
+    """Queue a campaign for send_at (unix time, default now)
+
+    The audience is either a tag expression (see audiences.py) or a list of
+    contact ids. Raises ValueError for an expression that does not resolve.
+    """
+    if audience is not None:
+        resolve_audience(user_id, audience)
+    # Before the insert, so the dispatcher cannot drop the mark in between
+    shard_router.mark(shard_router.lookup(user_id)[0], SHARD_WORK)
+    with db_connection(user_id) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT country_code, whatsapp_number FROM users WHERE id = ?', (user_id,))
+        user = cursor.fetchone()
+        if not user:
+            return None
+        cursor.execute('''
+            INSERT INTO campaigns (
+                user_id, title, message, media_url, sender_number, audience, contact_ids, scheduled_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            user_id, title, message, media_url,
+            f"{user['country_code']}{user['whatsapp_number']}",
+            audience,
+            json.dumps(contact_ids) if contact_ids is not None else None,
+            send_at if send_at is not None else time.time()
+        ))
+        conn.commit()
+        return get_campaign(cursor.lastrowid, user_id)
+
+
+def get_campaigns(user_id):
+    """Get a user's campaigns, newest first"""
+    with db_connection(user_id) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM campaigns WHERE user_id = ? ORDER BY id DESC', (user_id,))
+        return [_serialize_campaign(campaign) for campaign in cursor.fetchall()]
+
+
+def get_campaign(campaign_id, user_id):
+    """Get a campaign with per-status message counts, queue lag and send rate"""
+    with db_connection(user_id) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM campaigns WHERE id = ? AND user_id = ?', (campaign_id, user_id))
+        campaign = cursor.fetchone()
+        if not campaign:
+            return None
+        cursor.execute('''
+            SELECT status, COUNT(*) AS count FROM campaign_messages
+            WHERE campaign_id = ? GROUP BY status
+        ''', (campaign_id,))
+        campaign['messages'] = {row['status']: row['count'] for row in cursor.fetchall()}
+        cursor.execute('''
+            SELECT
+                (SELECT MIN(next_attempt_at) FROM campaign_messages
+                 WHERE campaign_id = ? AND status = 'queued') AS oldest_due,
+                MIN(sent_at) AS first_sent, MAX(sent_at) AS last_sent
+            FROM campaign_messages WHERE campaign_id = ? AND status = 'sent'
+        ''', (campaign_id, campaign_id))
+        timing = cursor.fetchone()
+        now = time.time()
+        campaign['queue_lag_seconds'] = (
+            round(max(0.0, now - timing['oldest_due']), 3) if timing['oldest_due'] else 0.0
+        )
+        sent = campaign['messages'].get('sent', 0)
+        elapsed = (timing['last_sent'] or 0) - (timing['first_sent'] or 0)
+        campaign['send_rate'] = round(sent / elapsed, 1) if sent > 1 and elapsed > 0 else None
+        return _serialize_campaign(campaign)
+
+
+def cancel_campaign(campaign_id, user_id):
+    """Stop a scheduled or sending campaign; messages already handed to a sender still go out"""
+    with db_connection(user_id) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE campaigns SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND user_id = ? AND status IN ('scheduled', 'sending')
+        ''', (campaign_id, user_id))
+        if not cursor.rowcount:
+            conn.rollback()
+            return False
+        cursor.execute(
+            "UPDATE campaign_messages SET status = 'cancelled' WHERE campaign_id = ? AND status = 'queued'",
+            (campaign_id,)
+        )
+        conn.commit()
+        return True
+
+
+# Pipeline
+#
+# One dispatcher thread owns all queue bookkeeping: it starts due campaigns,
+# expands them into message jobs in batches, claims due jobs under a lease
+# into an in-process outbox and writes back send results in batches. Sender
+# threads only talk to the WhatsApp API, paced by a token bucket per sending
+# number, so SQLite sees a handful of short write transactions per batch.
+# Each shard keeps its own queue; the dispatcher visits the shards marked as
+# having campaigns in turn, so idle tenants' shards are never opened.
+
+_outbox = Outbox()
+_results = queue.Queue()
+_wake = threading.Event()
+_stop = threading.Event()
+_threads = []
+# (shard, campaign id) -> contact ids still to expand, rebuilt from expand_cursor after a restart
+_expansions = {}
+# Kind of work mark (see ShardRouter.mark) for shards with scheduled or sending campaigns
+SHARD_WORK = 'campaigns'
+# Marks of shards without such campaigns are cleared once this much older
+SHARD_WORK_GRACE = 60.0
+
+
+def _start_due_campaigns(conn, now):
+    conn.execute('''
+        UPDATE campaigns SET status = 'sending', updated_at = CURRENT_TIMESTAMP
+        WHERE status = 'scheduled' AND scheduled_at <= ?
+    ''', (now,))
+    conn.commit()
+
+
+def _audience_ids(campaign):
+    if campaign['audience'] is not None:
+        ids = resolve_audience(campaign['user_id'], campaign['audience'])
+    else:
+        ids = sorted(set(json.loads(campaign['contact_ids'] or '[]')))
+    return [contact_id for contact_id in ids if contact_id > campaign['expand_cursor']]
+
+
+def _expand_campaigns(conn, shard, now):
+    """Turn the next batch of each sending campaign's audience into message jobs"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT id, user_id, audience, contact_ids, expand_cursor FROM campaigns
+        WHERE status = 'sending' AND expanded_at IS NULL
+    ''')
+    campaigns = cursor.fetchall()
+    sending = {(shard, campaign['id']) for campaign in campaigns}
+    for key in [key for key in _expansions if key[0] == shard and key not in sending]:
+        del _expansions[key]
+
+    expanded = False
+    for campaign in campaigns:
+        key = (shard, campaign['id'])
+        remaining = _expansions.get(key)
+        if remaining is None:
+            try:
+                remaining = _expansions[key] = _audience_ids(campaign)
+            except ValueError as e:
+                cursor.execute('''
+                    UPDATE campaigns SET status = 'failed', error = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (str(e), campaign['id']))
+                conn.commit()
+                continue
+
+        batch = remaining[:CAMPAIGN_EXPAND_BATCH]
+        del remaining[:CAMPAIGN_EXPAND_BATCH]
+        inserted = 0
+        if batch:
+            # Contacts without a valid WhatsApp number are skipped
+            cursor.execute('''
+                INSERT OR IGNORE INTO campaign_messages (
+                    campaign_id, contact_id, to_number, next_attempt_at, enqueued_at, idempotency_key
+                )
+                SELECT ?, c.id, c.phone_e164, ?, ?, 'campaign-' || ? || '-' || c.id
+                FROM contacts c
+                WHERE c.user_id = ? AND c.id IN (SELECT value FROM json_each(?))
+                  AND c.phone_e164 IS NOT NULL
+            ''', (campaign['id'], now, now, campaign['id'], campaign['user_id'], json.dumps(batch)))
+            inserted = cursor.rowcount
+        cursor.execute('''
+            UPDATE campaigns
+            SET expand_cursor = ?, total_messages = total_messages + ?,
+                expanded_at = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (batch[-1] if batch else campaign['expand_cursor'], inserted,
+              None if remaining else now, campaign['id']))
+        conn.commit()
+        if not remaining:
+            _expansions.pop(key, None)
+        expanded = True
+    return expanded
+
+
+def _claim_messages(conn, shard, now):
+    """Lease due message jobs and hand them to the sender threads
+
+    Keeps at most a claim batch waiting in the outbox. Each sending campaign
+    is claimed from on its own, and a number with NUMBER_BACKLOG messages
+    already waiting gets no more, so due messages of other numbers are
+    claimed even while one number has a huge backlog.
+    """
+    budget = CAMPAIGN_CLAIM_BATCH - _outbox.qsize()
+    if budget <= 0:
+        return False
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, user_id, message, media_url, sender_number FROM campaigns WHERE status = 'sending'")
+    campaigns = cursor.fetchall()
+    # No campaign gets the first pick every pass
+    random.shuffle(campaigns)
+    backlog = _outbox.backlog()
+    messages = []
+    for campaign in campaigns:
+        number = campaign['sender_number']
+        limit = min(budget, NUMBER_BACKLOG - backlog.get(number, 0))
+        if limit <= 0:
+            continue
+        cursor.execute('''
+            UPDATE campaign_messages
+            SET status = 'sending', locked_until = ?, attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM campaign_messages
+                WHERE campaign_id = ? AND status = 'queued' AND next_attempt_at <= ?
+                ORDER BY next_attempt_at
+                LIMIT ?
+            )
+            RETURNING id, campaign_id, to_number, attempts, next_attempt_at, idempotency_key
+        ''', (now + CAMPAIGN_LEASE_SECONDS, campaign['id'], now, limit))
+        claimed = cursor.fetchall()
+        for message in claimed:
+            message['campaign'] = campaign
+            message['shard'] = shard
+        messages.extend(claimed)
+        backlog[number] = backlog.get(number, 0) + len(claimed)
+        budget -= len(claimed)
+        if not budget:
+            break
+    conn.commit()
+    if not messages:
+        return False
+
+    for message in messages:
+        _outbox.put(message)
+    OUTBOX_DEPTH.set(_outbox.qsize())
+    return True
+
+
+def _record_results():
+    """Write back finished sends, one transaction per shard, then their routes"""
+    by_shard = {}
+    routes = []
+    while True:
+        try:
+            shard, user_id, kind, values = _results.get_nowait()
+        except queue.Empty:
+            break
+        by_shard.setdefault(shard, {'sent': [], 'retry': [], 'failed': []})[kind].append(values)
+        if kind == 'sent':
+            routes.append((values[0], user_id, values[1]))
+    for shard, results in by_shard.items():
+        with shard_router.pool(shard).connection() as conn:
+            _write_results(conn, results['sent'], results['retry'], results['failed'])
+    if routes:
+        record_routes(routes)
+    return bool(by_shard)
+
+
+def _write_results(conn, sent, retries, failed):
+    cursor = conn.cursor()
+    cursor.executemany('''
+        UPDATE campaign_messages
+        SET status = 'sent', provider_message_id = ?, sent_at = ?, locked_until = NULL, last_error = NULL
+        WHERE id = ?
+    ''', sent)
+    cursor.executemany('''
+        UPDATE campaign_messages
+        SET status = 'queued', next_attempt_at = ?, locked_until = NULL, last_error = ?
+        WHERE id = ?
+    ''', retries)
+    cursor.executemany('''
+        UPDATE campaign_messages SET status = 'failed', locked_until = NULL, last_error = ?, failed_at = ?
+        WHERE id = ?
+    ''', failed)
+    conn.commit()
+
+
+def _housekeeping(conn, now):
+    """Requeue expired leases and mark finished campaigns completed
+
+    A message whose lease expired on its last allowed attempt (its sender
+    died or hung on it every time) is failed instead of requeued.
+    """
+    conn.execute('''
+        UPDATE campaign_messages
+        SET status = CASE WHEN attempts >= :max_attempts THEN 'failed' ELSE 'queued' END,
+            failed_at = CASE WHEN attempts >= :max_attempts THEN :now END,
+            last_error = CASE WHEN attempts >= :max_attempts THEN 'Send lease expired' ELSE last_error END,
+            locked_until = NULL
+        WHERE status = 'sending' AND locked_until < :now
+    ''', {'now': now, 'max_attempts': CAMPAIGN_MAX_ATTEMPTS})
+    conn.execute('''
+        UPDATE campaigns SET status = 'completed', completed_at = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE status = 'sending' AND expanded_at IS NOT NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM campaign_messages m
+              WHERE m.campaign_id = campaigns.id AND m.status IN ('queued', 'sending')
+          )
+    ''', (now,))
+    conn.commit()
+
+
+def _has_campaigns(conn):
+    return conn.execute(
+        "SELECT 1 FROM campaigns WHERE status IN ('scheduled', 'sending') LIMIT 1"
+    ).fetchone() is not None
+
+
+def _mark_campaign_shards():
+    """Mark every shard that has campaigns, once at startup
+
+    Covers campaigns created before marks existed; after this create_campaign
+    and tenant moves keep the marks up to date.
+    """
+    for shard in shard_router.shard_names():
+        try:
+            with shard_router.pool(shard).connection() as conn:
+                if _has_campaigns(conn):
+                    shard_router.mark(shard, SHARD_WORK)
+        except Exception:
+            logger.exception("Error checking shard %s for campaigns", shard)
+
+
+def _dispatch_loop():
+    last_housekeeping = 0.0
+    marks = {}
+    shards = []
+    _mark_campaign_shards()
+    while not _stop.is_set():
+        _wake.clear()
+        busy = False
+        try:
+            busy |= _record_results()
+        except Exception:
+            logger.exception("Error recording campaign results")
+
+        now = time.time()
+        housekeeping = now - last_housekeeping >= CAMPAIGN_POLL_INTERVAL
+        if housekeeping:
+            last_housekeeping = now
+            try:
+                marks = shard_router.marked(SHARD_WORK)
+                shards = list(marks)
+            except Exception:
+                logger.exception("Error listing shards with campaigns")
+        # Start from a different shard each pass so none monopolizes the outbox
+        shards = shards[1:] + shards[:1]
+        for shard in list(shards):
+            try:
+                with shard_router.pool(shard).connection() as conn:
+                    if housekeeping:
+                        _start_due_campaigns(conn, now)
+                        _housekeeping(conn, now)
+                        if (marks[shard] < now - SHARD_WORK_GRACE and not _has_campaigns(conn)
+                                and not any(key[0] == shard for key in _expansions)):
+                            shard_router.unmark(shard, SHARD_WORK, marks[shard])
+                            shards.remove(shard)
+                            continue
+                    busy |= _expand_campaigns(conn, shard, now)
+                    busy |= _claim_messages(conn, shard, now)
+            except Exception:
+                logger.exception("Error dispatching campaign messages on shard %s", shard)
+        if not busy:
+            _wake.wait(CAMPAIGN_POLL_INTERVAL)
+
+
+def _retry_delay(attempts, error):
+    if error.retry_after is not None:
+        return error.retry_after
+    # Exponential backoff with jitter so retries of a burst spread out
+    return min(CAMPAIGN_RETRY_MAX, CAMPAIGN_RETRY_BASE * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+
+
+def _send_loop():
+    while True:
+        message = _outbox.get()
+        if message is None:
+            return
+        campaign = message['campaign']
+        now = time.time()
+        QUEUE_LAG.observe(max(0.0, now - message['next_attempt_at']))
+        started = time.perf_counter()
+        try:
+            provider_id = send_message(
+                campaign['sender_number'], message['to_number'], campaign['message'],
+                media_url=campaign['media_url'], idempotency_key=message['idempotency_key']
+            )
+            result = ('sent', (provider_id, time.time(), message['id']))
+        except WhatsAppError as e:
+            if e.permanent or message['attempts'] >= CAMPAIGN_MAX_ATTEMPTS:
+                result = ('failed', (str(e), time.time(), message['id']))
+            else:
+                delay = _retry_delay(message['attempts'], e)
+                result = ('retry', (time.time() + delay, str(e), message['id']))
+        except Exception as e:
+            logger.exception("Error sending campaign message %s", message['id'])
+            if message['attempts'] >= CAMPAIGN_MAX_ATTEMPTS:
+                result = ('failed', (str(e), time.time(), message['id']))
+            else:
+                result = ('retry', (time.time() + CAMPAIGN_RETRY_MAX, str(e), message['id']))
+        SEND_LATENCY.observe(time.perf_counter() - started)
+        MESSAGES.inc(result[0])
+        _results.put((message['shard'], campaign['user_id'], *result))
+        _wake.set()
+
+
+def start_workers(workers=None):
+    """Start the dispatcher and sender threads once per process"""
+    workers = CAMPAIGN_WORKERS if workers is None else workers
+    if _threads or workers <= 0:
+        return
+    _stop.clear()
+    _outbox.open()
+    _threads.append(threading.Thread(target=_dispatch_loop, name='campaign-dispatcher', daemon=True))
+    for i in range(workers):
+        _threads.append(threading.Thread(target=_send_loop, name=f'campaign-sender-{i}', daemon=True))
+    for thread in _threads:
+        thread.start()
+
+
+def stop_workers(timeout=10.0):
+    """Stop the pipeline; unsent claimed messages are picked up again when their lease expires"""
+    if not _threads:
+        return
+    _stop.set()
+    _wake.set()
+    _outbox.close()
+    for thread in _threads:
+        thread.join(timeout)
+    # Flush results the senders produced after the dispatcher's last pass
+    _record_results()
+    _threads.clear()
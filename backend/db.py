@@ -1,161 +1,842 @@
 import sqlite3
 from sqlite3 import Error
+import base64
+import json
 import os
+import re
+import threading
+from collections import OrderedDict
 from decouple import config
+from pool import ConnectionPool
+from group_commit import GroupCommitWriter
+from migrations import Migration, migrate, run_online
+from metrics import InstrumentedCursor
+from phones import to_e164
+import fts
+from shards import CATALOG_SCHEMA, SHARD_WORK_SCHEMA, ShardRouter, TenantMovingError
 
-DATABASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database.sqlite')
+# The catalog: users and the tenant -> shard map (see shards.py)
+DATABASE_PATH = config(
+    'DATABASE_PATH',
+    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database.sqlite')
+)
+# Where shard files live when SHARD_STRATEGY spreads tenants over several
+SHARD_DIR = config('SHARD_DIR', default=os.path.join(os.path.dirname(DATABASE_PATH), 'shards'))
 
-def init_db():
-    """Initialize the database with schema"""
-    try:
-        # Remove existing database file if it exists
-        if os.path.exists(DATABASE_PATH):
-            os.remove(DATABASE_PATH)
-            print("Removed existing database")
+# Connection tuning; WAL lets readers run concurrently with the single writer
+DB_PRAGMAS = {
+    'foreign_keys': 'ON',
+    'journal_mode': config('SQLITE_JOURNAL_MODE', default='WAL'),
+    'synchronous': config('SQLITE_SYNCHRONOUS', default='NORMAL'),
+    'mmap_size': config('SQLITE_MMAP_SIZE', default=268435456, cast=int),
+    'cache_size': config('SQLITE_CACHE_SIZE', default=-16000, cast=int),
+    'temp_store': 'MEMORY',
+}
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Create users table with additional fields
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT NOT NULL UNIQUE COLLATE NOCASE,
-            password TEXT NOT NULL,
-            full_name TEXT NOT NULL,
-            country_code TEXT NOT NULL,
-            whatsapp_number TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(country_code, whatsapp_number)
-        )
-        ''')
-        
-        # Create tags table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tags (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            name TEXT NOT NULL,
-            color TEXT DEFAULT '#3490dc',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-            UNIQUE(user_id, name)
-        )
-        ''')
-        
-        # Create contacts table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS contacts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            name TEXT NOT NULL,
-            email TEXT,
-            phone TEXT,
-            country_code TEXT,
-            whatsapp_number TEXT,
-            company TEXT,
-            avatar_url TEXT,
-            notes TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
+def _digits_sql(expr):
+    """SQL expression stripping common phone punctuation from expr"""
+    for char in ' -()+./':
+        expr = f"REPLACE({expr}, '{char}', '')"
+    return expr
+
+# Phone fields are also indexed as bare digits so "+1 (555) 123" finds "15551234"
+_PHONE_DIGITS_SQL = (
+    _digits_sql("COALESCE({row}.phone, '')") + " || ' ' || "
+    + _digits_sql("COALESCE({row}.whatsapp_number, '')") + " || ' ' || "
+    + _digits_sql("COALESCE({row}.country_code, '') || COALESCE({row}.whatsapp_number, '')")
+)
+
+_CONTACTS_FTS_INSERT = '''
+    INSERT INTO contacts_fts (rowid, name, email, phone, whatsapp_number, company, phone_digits)
+    VALUES (new.id, new.name, new.email, new.phone, new.whatsapp_number, new.company, {digits});
+'''.format(digits=_PHONE_DIGITS_SQL.format(row='new'))
+
+CONTACTS_FTS_SCHEMA = f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS contacts_fts USING fts5(
+        name, email, phone, whatsapp_number, company, phone_digits,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3 4'
+    );
+
+    CREATE TRIGGER IF NOT EXISTS contacts_fts_ai AFTER INSERT ON contacts BEGIN
+        {_CONTACTS_FTS_INSERT}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS contacts_fts_ad AFTER DELETE ON contacts BEGIN
+        DELETE FROM contacts_fts WHERE rowid = old.id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS contacts_fts_au
+    AFTER UPDATE OF name, email, phone, country_code, whatsapp_number, company ON contacts BEGIN
+        DELETE FROM contacts_fts WHERE rowid = old.id;
+        {_CONTACTS_FTS_INSERT}
+    END;
+'''
+
+# Contact totals kept current by triggers so listings never need COUNT(*)
+CONTACT_COUNTERS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS user_contact_counts (
+        user_id INTEGER PRIMARY KEY,
+        contact_count INTEGER NOT NULL DEFAULT 0
+    );
+
+    CREATE TABLE IF NOT EXISTS tag_contact_counts (
+        tag_id INTEGER PRIMARY KEY,
+        contact_count INTEGER NOT NULL DEFAULT 0
+    );
+
+    CREATE TRIGGER IF NOT EXISTS contacts_count_ai AFTER INSERT ON contacts BEGIN
+        INSERT INTO user_contact_counts (user_id, contact_count) VALUES (new.user_id, 1)
+        ON CONFLICT (user_id) DO UPDATE SET contact_count = contact_count + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS contacts_count_ad AFTER DELETE ON contacts BEGIN
+        UPDATE user_contact_counts SET contact_count = contact_count - 1
+        WHERE user_id = old.user_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS contact_tags_count_ai AFTER INSERT ON contact_tags BEGIN
+        INSERT INTO tag_contact_counts (tag_id, contact_count) VALUES (new.tag_id, 1)
+        ON CONFLICT (tag_id) DO UPDATE SET contact_count = contact_count + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS contact_tags_count_ad AFTER DELETE ON contact_tags BEGIN
+        UPDATE tag_contact_counts SET contact_count = contact_count - 1
+        WHERE tag_id = old.tag_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS tags_count_ad AFTER DELETE ON tags BEGIN
+        DELETE FROM tag_contact_counts WHERE tag_id = old.id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS users_count_ad AFTER DELETE ON users BEGIN
+        DELETE FROM user_contact_counts WHERE user_id = old.id;
+    END;
+'''
+
+INITIAL_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT NOT NULL UNIQUE COLLATE NOCASE,
+        password TEXT NOT NULL,
+        full_name TEXT NOT NULL,
+        country_code TEXT NOT NULL,
+        whatsapp_number TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(country_code, whatsapp_number)
+    );
+
+    CREATE TABLE IF NOT EXISTS tags (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        color TEXT DEFAULT '#3490dc',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+        UNIQUE(user_id, name)
+    );
+
+    CREATE TABLE IF NOT EXISTS contacts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        email TEXT,
+        phone TEXT,
+        country_code TEXT,
+        whatsapp_number TEXT,
+        company TEXT,
+        avatar_url TEXT,
+        notes TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    );
+
+    CREATE TABLE IF NOT EXISTS contact_tags (
+        contact_id INTEGER NOT NULL,
+        tag_id INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (contact_id, tag_id),
+        FOREIGN KEY (contact_id) REFERENCES contacts(id) ON DELETE CASCADE,
+        FOREIGN KEY (tag_id) REFERENCES tags(id) ON DELETE CASCADE
+    );
+
+    CREATE INDEX IF NOT EXISTS email_idx ON users(email);
+    CREATE INDEX IF NOT EXISTS phone_idx ON users(country_code, whatsapp_number);
+    CREATE INDEX IF NOT EXISTS contacts_user_idx ON contacts(user_id);
+    CREATE INDEX IF NOT EXISTS contacts_phone_idx ON contacts(country_code, whatsapp_number);
+    CREATE INDEX IF NOT EXISTS tags_user_idx ON tags(user_id);
+'''
+
+IMPORT_JOBS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS import_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        filename TEXT,
+        status TEXT NOT NULL DEFAULT 'queued',
+        rows_processed INTEGER NOT NULL DEFAULT 0,
+        rows_imported INTEGER NOT NULL DEFAULT 0,
+        rows_rejected INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    );
+
+    CREATE TABLE IF NOT EXISTS import_rejections (
+        job_id INTEGER NOT NULL,
+        line INTEGER NOT NULL,
+        reason TEXT NOT NULL,
+        row_data TEXT,
+        PRIMARY KEY (job_id, line),
+        FOREIGN KEY (job_id) REFERENCES import_jobs(id) ON DELETE CASCADE
+    );
+
+    CREATE INDEX IF NOT EXISTS import_jobs_user_idx ON import_jobs(user_id);
+'''
+
+# Existing rows are (re)indexed so the steps also apply to populated databases
+CONTACTS_FTS_BACKFILL = '''
+    DELETE FROM contacts_fts;
+    INSERT INTO contacts_fts (rowid, name, email, phone, whatsapp_number, company, phone_digits)
+    SELECT c.id, c.name, c.email, c.phone, c.whatsapp_number, c.company, {digits}
+    FROM contacts c;
+'''.format(digits=_PHONE_DIGITS_SQL.format(row='c'))
+
+CONTACT_COUNTERS_BACKFILL = '''
+    DELETE FROM user_contact_counts;
+    INSERT INTO user_contact_counts (user_id, contact_count)
+    SELECT user_id, COUNT(*) FROM contacts GROUP BY user_id;
+
+    DELETE FROM tag_contact_counts;
+    INSERT INTO tag_contact_counts (tag_id, contact_count)
+    SELECT tag_id, COUNT(*) FROM contact_tags GROUP BY tag_id;
+'''
+
+# Per-user counter bumped by every tag/contact write; drives HTTP ETags
+DATA_VERSIONS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS user_data_versions (
+        user_id INTEGER PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0,
+        updated_at REAL NOT NULL
+    )
+'''
+
+# Membership change log read by the in-memory audience bitmaps (audiences.py).
+# tag_id 0 records a contact joining or leaving the user's contact set; on
+# cascaded deletes the tag or the contact may already be gone, hence COALESCE.
+AUDIENCE_CHANGES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS audience_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        contact_id INTEGER NOT NULL,
+        tag_id INTEGER NOT NULL,
+        added INTEGER NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS audience_changes_user_idx ON audience_changes(user_id, seq);
+
+    CREATE TRIGGER IF NOT EXISTS contacts_audience_ai AFTER INSERT ON contacts BEGIN
+        INSERT INTO audience_changes (user_id, contact_id, tag_id, added)
+        VALUES (new.user_id, new.id, 0, 1);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS contacts_audience_ad AFTER DELETE ON contacts BEGIN
+        INSERT INTO audience_changes (user_id, contact_id, tag_id, added)
+        VALUES (old.user_id, old.id, 0, 0);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS contact_tags_audience_ai AFTER INSERT ON contact_tags BEGIN
+        INSERT INTO audience_changes (user_id, contact_id, tag_id, added)
+        VALUES ((SELECT user_id FROM tags WHERE id = new.tag_id), new.contact_id, new.tag_id, 1);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS contact_tags_audience_ad AFTER DELETE ON contact_tags BEGIN
+        INSERT INTO audience_changes (user_id, contact_id, tag_id, added)
+        VALUES (COALESCE((SELECT user_id FROM tags WHERE id = old.tag_id),
+                         (SELECT user_id FROM contacts WHERE id = old.contact_id)),
+                old.contact_id, old.tag_id, 0);
+    END;
+'''
+
+# Campaigns and their per-contact message jobs (campaigns.py); times are unix seconds
+CAMPAIGNS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS campaigns (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        title TEXT NOT NULL,
+        message TEXT NOT NULL,
+        media_url TEXT,
+        sender_number TEXT NOT NULL,
+        audience TEXT,
+        contact_ids TEXT,
+        status TEXT NOT NULL DEFAULT 'scheduled',
+        scheduled_at REAL NOT NULL,
+        expand_cursor INTEGER NOT NULL DEFAULT 0,
+        expanded_at REAL,
+        completed_at REAL,
+        total_messages INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    );
+
+    CREATE TABLE IF NOT EXISTS campaign_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        campaign_id INTEGER NOT NULL,
+        contact_id INTEGER NOT NULL,
+        to_number TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        locked_until REAL,
+        idempotency_key TEXT NOT NULL UNIQUE,
+        provider_message_id TEXT,
+        last_error TEXT,
+        enqueued_at REAL NOT NULL,
+        sent_at REAL,
+        UNIQUE(campaign_id, contact_id),
+        FOREIGN KEY (campaign_id) REFERENCES campaigns(id) ON DELETE CASCADE
+    );
+
+    CREATE INDEX IF NOT EXISTS campaigns_user_idx ON campaigns(user_id);
+    CREATE INDEX IF NOT EXISTS campaigns_status_idx ON campaigns(status, scheduled_at);
+    CREATE INDEX IF NOT EXISTS campaign_messages_due_idx ON campaign_messages(status, next_attempt_at);
+    CREATE INDEX IF NOT EXISTS campaign_messages_campaign_idx ON campaign_messages(campaign_id, status);
+'''
+
+# Latest change per contact and tag for the delta-sync feed (sync.py). Every
+# change deletes the object's row and appends it again at the next seq, so seq
+# order is change order and each object appears once; deleted rows are the
+# tombstones. Delete-then-insert rather than INSERT OR REPLACE because an
+# outer INSERT OR IGNORE would override the trigger's conflict clause. A
+# contact's tag links count as changes to the contact, unless the contact
+# itself is being deleted.
+def _sync_change(kind, row, deleted=0):
+    """Trigger body moving a contact or tag to the end of sync_changes"""
+    return f'''
+        DELETE FROM sync_changes WHERE kind = '{kind}' AND object_id = {row}.id;
+        INSERT INTO sync_changes (user_id, kind, object_id, deleted)
+        VALUES ({row}.user_id, '{kind}', {row}.id, {deleted});
+    '''
+
+def _sync_contact_tags_change(row):
+    """Trigger body marking a tag link's contact changed, if the contact still exists"""
+    # A deleted contact's row is its tombstone, which must stay put
+    return f'''
+        DELETE FROM sync_changes
+        WHERE kind = 'contact' AND object_id = {row}.contact_id AND deleted = 0;
+        INSERT INTO sync_changes (user_id, kind, object_id, deleted)
+        SELECT user_id, 'contact', id, 0 FROM contacts WHERE id = {row}.contact_id;
+    '''
+
+SYNC_CHANGES_SCHEMA = f'''
+    CREATE TABLE IF NOT EXISTS sync_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        object_id INTEGER NOT NULL,
+        deleted INTEGER NOT NULL DEFAULT 0,
+        UNIQUE(kind, object_id)
+    );
+
+    CREATE INDEX IF NOT EXISTS sync_changes_user_idx ON sync_changes(user_id, seq);
+
+    CREATE TRIGGER IF NOT EXISTS contacts_sync_ai AFTER INSERT ON contacts BEGIN
+        {_sync_change('contact', 'new')}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS contacts_sync_au AFTER UPDATE ON contacts BEGIN
+        {_sync_change('contact', 'new')}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS contacts_sync_ad AFTER DELETE ON contacts BEGIN
+        {_sync_change('contact', 'old', deleted=1)}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS contact_tags_sync_ai AFTER INSERT ON contact_tags BEGIN
+        {_sync_contact_tags_change('new')}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS contact_tags_sync_ad AFTER DELETE ON contact_tags BEGIN
+        {_sync_contact_tags_change('old')}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS tags_sync_ai AFTER INSERT ON tags BEGIN
+        {_sync_change('tag', 'new')}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS tags_sync_au AFTER UPDATE ON tags BEGIN
+        {_sync_change('tag', 'new')}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS tags_sync_ad AFTER DELETE ON tags BEGIN
+        {_sync_change('tag', 'old', deleted=1)}
+    END;
+'''
+
+SYNC_CHANGES_BACKFILL = '''
+    INSERT INTO sync_changes (user_id, kind, object_id)
+    SELECT user_id, 'tag', id FROM tags ORDER BY id;
+
+    INSERT INTO sync_changes (user_id, kind, object_id)
+    SELECT user_id, 'contact', id FROM contacts ORDER BY id;
+'''
+
+# WhatsApp status callbacks (webhooks.py). Raw bodies are appended to
+# webhook_events on the catalog and acknowledged; the applier folds them into
+# campaign_messages.delivery_status by provider message id. Statuses for
+# messages not (yet) known wait in delivery_status_pending.
+WEBHOOKS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS webhook_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        received_at REAL NOT NULL,
+        body TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS webhook_cursors (
+        name TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS delivery_status_pending (
+        message_id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        status_at REAL,
+        error TEXT,
+        first_seen REAL NOT NULL
+    );
+
+    ALTER TABLE campaign_messages ADD COLUMN delivery_status TEXT;
+    ALTER TABLE campaign_messages ADD COLUMN delivery_status_at REAL;
+    ALTER TABLE campaign_messages ADD COLUMN delivery_error TEXT;
+'''
+
+# Campaign report rollups (reports.py): messages per campaign, hour or day and
+# milestone, so reports never read campaign_messages. Each milestone has a
+# timestamp column that is set once; triggers count the message in the
+# bucket of that time, and move it if the time is ever rewritten. Rows are
+# copied in on a shard move by the insert triggers, and deleted with their
+# campaign.
+REPORT_MILESTONES = (
+    ('sent', 'sent_at'),
+    ('delivered', 'delivered_at'),
+    ('read', 'read_at'),
+    ('failed', 'failed_at'),
+)
+REPORT_GRAINS = (('hourly', 3600), ('daily', 86400))
+
+def _campaign_stats_add(row, status, column, delta):
+    """Trigger statements counting row's milestone into every rollup"""
+    return ''.join(f'''
+        INSERT INTO campaign_stats_{grain} (campaign_id, bucket, status, count)
+        SELECT {row}.campaign_id, CAST({row}.{column} / {seconds} AS INTEGER) * {seconds}, '{status}', {delta}
+        WHERE {row}.{column} IS NOT NULL
+        ON CONFLICT (campaign_id, bucket, status) DO UPDATE SET count = count + excluded.count;
+    ''' for grain, seconds in REPORT_GRAINS)
+
+def campaign_milestones_sql(campaigns):
+    """(campaign_id, status, at) for every milestone reached by the campaigns a subquery selects"""
+    return ' UNION ALL '.join(
+        f"SELECT campaign_id, '{status}' AS status, {column} AS at FROM campaign_messages "
+        f"WHERE {column} IS NOT NULL AND campaign_id IN ({campaigns})"
+        for status, column in REPORT_MILESTONES
+    )
+
+def campaign_stats_rebuild_sql(campaigns):
+    """Statements recomputing the rollups of the campaigns a subquery selects"""
+    milestones = campaign_milestones_sql(campaigns)
+    statements = []
+    for grain, seconds in REPORT_GRAINS:
+        statements.append(f'DELETE FROM campaign_stats_{grain} WHERE campaign_id IN ({campaigns})')
+        statements.append(f'''
+            INSERT INTO campaign_stats_{grain} (campaign_id, bucket, status, count)
+            SELECT campaign_id, CAST(at / {seconds} AS INTEGER) * {seconds} AS bucket, status, COUNT(*)
+            FROM ({milestones})
+            GROUP BY campaign_id, bucket, status
         ''')
-        
-        # Create contact_tags junction table
+    return statements
+
+CAMPAIGN_STATS_SCHEMA = '''
+    ALTER TABLE campaign_messages ADD COLUMN delivered_at REAL;
+    ALTER TABLE campaign_messages ADD COLUMN read_at REAL;
+    ALTER TABLE campaign_messages ADD COLUMN failed_at REAL;
+
+    UPDATE campaign_messages SET delivered_at = delivery_status_at
+    WHERE delivery_status IN ('delivered', 'read');
+    UPDATE campaign_messages SET read_at = delivery_status_at WHERE delivery_status = 'read';
+    UPDATE campaign_messages SET failed_at = COALESCE(delivery_status_at, next_attempt_at)
+    WHERE delivery_status = 'failed' OR status = 'failed';
+''' + ''.join(f'''
+    CREATE TABLE IF NOT EXISTS campaign_stats_{grain} (
+        campaign_id INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (campaign_id, bucket, status),
+        FOREIGN KEY (campaign_id) REFERENCES campaigns(id) ON DELETE CASCADE
+    ) WITHOUT ROWID;
+''' for grain, _ in REPORT_GRAINS) + ''.join(f'''
+    CREATE TRIGGER IF NOT EXISTS campaign_messages_{status}_stats_ai AFTER INSERT ON campaign_messages
+    WHEN new.{column} IS NOT NULL BEGIN
+        {_campaign_stats_add('new', status, column, 1)}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS campaign_messages_{status}_stats_au AFTER UPDATE OF {column} ON campaign_messages
+    WHEN old.{column} IS NOT new.{column} BEGIN
+        {_campaign_stats_add('old', status, column, -1)}
+        {_campaign_stats_add('new', status, column, 1)}
+    END;
+''' for status, column in REPORT_MILESTONES) + ''.join(
+    f'{statement};\n' for statement in campaign_stats_rebuild_sql('SELECT id FROM campaigns')
+)
+
+# Contact search scoped by tenant (see fts.py): every indexed word carries
+# its owner's prefix, so MATCH only walks that tenant's terms. Replaces the
+# shared index from migration 3; prefix index lengths include the tenant
+# prefix, so they still cover one to four typed characters.
+_CONTACTS_FTS_COLUMNS = ('name', 'email', 'phone', 'whatsapp_number', 'company', 'phone_digits')
+
+def _contacts_fts_values(row):
+    values = [f'{row}.{column}' for column in _CONTACTS_FTS_COLUMNS[:-1]]
+    values.append(_PHONE_DIGITS_SQL.format(row=row))
+    return ', '.join(f'fts_terms({row}.user_id, {value})' for value in values)
+
+_CONTACTS_TENANT_FTS_INSERT = f'''
+    INSERT INTO contacts_fts (rowid, {', '.join(_CONTACTS_FTS_COLUMNS)})
+    VALUES (new.id, {_contacts_fts_values('new')});
+'''
+
+CONTACTS_TENANT_FTS_SCHEMA = f'''
+    DROP TRIGGER IF EXISTS contacts_fts_ai;
+    DROP TRIGGER IF EXISTS contacts_fts_ad;
+    DROP TRIGGER IF EXISTS contacts_fts_au;
+    DROP TABLE IF EXISTS contacts_fts;
+
+    CREATE VIRTUAL TABLE contacts_fts USING fts5(
+        {', '.join(_CONTACTS_FTS_COLUMNS)},
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '{' '.join(str(fts.PREFIX_LENGTH + n) for n in (1, 2, 3, 4))}'
+    );
+
+    CREATE TRIGGER contacts_fts_ai AFTER INSERT ON contacts BEGIN
+        {_CONTACTS_TENANT_FTS_INSERT}
+    END;
+
+    CREATE TRIGGER contacts_fts_ad AFTER DELETE ON contacts BEGIN
+        DELETE FROM contacts_fts WHERE rowid = old.id;
+    END;
+
+    CREATE TRIGGER contacts_fts_au
+    AFTER UPDATE OF user_id, name, email, phone, country_code, whatsapp_number, company ON contacts BEGIN
+        DELETE FROM contacts_fts WHERE rowid = old.id;
+        {_CONTACTS_TENANT_FTS_INSERT}
+    END;
+
+    INSERT INTO contacts_fts (rowid, {', '.join(_CONTACTS_FTS_COLUMNS)})
+    SELECT c.id, {_contacts_fts_values('c')} FROM contacts c;
+'''
+
+# Rows normalized per transaction while backfilling contacts.phone_e164
+PHONE_BACKFILL_BATCH = config('PHONE_BACKFILL_BATCH', default=5000, cast=int)
+
+def _backfill_phone_e164(cursor):
+    """Fill phone_e164 in batches, then add the unique (user_id, phone_e164) index"""
+    conn = cursor.connection
+    last_id = 0
+    while True:
         cursor.execute('''
-        CREATE TABLE IF NOT EXISTS contact_tags (
-            contact_id INTEGER NOT NULL,
-            tag_id INTEGER NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (contact_id, tag_id),
-            FOREIGN KEY (contact_id) REFERENCES contacts(id) ON DELETE CASCADE,
-            FOREIGN KEY (tag_id) REFERENCES tags(id) ON DELETE CASCADE
+            SELECT id, country_code, whatsapp_number FROM contacts
+            WHERE id > ? AND phone_e164 IS NULL AND whatsapp_number IS NOT NULL
+            ORDER BY id LIMIT ?
+        ''', (last_id, PHONE_BACKFILL_BATCH))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1]['id']
+        updates = [(to_e164(row['country_code'], row['whatsapp_number']), row['id']) for row in rows]
+        cursor.executemany(
+            'UPDATE contacts SET phone_e164 = ? WHERE id = ?',
+            [update for update in updates if update[0]]
         )
-        ''')
-        
-        # Create indexes
-        cursor.execute('CREATE INDEX IF NOT EXISTS email_idx ON users(email)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS phone_idx ON users(country_code, whatsapp_number)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS contacts_user_idx ON contacts(user_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS contacts_phone_idx ON contacts(country_code, whatsapp_number)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS tags_user_idx ON tags(user_id)')
-        
         conn.commit()
+        cursor.execute('BEGIN IMMEDIATE')
+
+    # Older data may hold the same number twice; the lowest id keeps it
+    cursor.execute('''
+        UPDATE contacts SET phone_e164 = NULL
+        WHERE phone_e164 IS NOT NULL AND id NOT IN (
+            SELECT MIN(id) FROM contacts WHERE phone_e164 IS NOT NULL GROUP BY user_id, phone_e164
+        )
+    ''')
+    cursor.execute(
+        'CREATE UNIQUE INDEX IF NOT EXISTS contacts_user_phone_e164_idx ON contacts(user_id, phone_e164)'
+    )
+
+# Tenant of each sent WhatsApp message id, recorded with the send result, so
+# the webhook applier goes straight to the tenant's shard; catalog only. The
+# backfill covers messages sent from this database before the table existed.
+PROVIDER_MESSAGE_ROUTES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS provider_message_routes (
+        provider_message_id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        sent_at REAL NOT NULL
+    ) WITHOUT ROWID;
+
+    CREATE INDEX IF NOT EXISTS provider_message_routes_sent_idx ON provider_message_routes(sent_at);
+
+    INSERT OR IGNORE INTO provider_message_routes (provider_message_id, user_id, sent_at)
+    SELECT m.provider_message_id, c.user_id, m.sent_at
+    FROM campaign_messages m JOIN campaigns c ON c.id = m.campaign_id
+    WHERE m.provider_message_id IS NOT NULL AND m.sent_at IS NOT NULL;
+'''
+
+# Send token buckets per WhatsApp sending number, shared by every process
+# running the campaign pipeline (see campaigns.TokenBucket); catalog only
+SEND_RATE_LIMITS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS send_rate_limits (
+        sender_number TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL
+    ) WITHOUT ROWID;
+'''
+
+# Append new steps with the next version number; never edit an applied one
+MIGRATIONS = [
+    Migration(1, 'initial schema', INITIAL_SCHEMA),
+    Migration(2, 'contacts name index',
+              'CREATE INDEX IF NOT EXISTS contacts_user_name_idx ON contacts(user_id, name, id)',
+              online=True),
+    Migration(3, 'contacts full-text index', CONTACTS_FTS_SCHEMA + CONTACTS_FTS_BACKFILL),
+    Migration(4, 'import jobs', IMPORT_JOBS_SCHEMA),
+    Migration(5, 'contact counters', CONTACT_COUNTERS_SCHEMA + CONTACT_COUNTERS_BACKFILL),
+    Migration(6, 'user data versions', DATA_VERSIONS_SCHEMA),
+    Migration(7, 'audience change log', AUDIENCE_CHANGES_SCHEMA),
+    Migration(8, 'campaigns', CAMPAIGNS_SCHEMA),
+    Migration(9, 'contacts phone_e164 column', 'ALTER TABLE contacts ADD COLUMN phone_e164 TEXT'),
+    Migration(10, 'contacts phone_e164 backfill and index', _backfill_phone_e164, online=True),
+    Migration(11, 'shard catalog', CATALOG_SCHEMA),
+    Migration(12, 'sync change feed', SYNC_CHANGES_SCHEMA + SYNC_CHANGES_BACKFILL),
+    Migration(13, 'whatsapp status webhooks', WEBHOOKS_SCHEMA),
+    Migration(14, 'campaign_messages provider id index',
+              'CREATE INDEX IF NOT EXISTS campaign_messages_provider_idx '
+              'ON campaign_messages(provider_message_id) WHERE provider_message_id IS NOT NULL',
+              online=True),
+    Migration(15, 'campaign report rollups', CAMPAIGN_STATS_SCHEMA),
+    Migration(16, 'contacts full-text index scoped by tenant', CONTACTS_TENANT_FTS_SCHEMA),
+    Migration(17, 'campaign_messages due-per-campaign index',
+              'CREATE INDEX IF NOT EXISTS campaign_messages_campaign_due_idx '
+              'ON campaign_messages(campaign_id, status, next_attempt_at)',
+              online=True),
+    Migration(18, 'send rate limits', SEND_RATE_LIMITS_SCHEMA),
+    Migration(19, 'shard work marks', SHARD_WORK_SCHEMA),
+    Migration(20, 'provider message routes', PROVIDER_MESSAGE_ROUTES_SCHEMA),
+]
+
+def init_db():
+    """Bring the catalog up to date without touching existing data
+
+    Each shard is brought up to date when a process first opens it.
+    """
+    try:
+        shard_router.open_catalog()
         print("Database initialized successfully")
     except Error as e:
         print(f"Error initializing database: {e}")
-    finally:
-        if conn:
-            conn.close()
+
+def _migrate_pool(pool):
+    with pool.connection() as conn:
+        online = migrate(conn, MIGRATIONS)
+    run_online(pool.connection, online)
 
 def dict_factory(cursor, row):
-    """Convert database row objects to a dictionary"""
-    fields = [column[0] for column in cursor.description]
-    return {key: value for key, value in zip(fields, row)}
+    """Convert database row objects to a dictionary
 
-def get_db_connection():
-    """Create a database connection"""
+    cursor.description is one tuple per statement, so the column names are
+    worked out once per result set and reused for every row.
+    """
+    description = cursor.description
+    cached = getattr(cursor, 'row_fields', None)
+    if cached is None or cached[0] is not description:
+        cached = cursor.row_fields = (description, tuple(column[0] for column in description))
+    return dict(zip(cached[1], row))
+
+# One pool per database file, each up to DB_POOL_SIZE connections
+def _open_pool(path):
+    return ConnectionPool(
+        path,
+        size=config('DB_POOL_SIZE', default=8, cast=int),
+        timeout=config('DB_POOL_TIMEOUT', default=10.0, cast=float),
+        pragmas=DB_PRAGMAS,
+        row_factory=dict_factory,
+        cursor_factory=InstrumentedCursor,
+        healthcheck_interval=config('DB_POOL_HEALTHCHECK_INTERVAL', default=30.0, cast=float),
+        init=fts.register,
+    )
+
+shard_router = ShardRouter(DATABASE_PATH, SHARD_DIR, _open_pool, _migrate_pool)
+
+def get_db_connection(user_id=None):
+    """Borrow a connection to the user's shard (or the catalog); close() hands it back"""
     try:
-        # Ensure the database directory exists
-        os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
-        
-        conn = sqlite3.connect(DATABASE_PATH)
-        conn.row_factory = dict_factory
-        
-        # Enable foreign key support
-        conn.execute('PRAGMA foreign_keys = ON')
-        
-        return conn
+        return shard_router.acquire(user_id)
     except Error as e:
         print(f"Error connecting to database: {e}")
         raise e
 
+def db_connection(user_id=None):
+    """Context manager that borrows a pooled connection for the block
+
+    With a user_id the connection is to the shard holding that tenant's
+    tags, contacts, imports and campaigns; without one it is to the catalog.
+    Raises TenantMovingError while the tenant is being moved.
+    """
+    return shard_router.connection(user_id)
+
+# Opt-in group commit: contact and tag writes from every request thread go to
+# one writer thread that commits them a batch at a time, instead of each
+# request taking the write lock and committing on its own
+GROUP_COMMIT = config('GROUP_COMMIT', default=False, cast=bool)
+group_writer = GroupCommitWriter(
+    lambda shard: shard_router.pool(shard).connection(),
+    max_ops=config('GROUP_COMMIT_MAX_OPS', default=64, cast=int),
+    window=config('GROUP_COMMIT_WINDOW_MS', default=2.0, cast=float) / 1000,
+)
+
+def _write(user_id, operation):
+    """Run operation(conn) as its own transaction on the user's shard and return its result
+
+    operation must not commit. With GROUP_COMMIT it runs on the writer
+    thread, committed together with other writes to the same shard; it is
+    rolled back alone if it raises either way.
+    """
+    if GROUP_COMMIT:
+        return group_writer.submit(shard_router.shard_for(user_id), operation)
+    with db_connection(user_id) as conn:
+        result = operation(conn)
+        conn.commit()
+        return result
+
 def get_user_by_email(email):
     """Helper function to get user by email"""
-    try:
-        conn = get_db_connection()
+    with db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM users WHERE email = ? COLLATE NOCASE', (email,))
         return cursor.fetchone()
-    finally:
-        if conn:
-            conn.close()
+
+class DuplicateUserError(ValueError):
+    """The email address or WhatsApp number already belongs to a user"""
 
 def create_user(email, hashed_password, full_name, country_code, whatsapp_number):
-    """Helper function to create a new user"""
-    try:
-        conn = get_db_connection()
+    """Helper function to create a new user and place them on a shard
+
+    Raises DuplicateUserError if the email or WhatsApp number is taken.
+    """
+    with db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute(
-            'INSERT INTO users (email, password, full_name, country_code, whatsapp_number) VALUES (?, ?, ?, ?, ?)',
-            (email, hashed_password, full_name, country_code, whatsapp_number)
+        try:
+            cursor.execute(
+                'INSERT INTO users (email, password, full_name, country_code, whatsapp_number) '
+                'VALUES (?, ?, ?, ?, ?) RETURNING *',
+                (email, hashed_password, full_name, country_code, whatsapp_number)
+            )
+            user = cursor.fetchone()
+        except sqlite3.IntegrityError as e:
+            if 'users.email' in str(e):
+                raise DuplicateUserError('User already exists') from e
+            if 'users.whatsapp_number' in str(e):
+                raise DuplicateUserError('WhatsApp number already registered') from e
+            raise
+        shard = shard_router.assign(conn, user['id'])
+        conn.commit()
+    shard_router.add_user(shard, user)
+    return user
+
+def update_user_password(user_id, hashed_password):
+    """Helper function to replace a user's password hash"""
+    with db_connection() as conn:
+        conn.execute(
+            'UPDATE users SET password = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+            (hashed_password, user_id)
         )
         conn.commit()
-        return get_user_by_email(email)
-    finally:
-        if conn:
-            conn.close()
 
 def get_user_by_whatsapp(country_code, whatsapp_number):
     """Helper function to get user by WhatsApp number"""
-    try:
-        conn = get_db_connection()
+    with db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM users WHERE country_code = ? AND whatsapp_number = ?', 
                       (country_code, whatsapp_number))
         return cursor.fetchone()
-    finally:
-        if conn:
-            conn.close()
+
+# Data versions
+
+def bump_data_version(conn, user_id):
+    """Mark a user's tags/contacts as changed; call inside the write's transaction"""
+    conn.execute('''
+        INSERT INTO user_data_versions (user_id, version, updated_at)
+        VALUES (?, 1, (julianday('now') - 2440587.5) * 86400.0)
+        ON CONFLICT (user_id) DO UPDATE
+        SET version = version + 1, updated_at = excluded.updated_at
+    ''', (user_id,))
+
+def get_data_version(user_id):
+    """Get (version, updated_at) for a user's tags/contacts; (0, None) if never written"""
+    with db_connection(user_id) as conn:
+        row = conn.execute(
+            'SELECT version, updated_at FROM user_data_versions WHERE user_id = ?',
+            (user_id,)
+        ).fetchone()
+        return (row['version'], row['updated_at']) if row else (0, None)
 
 # Tags related functions
+
+# Per-process cache of {tag_id: {'id', 'name', 'color'}} per user, so contact
+# rows only need to carry tag ids. Each entry is stamped with the user's
+# data version and only served while that is still current, so writes made
+# by other processes are seen too; invalidate_tag_cache() just frees the
+# entry early in the writing process.
+TAG_CACHE_USERS = config('TAG_CACHE_USERS', default=1024, cast=int)
+_tag_cache = OrderedDict()
+_tag_cache_lock = threading.Lock()
+
+def invalidate_tag_cache(user_id):
+    """Forget the cached tags of a user"""
+    with _tag_cache_lock:
+        _tag_cache.pop(user_id, None)
+
+def get_tag_map(cursor, user_id, refresh=False):
+    """Get a user's tags keyed by id, loading them when the cached copy is missing or stale"""
+    # Read the version before the tags: a write committing in between leaves
+    # newer tags under an older stamp, which is only reloaded early
+    cursor.execute('SELECT version FROM user_data_versions WHERE user_id = ?', (user_id,))
+    row = cursor.fetchone()
+    version = row['version'] if row else 0
+    if not refresh:
+        with _tag_cache_lock:
+            cached = _tag_cache.get(user_id)
+            if cached is not None and cached[0] == version:
+                _tag_cache.move_to_end(user_id)
+                return cached[1]
+
+    cursor.execute('SELECT id, name, color FROM tags WHERE user_id = ?', (user_id,))
+    tag_map = {tag['id']: tag for tag in cursor.fetchall()}
+    with _tag_cache_lock:
+        cached = _tag_cache.get(user_id)
+        # A concurrent reader may already have stored a newer generation
+        if cached is None or cached[0] <= version:
+            _tag_cache[user_id] = (version, tag_map)
+            _tag_cache.move_to_end(user_id)
+        while len(_tag_cache) > TAG_CACHE_USERS:
+            _tag_cache.popitem(last=False)
+    return tag_map
+
 def create_tag(user_id, name, color=None):
     """Create a new tag"""
-    try:
-        conn = get_db_connection()
+    def insert(conn):
         cursor = conn.cursor()
         if color:
             cursor.execute(
@@ -167,239 +848,420 @@ def create_tag(user_id, name, color=None):
                 'INSERT INTO tags (user_id, name) VALUES (?, ?)',
                 (user_id, name)
             )
-        conn.commit()
+        bump_data_version(conn, user_id)
         return cursor.lastrowid
-    finally:
-        if conn:
-            conn.close()
+
+    tag_id = _write(user_id, insert)
+    invalidate_tag_cache(user_id)
+    return tag_id
 
 def get_tags(user_id):
-    """Get all tags for a user"""
-    try:
-        conn = get_db_connection()
+    """Get all tags for a user with the number of contacts tagged with each"""
+    with db_connection(user_id) as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM tags WHERE user_id = ? ORDER BY name', (user_id,))
+        cursor.execute('''
+            SELECT t.*, COALESCE(tc.contact_count, 0) AS contact_count
+            FROM tags t
+            LEFT JOIN tag_contact_counts tc ON tc.tag_id = t.id
+            WHERE t.user_id = ?
+            ORDER BY t.name
+        ''', (user_id,))
         return cursor.fetchall()
-    finally:
-        if conn:
-            conn.close()
+
+def _count_contacts(cursor, user_id, tag_id=None):
+    """Read a user's (or one of their tags') contact total from the counters"""
+    if tag_id:
+        cursor.execute('''
+            SELECT COALESCE(tc.contact_count, 0) AS total
+            FROM tags t LEFT JOIN tag_contact_counts tc ON tc.tag_id = t.id
+            WHERE t.id = ? AND t.user_id = ?
+        ''', (tag_id, user_id))
+    else:
+        cursor.execute(
+            'SELECT contact_count AS total FROM user_contact_counts WHERE user_id = ?',
+            (user_id,)
+        )
+    row = cursor.fetchone()
+    return row['total'] if row else 0
+
+def get_contact_count(user_id):
+    """Get the total number of contacts a user has"""
+    with db_connection(user_id) as conn:
+        return _count_contacts(conn.cursor(), user_id)
 
 def update_tag(tag_id, user_id, name=None, color=None):
     """Update a tag"""
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        updates = []
-        values = []
-        if name is not None:
-            updates.append('name = ?')
-            values.append(name)
-        if color is not None:
-            updates.append('color = ?')
-            values.append(color)
-        if updates:
-            values.extend([user_id, tag_id])
-            cursor.execute(
-                f'UPDATE tags SET {", ".join(updates)}, updated_at = CURRENT_TIMESTAMP WHERE user_id = ? AND id = ?',
-                values
-            )
-            conn.commit()
-            return True
+    updates = []
+    values = []
+    if name is not None:
+        updates.append('name = ?')
+        values.append(name)
+    if color is not None:
+        updates.append('color = ?')
+        values.append(color)
+    if not updates:
         return False
-    finally:
-        if conn:
-            conn.close()
+    values.extend([user_id, tag_id])
+
+    def update(conn):
+        cursor = conn.cursor()
+        cursor.execute(
+            f'UPDATE tags SET {", ".join(updates)}, updated_at = CURRENT_TIMESTAMP WHERE user_id = ? AND id = ?',
+            values
+        )
+        if cursor.rowcount:
+            bump_data_version(conn, user_id)
+        return cursor.rowcount > 0
+
+    updated = _write(user_id, update)
+    invalidate_tag_cache(user_id)
+    return updated
 
 def delete_tag(tag_id, user_id):
     """Delete a tag"""
-    try:
-        conn = get_db_connection()
+    def delete(conn):
         cursor = conn.cursor()
         cursor.execute('DELETE FROM tags WHERE id = ? AND user_id = ?', (tag_id, user_id))
-        conn.commit()
+        if cursor.rowcount:
+            bump_data_version(conn, user_id)
         return cursor.rowcount > 0
-    finally:
-        if conn:
-            conn.close()
+
+    deleted = _write(user_id, delete)
+    invalidate_tag_cache(user_id)
+    return deleted
 
 # Contacts related functions
+# Tag ids of a contact as a JSON array, read straight from the contact_tags key
+_CONTACT_TAG_IDS_SQL = '''(
+    SELECT json_group_array(ct.tag_id) FROM contact_tags ct WHERE ct.contact_id = c.id
+) AS tag_ids'''
+
+# Columns a contact can be projected to with ?fields=; 'tags' is its tag list
+CONTACT_FIELDS = ('id', 'user_id', 'name', 'email', 'phone', 'country_code', 'whatsapp_number',
+                  'phone_e164', 'company', 'avatar_url', 'notes', 'created_at', 'updated_at', 'tags')
+
+def parse_contact_fields(value):
+    """Parse a comma-separated field list into a CONTACT_FIELDS subset, or None for all
+
+    id and name are always included. Raises ValueError for unknown names.
+    """
+    if not value:
+        return None
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    for name in names:
+        if name not in CONTACT_FIELDS:
+            raise ValueError(f'Unknown field: {name}')
+    return tuple(field for field in CONTACT_FIELDS if field in ('id', 'name', *names))
+
+def _contact_select(fields=None):
+    """(columns, with_tags, select list) for reading fields of contacts aliased c"""
+    fields = fields or CONTACT_FIELDS
+    columns = tuple(field for field in fields if field != 'tags')
+    with_tags = 'tags' in fields
+    select = ', '.join(f'c.{column}' for column in columns)
+    if with_tags:
+        select += ', ' + _CONTACT_TAG_IDS_SQL
+    return columns, with_tags, select
+
+def _contact_rows(cursor, user_id, columns, rows, with_tags):
+    """Build contact dicts from tuple rows of columns (plus tag_ids last when with_tags)"""
+    if not with_tags:
+        return [dict(zip(columns, row)) for row in rows]
+    tag_map = get_tag_map(cursor, user_id)
+    contacts = []
+    for row in rows:
+        tag_ids = json.loads(row[-1])
+        if any(tag_id not in tag_map for tag_id in tag_ids):
+            tag_map = get_tag_map(cursor, user_id, refresh=True)
+        # zip() stops before the trailing tag_ids column
+        contact = dict(zip(columns, row))
+        contact['tags'] = [tag_map[tag_id] for tag_id in tag_ids if tag_id in tag_map]
+        contacts.append(contact)
+    return contacts
+
+def _attach_tags(cursor, user_id, contacts):
+    """Replace each contact's tag_ids (JSON text or a list) with its tags from the tag cache"""
+    tag_map = get_tag_map(cursor, user_id)
+    for contact in contacts:
+        tag_ids = contact.pop('tag_ids')
+        if isinstance(tag_ids, str):
+            tag_ids = json.loads(tag_ids)
+        if any(tag_id not in tag_map for tag_id in tag_ids):
+            # Tag created by another process since the cache was filled
+            tag_map = get_tag_map(cursor, user_id, refresh=True)
+        contact['tags'] = [tag_map[tag_id] for tag_id in tag_ids if tag_id in tag_map]
+    return contacts
+
+def _fetch_contact(cursor, contact_id, user_id):
+    """Load a single contact with its tags using an existing cursor"""
+    cursor.execute(f'''
+        SELECT c.*, {_CONTACT_TAG_IDS_SQL}
+        FROM contacts c
+        WHERE c.id = ? AND c.user_id = ?
+    ''', (contact_id, user_id))
+
+    contact = cursor.fetchone()
+    if contact:
+        _attach_tags(cursor, user_id, [contact])
+    return contact
+
+class DuplicatePhoneError(ValueError):
+    """Another of the user's contacts already has this WhatsApp number"""
+
+def _raise_if_duplicate_phone(error):
+    if 'phone_e164' in str(error):
+        raise DuplicatePhoneError('A contact with this WhatsApp number already exists') from error
+
 def create_contact(user_id, contact_data, tag_ids=None):
-    """Create a new contact with optional tags"""
-    try:
-        conn = get_db_connection()
+    """Create a new contact with optional tags
+
+    Raises DuplicatePhoneError if the WhatsApp number is already taken.
+    """
+    def insert(conn):
         cursor = conn.cursor()
         
         # Insert contact
-        cursor.execute('''
-            INSERT INTO contacts (
-                user_id, name, email, phone, country_code, whatsapp_number,
-                company, avatar_url, notes
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            user_id,
-            contact_data['name'],
-            contact_data.get('email'),
-            contact_data.get('phone'),
-            contact_data.get('country_code'),
-            contact_data.get('whatsapp_number'),
-            contact_data.get('company'),
-            contact_data.get('avatar_url'),
-            contact_data.get('notes')
-        ))
+        try:
+            cursor.execute('''
+                INSERT INTO contacts (
+                    user_id, name, email, phone, country_code, whatsapp_number,
+                    company, avatar_url, notes, phone_e164
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                RETURNING *
+            ''', (
+                user_id,
+                contact_data['name'],
+                contact_data.get('email'),
+                contact_data.get('phone'),
+                contact_data.get('country_code'),
+                contact_data.get('whatsapp_number'),
+                contact_data.get('company'),
+                contact_data.get('avatar_url'),
+                contact_data.get('notes'),
+                to_e164(contact_data.get('country_code'), contact_data.get('whatsapp_number'))
+            ))
+            contact = cursor.fetchone()
+        except sqlite3.IntegrityError as e:
+            _raise_if_duplicate_phone(e)
+            raise
         
-        contact_id = cursor.lastrowid
-        
-        # Add tags if provided
+        # Add tags if provided, skipping ids that aren't the user's tags
+        contact['tag_ids'] = []
         if tag_ids:
-            for tag_id in tag_ids:
-                cursor.execute(
-                    'INSERT INTO contact_tags (contact_id, tag_id) VALUES (?, ?)',
-                    (contact_id, tag_id)
-                )
+            cursor.execute('''
+                INSERT INTO contact_tags (contact_id, tag_id)
+                SELECT ?, id FROM tags WHERE user_id = ? AND id IN (SELECT value FROM json_each(?))
+                RETURNING tag_id
+            ''', (contact['id'], user_id, json.dumps(tag_ids)))
+            contact['tag_ids'] = sorted(row['tag_id'] for row in cursor.fetchall())
         
-        conn.commit()
-        return get_contact(contact_id, user_id)
-    finally:
-        if conn:
-            conn.close()
+        bump_data_version(conn, user_id)
+        return _attach_tags(cursor, user_id, [contact])[0]
+
+    return _write(user_id, insert)
 
 def get_contact(contact_id, user_id):
     """Get a single contact with its tags"""
-    try:
-        conn = get_db_connection()
+    with db_connection(user_id) as conn:
+        return _fetch_contact(conn.cursor(), contact_id, user_id)
+
+def get_contacts_by_ids(user_id, contact_ids, fields=None):
+    """Get the user's contacts with the given ids, in the order asked for
+
+    One query on one connection whatever the number of ids (they go in as a
+    JSON array, so there is no bound-parameter limit), with tags attached
+    from the tag cache in the same pass. Ids that don't exist or belong to
+    another user are left out; repeated ids appear once.
+    """
+    wanted = list(dict.fromkeys(contact_ids))
+    if not wanted:
+        return []
+    columns, with_tags, select = _contact_select(fields)
+    with db_connection(user_id) as conn:
         cursor = conn.cursor()
-        
-        # Get contact details
-        cursor.execute('''
-            SELECT c.*, GROUP_CONCAT(t.id) as tag_ids, GROUP_CONCAT(t.name) as tag_names, 
-                   GROUP_CONCAT(t.color) as tag_colors
+        cursor.row_factory = None
+        cursor.execute(f'''
+            SELECT {select}
             FROM contacts c
-            LEFT JOIN contact_tags ct ON c.id = ct.contact_id
-            LEFT JOIN tags t ON ct.tag_id = t.id
-            WHERE c.id = ? AND c.user_id = ?
-            GROUP BY c.id
-        ''', (contact_id, user_id))
-        
-        contact = cursor.fetchone()
-        if contact:
-            # Process tags
-            if contact['tag_ids']:
-                contact['tags'] = [
-                    {'id': tid, 'name': tname, 'color': tcolor}
-                    for tid, tname, tcolor in zip(
-                        contact['tag_ids'].split(','),
-                        contact['tag_names'].split(','),
-                        contact['tag_colors'].split(',')
-                    )
-                ]
-            else:
-                contact['tags'] = []
-                
-            # Clean up concatenated fields
-            del contact['tag_ids']
-            del contact['tag_names']
-            del contact['tag_colors']
-            
-        return contact
-    finally:
-        if conn:
-            conn.close()
+            WHERE c.user_id = ? AND c.id IN (SELECT value FROM json_each(?))
+        ''', (user_id, json.dumps(wanted)))
+        rows = cursor.fetchall()
+        cursor.row_factory = conn.row_factory
+        found = {contact['id']: contact
+                 for contact in _contact_rows(cursor, user_id, columns, rows, with_tags)}
+    return [found[contact_id] for contact_id in wanted if contact_id in found]
 
-def get_contacts(user_id, page=1, per_page=20, search=None, tag_id=None):
-    """Get paginated contacts with optional search and tag filter"""
+def find_contacts_by_phone(user_id, numbers, country_code=None):
+    """Map each of numbers to the user's contact with that WhatsApp number
+
+    Numbers are normalized to E.164 (see phones.to_e164); country_code
+    applies to numbers written without one. Returns {number: contact or None}
+    in the order given, using the (user_id, phone_e164) index.
+    """
+    normalized = {number: to_e164(country_code, number) for number in numbers}
+    wanted = list({e164 for e164 in normalized.values() if e164})
+    found = {}
+    if wanted:
+        with db_connection(user_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT c.*, {_CONTACT_TAG_IDS_SQL}
+                FROM contacts c
+                WHERE c.user_id = ? AND c.phone_e164 IN (SELECT value FROM json_each(?))
+            ''', (user_id, json.dumps(wanted)))
+            found = {contact['phone_e164']: contact
+                     for contact in _attach_tags(cursor, user_id, cursor.fetchall())}
+    return {number: found.get(e164) for number, e164 in normalized.items()}
+
+def get_contact_by_phone(user_id, number, country_code=None):
+    """Get the user's contact with a WhatsApp number, or None"""
+    return find_contacts_by_phone(user_id, [number], country_code)[number]
+
+def encode_cursor(contact):
+    """Build an opaque keyset cursor pointing just past a contact"""
+    raw = json.dumps([contact['name'], contact['id']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor_token):
+    """Decode a cursor from encode_cursor(), raising ValueError if it is malformed"""
     try:
-        conn = get_db_connection()
+        padded = cursor_token + '=' * (-len(cursor_token) % 4)
+        name, contact_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(name, str) or not isinstance(contact_id, int):
+        raise ValueError('Invalid cursor')
+    return name, contact_id
+
+_PHONE_PUNCTUATION = re.compile(r'[\s\-()+./]')
+
+def build_search_query(search, user_id):
+    """Turn free-form search text into a user's FTS5 prefix query, or None if empty
+
+    Every word must match some field as a prefix. Words that look like phone
+    numbers also match the digit-normalized phone column. Terms carry the
+    user's tenant prefix (see fts.py), so only their contacts can match.
+    """
+    stripped = _PHONE_PUNCTUATION.sub('', search)
+    if stripped.isdigit():
+        words = [stripped]
+    else:
+        words = search.split()
+
+    terms = []
+    for word in words:
+        tokens = fts.tenant_words(user_id, word)
+        if not tokens:
+            continue
+        term = '"' + ' '.join(tokens).replace('"', '""') + '"*'
+        digits = _PHONE_PUNCTUATION.sub('', word)
+        if digits.isdigit():
+            term = f'({term} OR phone_digits : "{fts.tenant_prefix(user_id)}{digits}"*)'
+        terms.append(term)
+    return ' AND '.join(terms) or None
+
+def _contact_filter(user_id, search=None, tag_id=None):
+    """Build the FROM source, WHERE clause and params selecting a user's contacts
+
+    Returns ``(source, where, params, match)``; ``match`` is the FTS query or
+    None, and when set the source exposes the FTS table as ``f``.
+    """
+    source = 'contacts c'
+    where = 'c.user_id = ?'
+    params = [user_id]
+
+    # Add search condition if provided
+    match = build_search_query(search, user_id) if search else None
+    if match:
+        # CROSS JOIN pins the FTS index as the outer loop so MATCH runs once
+        source = 'contacts_fts f CROSS JOIN contacts c ON c.id = f.rowid'
+        where = 'f.contacts_fts MATCH ? AND ' + where
+        params.insert(0, match)
+
+    # Add tag filter if provided
+    if tag_id:
+        where += ' AND EXISTS (SELECT 1 FROM contact_tags WHERE contact_id = c.id AND tag_id = ?)'
+        params.append(tag_id)
+
+    return source, where, params, match
+
+def get_contacts(user_id, page=1, per_page=20, search=None, tag_id=None,
+                 after=None, include_total=True, fields=None):
+    """Get paginated contacts with optional search and tag filter
+
+    Pages are addressed either by ``page`` (LIMIT/OFFSET) or, when ``after``
+    is not None, by a keyset cursor seeking on (user_id, name, id). An empty
+    ``after`` starts cursor pagination from the first contact. ``fields``
+    (see parse_contact_fields) limits the columns read and returned.
+    """
+    columns, with_tags, select = _contact_select(fields)
+    with db_connection(user_id) as conn:
         cursor = conn.cursor()
-        
-        # Base query
-        query = '''
-            SELECT c.*, GROUP_CONCAT(t.id) as tag_ids, GROUP_CONCAT(t.name) as tag_names,
-                   GROUP_CONCAT(t.color) as tag_colors
-            FROM contacts c
-            LEFT JOIN contact_tags ct ON c.id = ct.contact_id
-            LEFT JOIN tags t ON ct.tag_id = t.id
-            WHERE c.user_id = ?
-        '''
-        params = [user_id]
-        
-        # Add search condition if provided
-        if search:
-            query += ''' AND (
-                c.name LIKE ? OR c.email LIKE ? OR c.phone LIKE ? OR 
-                c.whatsapp_number LIKE ? OR c.company LIKE ?
-            )'''
-            search_param = f'%{search}%'
-            params.extend([search_param] * 5)
-        
-        # Add tag filter if provided
-        if tag_id:
-            query += ' AND EXISTS (SELECT 1 FROM contact_tags WHERE contact_id = c.id AND tag_id = ?)'
-            params.append(tag_id)
-        
-        # Add group by and pagination
-        query += '''
-            GROUP BY c.id
-            ORDER BY c.name
-            LIMIT ? OFFSET ?
+
+        # Filters shared by the page query and the count query
+        source, where, params, match = _contact_filter(user_id, search, tag_id)
+        inner_order = outer_order = 'c.name, c.id'
+        # Offset pages are ranked by relevance; cursor pages keep name order
+        if match and after is None:
+            inner_order = 'f.rank, c.id'
+            outer_order = 'c.search_rank, c.id'
+
+        # Pick the page from contacts alone, then look up tags for just those rows
+        page_where = where
+        page_params = list(params)
+        if after is not None:
+            if after:
+                page_where += ' AND (c.name, c.id) > (?, ?)'
+                page_params.extend(decode_cursor(after))
+            page_params.extend([per_page + 1, 0])
+        else:
+            page_params.extend([per_page, (page - 1) * per_page])
+
+        query = f'''
+            SELECT {select}
+            FROM (
+                SELECT c.*{', f.rank AS search_rank' if match else ''} FROM {source}
+                WHERE {page_where}
+                ORDER BY {inner_order}
+                LIMIT ? OFFSET ?
+            ) c
+            ORDER BY {outer_order}
         '''
-        params.extend([per_page, (page - 1) * per_page])
-        
+        # Plain tuples; each row becomes one dict in _contact_rows
+        cursor.row_factory = None
+        cursor.execute(query, page_params)
+        rows = cursor.fetchall()
+        cursor.row_factory = conn.row_factory
+        contacts = _contact_rows(cursor, user_id, columns, rows, with_tags)
+
+        result = {'contacts': contacts, 'per_page': per_page}
+
+        if after is not None:
+            has_more = len(contacts) > per_page
+            del contacts[per_page:]
+            result['has_more'] = has_more
+            result['next_cursor'] = encode_cursor(contacts[-1]) if has_more else None
+        else:
+            result['page'] = page
+
         # Get total count for pagination
-        count_query = 'SELECT COUNT(*) as total FROM contacts WHERE user_id = ?'
-        count_params = [user_id]
-        if search:
-            count_query += ''' AND (
-                name LIKE ? OR email LIKE ? OR phone LIKE ? OR 
-                whatsapp_number LIKE ? OR company LIKE ?
-            )'''
-            count_params.extend([search_param] * 5)
-        if tag_id:
-            count_query += ''' AND EXISTS (
-                SELECT 1 FROM contact_tags WHERE contact_id = contacts.id AND tag_id = ?
-            )'''
-            count_params.append(tag_id)
-            
-        # Execute queries
-        cursor.execute(count_query, count_params)
-        total = cursor.fetchone()['total']
-        
-        cursor.execute(query, params)
-        contacts = cursor.fetchall()
-        
-        # Process contacts
-        for contact in contacts:
-            if contact['tag_ids']:
-                contact['tags'] = [
-                    {'id': tid, 'name': tname, 'color': tcolor}
-                    for tid, tname, tcolor in zip(
-                        contact['tag_ids'].split(','),
-                        contact['tag_names'].split(','),
-                        contact['tag_colors'].split(',')
-                    )
-                ]
+        if include_total:
+            if match:
+                cursor.execute(f'SELECT COUNT(*) as total FROM {source} WHERE {where}', params)
+                total = cursor.fetchone()['total']
             else:
-                contact['tags'] = []
-                
-            # Clean up concatenated fields
-            del contact['tag_ids']
-            del contact['tag_names']
-            del contact['tag_colors']
-        
-        return {
-            'contacts': contacts,
-            'total': total,
-            'page': page,
-            'per_page': per_page,
-            'total_pages': (total + per_page - 1) // per_page
-        }
-    finally:
-        if conn:
-            conn.close()
+                total = _count_contacts(cursor, user_id, tag_id)
+            result['total'] = total
+            result['total_pages'] = (total + per_page - 1) // per_page
+
+        return result
 
 def update_contact(contact_id, user_id, contact_data, tag_ids=None):
-    """Update a contact and its tags"""
-    try:
-        conn = get_db_connection()
+    """Update a contact and its tags
+
+    Raises DuplicatePhoneError if the new WhatsApp number is already taken.
+    """
+    def update(conn):
         cursor = conn.cursor()
         
         # Update contact details
@@ -410,45 +1272,127 @@ def update_contact(contact_id, user_id, contact_data, tag_ids=None):
             if field in contact_data:
                 updates.append(f'{field} = ?')
                 values.append(contact_data[field])
+
+        if 'country_code' in contact_data or 'whatsapp_number' in contact_data:
+            number = {field: contact_data[field] for field in ('country_code', 'whatsapp_number')
+                      if field in contact_data}
+            if len(number) < 2:
+                cursor.execute(
+                    'SELECT country_code, whatsapp_number FROM contacts WHERE id = ? AND user_id = ?',
+                    (contact_id, user_id)
+                )
+                number = {**(cursor.fetchone() or {}), **number}
+            updates.append('phone_e164 = ?')
+            values.append(to_e164(number.get('country_code'), number.get('whatsapp_number')))
         
-        if updates:
-            values.extend([user_id, contact_id])
-            cursor.execute(
-                f'''UPDATE contacts 
-                    SET {", ".join(updates)}, updated_at = CURRENT_TIMESTAMP 
-                    WHERE user_id = ? AND id = ?''',
-                values
-            )
-        
-        # Update tags if provided
+        # Diff tags if provided: drop the links not asked for, add only the
+        # missing ones, and only ever touch the user's own contact and tags
         if tag_ids is not None:
-            # Remove existing tags
-            cursor.execute(
-                'DELETE FROM contact_tags WHERE contact_id = ?',
-                (contact_id,)
-            )
-            
-            # Add new tags
-            for tag_id in tag_ids:
+            tag_ids_json = json.dumps(tag_ids)
+            cursor.execute('''
+                DELETE FROM contact_tags
+                WHERE contact_id IN (SELECT id FROM contacts WHERE id = ? AND user_id = ?)
+                  AND tag_id NOT IN (SELECT value FROM json_each(?))
+            ''', (contact_id, user_id, tag_ids_json))
+            cursor.execute('''
+                INSERT INTO contact_tags (contact_id, tag_id)
+                SELECT c.id, t.id
+                FROM contacts c JOIN tags t ON t.user_id = c.user_id
+                WHERE c.id = ? AND c.user_id = ?
+                  AND t.id IN (SELECT value FROM json_each(?))
+                  AND NOT EXISTS (
+                      SELECT 1 FROM contact_tags ct WHERE ct.contact_id = c.id AND ct.tag_id = t.id
+                  )
+            ''', (contact_id, user_id, tag_ids_json))
+
+        # Update contact details, reading the result back in the same statement
+        if updates:
+            try:
                 cursor.execute(
-                    'INSERT INTO contact_tags (contact_id, tag_id) VALUES (?, ?)',
-                    (contact_id, tag_id)
+                    f'''UPDATE contacts 
+                        SET {", ".join(updates)}, updated_at = CURRENT_TIMESTAMP 
+                        WHERE user_id = ? AND id = ?
+                        RETURNING *, (
+                            SELECT json_group_array(ct.tag_id) FROM contact_tags ct
+                            WHERE ct.contact_id = contacts.id
+                        ) AS tag_ids''',
+                    [*values, user_id, contact_id]
                 )
-        
-        conn.commit()
-        return get_contact(contact_id, user_id)
-    finally:
-        if conn:
-            conn.close()
+                contact = cursor.fetchone()
+            except sqlite3.IntegrityError as e:
+                _raise_if_duplicate_phone(e)
+                raise
+            if contact:
+                _attach_tags(cursor, user_id, [contact])
+        else:
+            contact = _fetch_contact(cursor, contact_id, user_id)
+
+        if contact:
+            bump_data_version(conn, user_id)
+        return contact
+
+    return _write(user_id, update)
 
 def delete_contact(contact_id, user_id):
     """Delete a contact"""
-    try:
-        conn = get_db_connection()
+    def delete(conn):
         cursor = conn.cursor()
         cursor.execute('DELETE FROM contacts WHERE id = ? AND user_id = ?', (contact_id, user_id))
-        conn.commit()
+        if cursor.rowcount:
+            bump_data_version(conn, user_id)
         return cursor.rowcount > 0
-    finally:
-        if conn:
-            conn.close() 
\ No newline at end of file
+
+    return _write(user_id, delete)
+
+def _tag_selection(user_id, contact_ids=None, search=None, tag_id=None):
+    """SQL selecting the ids of a user's contacts by explicit ids or by filter"""
+    if contact_ids is not None:
+        return (
+            'SELECT c.id FROM contacts c WHERE c.user_id = ? AND c.id IN (SELECT value FROM json_each(?))',
+            [user_id, json.dumps(contact_ids)]
+        )
+    source, where, params, _ = _contact_filter(user_id, search, tag_id)
+    return f'SELECT c.id FROM {source} WHERE {where}', params
+
+def assign_tag(tag_id, user_id, contact_ids=None, search=None, filter_tag_id=None):
+    """Tag a selection of contacts in one statement
+
+    The selection is either a list of contact ids or the same search/tag
+    filter that get_contacts takes. Returns the number of contacts newly
+    tagged, or None if the tag does not belong to the user.
+    """
+    def assign(conn):
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1 FROM tags WHERE id = ? AND user_id = ?', (tag_id, user_id))
+        if not cursor.fetchone():
+            return None
+
+        selection, params = _tag_selection(user_id, contact_ids, search, filter_tag_id)
+        cursor.execute(
+            f'INSERT OR IGNORE INTO contact_tags (contact_id, tag_id) SELECT id, ? FROM ({selection})',
+            [tag_id, *params]
+        )
+        if cursor.rowcount:
+            bump_data_version(conn, user_id)
+        return cursor.rowcount
+
+    return _write(user_id, assign)
+
+def unassign_tag(tag_id, user_id, contact_ids=None, search=None, filter_tag_id=None):
+    """Untag a selection of contacts in one statement; see assign_tag()"""
+    def unassign(conn):
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1 FROM tags WHERE id = ? AND user_id = ?', (tag_id, user_id))
+        if not cursor.fetchone():
+            return None
+
+        selection, params = _tag_selection(user_id, contact_ids, search, filter_tag_id)
+        cursor.execute(
+            f'DELETE FROM contact_tags WHERE tag_id = ? AND contact_id IN ({selection})',
+            [tag_id, *params]
+        )
+        if cursor.rowcount:
+            bump_data_version(conn, user_id)
+        return cursor.rowcount
+
+    return _write(user_id, unassign)
@@ -0,0 +1,69 @@
+import csv
+import io
+import fastjson
+from db import _CONTACT_TAG_IDS_SQL, _attach_tags, db_connection
+from importer import join_tags
+
+EXPORT_FIELDS = ('id', 'name', 'email', 'phone', 'country_code', 'whatsapp_number',
+                 'company', 'avatar_url', 'notes', 'created_at', 'updated_at')
+
+
+def iter_contacts(user_id, batch_size=1000):
+    """Yield lists of a user's contacts, in id order, with their tags attached
+
+    Each page is read on its own borrowed connection, resuming after the
+    last id sent, so a slow download holds neither a pooled connection nor
+    a read snapshot (which would keep WAL checkpoints from finishing) while
+    the client catches up. Contacts edited mid-export show as of the page
+    that read them.
+    """
+    after_id = 0
+    while True:
+        with db_connection(user_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT {", ".join(f"c.{field}" for field in EXPORT_FIELDS)}, {_CONTACT_TAG_IDS_SQL}
+                FROM contacts c
+                WHERE c.user_id = ? AND c.id > ?
+                ORDER BY c.id
+                LIMIT ?
+            ''', (user_id, after_id, batch_size))
+            rows = _attach_tags(cursor, user_id, cursor.fetchall())
+        if not rows:
+            break
+        yield rows
+        if len(rows) < batch_size:
+            break
+        after_id = rows[-1]['id']
+
+
+def export_csv(user_id):
+    """Stream contacts as CSV; tags are a ';'-separated list of names
+
+    Separators inside a name are backslash-escaped, so the file imports back
+    with the same tags.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([*EXPORT_FIELDS, 'tags'])
+    for rows in iter_contacts(user_id):
+        for row in rows:
+            writer.writerow([*(row[field] for field in EXPORT_FIELDS),
+                             join_tags(tag['name'] for tag in row['tags'])])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_ndjson(user_id):
+    """Stream contacts as newline-delimited JSON objects"""
+    for rows in iter_contacts(user_id):
+        yield ''.join(fastjson.dumps(row) + '\n' for row in rows)
+
+
+# format -> (generator, mimetype)
+EXPORTERS = {
+    'csv': (export_csv, 'text/csv'),
+    'ndjson': (export_ndjson, 'application/x-ndjson'),
+}
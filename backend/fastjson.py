@@ -0,0 +1,58 @@
+import json
+from decouple import config
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 'auto' uses orjson when it is installed; 'stdlib' keeps Flask's own encoder
+JSON_ENCODER = config('JSON_ENCODER', default='auto')
+
+if JSON_ENCODER == 'orjson' and orjson is None:
+    raise RuntimeError('JSON_ENCODER is orjson but the orjson package is not installed')
+USE_ORJSON = orjson is not None and JSON_ENCODER in ('auto', 'orjson')
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson
+
+    Output matches the default provider (compact, keys sorted, dates as HTTP
+    dates) except that non-ASCII text is written as UTF-8 instead of \\u
+    escapes. Responses are encoded straight to bytes.
+    """
+
+    def _options(self):
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if self.compact is False or (self.compact is None and self._app.debug):
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self._options()),
+            mimetype=self.mimetype
+        )
+
+
+def dumps(obj):
+    """Compact JSON text for streamed output such as NDJSON exports"""
+    if USE_ORJSON:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def init_app(app):
+    """Switch the app's jsonify()/request.get_json() to the configured encoder"""
+    if USE_ORJSON:
+        app.json = OrjsonProvider(app)
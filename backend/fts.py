@@ -0,0 +1,38 @@
+"""Tenant-scoped terms for the contacts full-text index.
+
+Every tenant shares one contacts_fts table, so each indexed word is stored
+with a fixed-width tenant prefix ("u0000002a" + word). A search only ever
+names its own tenant's prefix, so MATCH walks that tenant's slice of the
+term index and a small tenant never pays for a large one's postings.
+
+The index triggers call fts_terms() from SQL, so every connection that
+writes contacts needs register() first; the sqlite3 shell can read the
+database but not insert or edit contacts.
+"""
+import re
+
+# unicode61 splits on anything that is not a letter or number
+_WORD = re.compile(r'[^\W_]+')
+# 'u' + 8 hex digits; prefix index lengths in the schema are offset by this
+PREFIX_LENGTH = 9
+
+
+def tenant_prefix(user_id):
+    return f'u{int(user_id):08x}'
+
+
+def tenant_words(user_id, text):
+    """text's words, each carrying the tenant prefix"""
+    prefix = tenant_prefix(user_id)
+    return [prefix + word for word in _WORD.findall(text)]
+
+
+def fts_terms(user_id, text):
+    """Indexed form of a column value (SQL function)"""
+    if user_id is None or text is None:
+        return None
+    return ' '.join(tenant_words(user_id, str(text)))
+
+
+def register(conn):
+    conn.create_function('fts_terms', 2, fts_terms, deterministic=True)
@@ -0,0 +1,135 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from metrics import COUNT_BUCKETS, Histogram
+
+BATCH_SIZE = Histogram('db_group_commit_operations', 'Write operations committed per group commit',
+                       buckets=COUNT_BUCKETS)
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommitWriter:
+    """Single writer thread that commits queued write operations together.
+
+    ``submit(key, operation)`` queues ``operation(conn)`` for database ``key``
+    and blocks until it has been committed. The writer takes whatever has
+    queued up, waiting up to ``window`` seconds for more and stopping at
+    ``max_ops``, and runs it as one BEGIN IMMEDIATE ... COMMIT per database.
+    Each operation runs in its own savepoint, so one that raises is rolled
+    back alone and its caller gets the exception while the rest commit.
+    Results are only handed back once the COMMIT has succeeded; if it fails
+    every caller in the group gets the error.
+
+    Operations must not commit or roll back themselves, and must not submit
+    further operations (the writer would wait on itself).
+    """
+
+    def __init__(self, connect, max_ops=64, window=0.002):
+        self.connect = connect
+        self.max_ops = max_ops
+        self.window = window
+        self._reset()
+
+    def _reset(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = os.getpid()
+
+    def submit(self, key, operation):
+        """Run operation(conn) in the next group commit on database key and return its result"""
+        if os.getpid() != self._pid:
+            # Forked worker: the parent's writer thread did not come along
+            self._reset()
+        if threading.current_thread() is self._thread:
+            raise RuntimeError('Cannot submit a write from inside a group-committed operation')
+
+        future = Future()
+        self._queue.put((key, operation, future))
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='group-commit-writer',
+                                                    daemon=True)
+                    self._thread.start()
+        return future.result()
+
+    def stop(self, timeout=10.0):
+        """Commit what is queued and stop the writer thread; the next submit() restarts it"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(None)
+        thread.join(timeout)
+        with self._lock:
+            self._thread = None
+
+    def _next_batch(self):
+        """Up to max_ops queued operations and whether stop() was called"""
+        item = self._queue.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_ops:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        while True:
+            batch, stopping = self._next_batch()
+            groups = {}
+            for key, operation, future in batch:
+                groups.setdefault(key, []).append((operation, future))
+            for key, operations in groups.items():
+                self._commit(key, operations)
+            if stopping:
+                return
+
+    def _commit(self, key, operations):
+        outcomes = []
+        try:
+            with self.connect(key) as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    for operation, future in operations:
+                        conn.execute('SAVEPOINT group_commit_op')
+                        try:
+                            outcomes.append((future, operation(conn), None))
+                        except Exception as e:
+                            conn.execute('ROLLBACK TO group_commit_op')
+                            outcomes.append((future, None, e))
+                        conn.execute('RELEASE group_commit_op')
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+        except Exception as e:
+            logger.exception("Error committing %s grouped writes", len(operations))
+            for _, future in operations:
+                future.set_exception(e)
+            return
+
+        BATCH_SIZE.observe(len(operations))
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
@@ -0,0 +1,353 @@
+import csv
+import json
+import logging
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from decouple import config
+from db import bump_data_version, db_connection, invalidate_tag_cache, shard_router
+from phones import to_e164
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = config('IMPORT_BATCH_SIZE', default=5000, cast=int)
+# Only the first rejections are kept for the report; all of them are counted
+IMPORT_MAX_REJECTIONS = config('IMPORT_MAX_REJECTIONS', default=10000, cast=int)
+# A queued or running job untouched this long (seconds) died with its process
+IMPORT_STALE_AFTER = config('IMPORT_STALE_AFTER', default=600.0, cast=float)
+
+_executor = ThreadPoolExecutor(
+    max_workers=config('IMPORT_WORKERS', default=2, cast=int),
+    thread_name_prefix='contact-import'
+)
+
+# CSV header aliases, matched after lowercasing and replacing spaces with '_'
+HEADER_ALIASES = {
+    'full_name': 'name',
+    'contact_name': 'name',
+    'e-mail': 'email',
+    'email_address': 'email',
+    'mobile': 'phone',
+    'phone_number': 'phone',
+    'whatsapp': 'whatsapp_number',
+    'countrycode': 'country_code',
+    'whatsappnumber': 'whatsapp_number',
+    'organization': 'company',
+    'note': 'notes',
+    'tag': 'tags',
+}
+
+CONTACT_FIELDS = ('name', 'email', 'phone', 'country_code', 'whatsapp_number',
+                  'company', 'avatar_url', 'notes')
+
+MAX_FIELD_LENGTH = 1000
+
+# Rows per multi-row INSERT, keeping its parameters under SQLite's 32766 limit
+_INSERT_ROWS = 1000
+_INSERT_COLUMNS = ('user_id', *CONTACT_FIELDS, 'phone_e164')
+
+# Tags in a CSV cell are split on ';' or '|'; a backslash escapes either
+# separator (or itself) inside a tag name
+_TAG_NAME = re.compile(r'(?:\\[;|\\]|[^;|])+')
+_TAG_ESCAPES = re.compile(r'\\([;|\\])')
+
+
+def split_tags(value):
+    """Tag names from a CSV tags cell"""
+    names = (name.strip() for name in _TAG_NAME.findall(value or ''))
+    return [_TAG_ESCAPES.sub(r'\1', name) for name in names if name]
+
+
+def join_tags(names):
+    """CSV tags cell for tag names; the inverse of split_tags()"""
+    return ';'.join(re.sub(r'([;|\\])', r'\\\1', name) for name in names)
+
+
+def _normalize_header(header):
+    key = (header or '').strip().lower().replace(' ', '_')
+    return HEADER_ALIASES.get(key, key)
+
+
+def normalize_row(row):
+    """Validate and normalize one CSV row.
+
+    Returns ``(contact, tag_names)`` or raises ValueError with the reason the
+    row was rejected.
+    """
+    contact = {}
+    for field in CONTACT_FIELDS:
+        value = (row.get(field) or '').strip()
+        if len(value) > MAX_FIELD_LENGTH:
+            raise ValueError(f'{field} is too long')
+        contact[field] = value or None
+
+    if not contact['name']:
+        raise ValueError('Name is required')
+
+    if contact['email']:
+        contact['email'] = contact['email'].lower()
+        if '@' not in contact['email']:
+            raise ValueError('Invalid email format')
+
+    if contact['whatsapp_number']:
+        digits = re.sub(r'\D', '', contact['whatsapp_number'])
+        if not digits:
+            raise ValueError('Invalid WhatsApp number')
+        contact['whatsapp_number'] = digits
+        if not contact['country_code']:
+            raise ValueError('Country code is required for WhatsApp number')
+
+    if contact['country_code']:
+        digits = re.sub(r'\D', '', contact['country_code'])
+        if not digits:
+            raise ValueError('Invalid country code')
+        contact['country_code'] = f'+{digits}'
+
+    contact['phone_e164'] = to_e164(contact['country_code'], contact['whatsapp_number'])
+    return contact, split_tags(row.get('tags'))
+
+
+def _resolve_tags(cursor, user_id, names, tag_cache):
+    """Map tag names to ids, creating tags that do not exist yet
+
+    Returns True if any tag had to be looked up (and possibly created).
+    """
+    missing = [name for name in names if name not in tag_cache]
+    if missing:
+        cursor.executemany(
+            'INSERT OR IGNORE INTO tags (user_id, name) VALUES (?, ?)',
+            [(user_id, name) for name in missing]
+        )
+        placeholders = ', '.join('?' * len(missing))
+        cursor.execute(
+            f'SELECT id, name FROM tags WHERE user_id = ? AND name IN ({placeholders})',
+            [user_id, *missing]
+        )
+        for tag in cursor.fetchall():
+            tag_cache[tag['name']] = tag['id']
+    return bool(missing)
+
+
+def _row_data(values):
+    return json.dumps([value[:200] for value in values[:20]])
+
+
+def _reject(job_id, line, reason, values, rejections, totals):
+    totals['rejected'] += 1
+    if totals['rejected'] <= IMPORT_MAX_REJECTIONS:
+        rejections.append((job_id, line, reason, _row_data(values)))
+
+
+def _drop_duplicate_numbers(cursor, job_id, user_id, batch, rejections, totals):
+    """Reject rows whose WhatsApp number the user (or an earlier row) already has"""
+    numbers = [contact['phone_e164'] for contact, *_ in batch if contact['phone_e164']]
+    if not numbers:
+        return batch
+    cursor.execute(
+        'SELECT phone_e164 FROM contacts WHERE user_id = ? AND phone_e164 IN (SELECT value FROM json_each(?))',
+        (user_id, json.dumps(numbers))
+    )
+    taken = {row['phone_e164'] for row in cursor.fetchall()}
+    kept = []
+    for row in batch:
+        contact, _, line, values = row
+        if contact['phone_e164'] in taken:
+            _reject(job_id, line, 'Duplicate WhatsApp number', values, rejections, totals)
+            continue
+        if contact['phone_e164']:
+            taken.add(contact['phone_e164'])
+        kept.append(row)
+    return kept
+
+
+def _write_batch(conn, job_id, user_id, batch, rejections, tag_cache, totals):
+    """Insert one batch of contacts and record progress in a single transaction"""
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    tags_changed = False
+    try:
+        # Checked under the write lock so no other writer can take a number meanwhile
+        batch = _drop_duplicate_numbers(cursor, job_id, user_id, batch, rejections, totals)
+        contact_ids = []
+        for start in range(0, len(batch), _INSERT_ROWS):
+            chunk = batch[start:start + _INSERT_ROWS]
+            placeholders = f"({', '.join('?' * len(_INSERT_COLUMNS))})"
+            cursor.execute(
+                f'''INSERT INTO contacts ({', '.join(_INSERT_COLUMNS)})
+                    VALUES {', '.join([placeholders] * len(chunk))} RETURNING id''',
+                [value for contact, *_ in chunk
+                 for value in (user_id, *(contact[field] for field in CONTACT_FIELDS), contact['phone_e164'])]
+            )
+            # RETURNING order is unspecified, but ids are handed out in VALUES order
+            contact_ids.extend(sorted(row['id'] for row in cursor.fetchall()))
+
+        if batch:
+            all_names = list({name for _, names, *_ in batch for name in names})
+            if all_names:
+                tags_changed = _resolve_tags(cursor, user_id, all_names, tag_cache)
+                cursor.executemany(
+                    'INSERT OR IGNORE INTO contact_tags (contact_id, tag_id) VALUES (?, ?)',
+                    [(contact_id, tag_cache[name])
+                     for contact_id, (_, names, *_) in zip(contact_ids, batch)
+                     for name in names]
+                )
+
+        if rejections:
+            cursor.executemany(
+                'INSERT OR IGNORE INTO import_rejections (job_id, line, reason, row_data) VALUES (?, ?, ?, ?)',
+                rejections
+            )
+
+        totals['imported'] += len(batch)
+        cursor.execute(
+            '''UPDATE import_jobs
+               SET rows_processed = ?, rows_imported = ?, rows_rejected = ?,
+                   updated_at = CURRENT_TIMESTAMP
+               WHERE id = ?''',
+            (totals['processed'], totals['imported'], totals['rejected'], job_id)
+        )
+        if batch:
+            bump_data_version(conn, user_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if tags_changed:
+        invalidate_tag_cache(user_id)
+
+
+def run_import(job_id, user_id, path):
+    """Parse the CSV at path and import it in batches, then delete the file"""
+    totals = {'processed': 0, 'imported': 0, 'rejected': 0}
+    try:
+        if not _claim(job_id, user_id):
+            logger.warning("Import job %s was failed as stale before it started", job_id)
+            return
+        with open(path, newline='', encoding='utf-8-sig', errors='replace') as f, \
+                db_connection(user_id) as conn:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if not header:
+                raise ValueError('CSV file is empty')
+            fields = [_normalize_header(name) for name in header]
+            if 'name' not in fields:
+                raise ValueError('CSV must have a name column')
+
+            tag_cache = {}
+            batch = []
+            rejections = []
+            for values in reader:
+                if not any(value.strip() for value in values):
+                    continue
+                totals['processed'] += 1
+                try:
+                    contact, tag_names = normalize_row(dict(zip(fields, values)))
+                    batch.append((contact, tag_names, reader.line_num, values))
+                except ValueError as e:
+                    _reject(job_id, reader.line_num, str(e), values, rejections, totals)
+
+                if len(batch) + len(rejections) >= IMPORT_BATCH_SIZE:
+                    _write_batch(conn, job_id, user_id, batch, rejections, tag_cache, totals)
+                    batch, rejections = [], []
+
+            _write_batch(conn, job_id, user_id, batch, rejections, tag_cache, totals)
+        _set_status(job_id, user_id, 'completed')
+    except Exception as e:
+        logger.exception("Error importing contacts for job %s", job_id)
+        _set_status(job_id, user_id, 'failed', str(e))
+    finally:
+        os.remove(path)
+
+
+def _set_status(job_id, user_id, status, error=None):
+    with db_connection(user_id) as conn:
+        conn.execute(
+            'UPDATE import_jobs SET status = ?, error = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+            (status, error, job_id)
+        )
+        conn.commit()
+
+
+def _claim(job_id, user_id):
+    """Move a queued job to running; False if it is no longer queued"""
+    with db_connection(user_id) as conn:
+        cursor = conn.execute(
+            "UPDATE import_jobs SET status = 'running', updated_at = CURRENT_TIMESTAMP "
+            "WHERE id = ? AND status = 'queued'",
+            (job_id,)
+        )
+        conn.commit()
+        return cursor.rowcount == 1
+
+
+def fail_stale_imports():
+    """Fail queued or running jobs left behind by a crashed process, once at startup
+
+    Such jobs would otherwise stay active forever and keep their tenant from
+    being moved. Jobs another process is working on are updated after every
+    batch, so only those untouched for IMPORT_STALE_AFTER seconds are failed.
+    """
+    for shard in shard_router.shard_names():
+        try:
+            with shard_router.pool(shard).connection() as conn:
+                cursor = conn.execute(
+                    '''UPDATE import_jobs
+                       SET status = 'failed', error = 'Import was interrupted', updated_at = CURRENT_TIMESTAMP
+                       WHERE status IN ('queued', 'running') AND updated_at < datetime('now', ?)''',
+                    (f'-{IMPORT_STALE_AFTER} seconds',)
+                )
+                conn.commit()
+                if cursor.rowcount:
+                    logger.warning("Failed %s stale import jobs on shard %s", cursor.rowcount, shard)
+        except Exception:
+            logger.exception("Error failing stale imports on shard %s", shard)
+
+
+def spool_upload(stream, chunk_size=64 * 1024):
+    """Copy an upload stream to a temporary file in fixed-size chunks"""
+    fd, path = tempfile.mkstemp(prefix='contacts-import-', suffix='.csv')
+    with os.fdopen(fd, 'wb') as out:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            out.write(chunk)
+    return path
+
+
+def start_import(user_id, stream, filename=None):
+    """Spool the upload to disk, queue the import and return the new job id"""
+    path = spool_upload(stream)
+    try:
+        with db_connection(user_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'INSERT INTO import_jobs (user_id, filename) VALUES (?, ?)',
+                (user_id, filename)
+            )
+            conn.commit()
+            job_id = cursor.lastrowid
+    except Exception:
+        os.remove(path)
+        raise
+    _executor.submit(run_import, job_id, user_id, path)
+    return job_id
+
+
+def get_import_job(job_id, user_id, limit=100, offset=0):
+    """Get an import job's progress with a page of its rejected rows"""
+    with db_connection(user_id) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM import_jobs WHERE id = ? AND user_id = ?', (job_id, user_id))
+        job = cursor.fetchone()
+        if job:
+            cursor.execute(
+                '''SELECT line, reason, row_data FROM import_rejections
+                   WHERE job_id = ? ORDER BY line LIMIT ? OFFSET ?''',
+                (job_id, limit, offset)
+            )
+            job['rejected'] = cursor.fetchall()
+            for rejection in job['rejected']:
+                rejection['row'] = json.loads(rejection.pop('row_data') or 'null')
+        return job
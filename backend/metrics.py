@@ -0,0 +1,253 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+from decouple import config
+from flask import Response, request
+
+logger = logging.getLogger(__name__)
+
+# Log statements slower than this many milliseconds with their query plan; 0 disables
+SLOW_QUERY_MS = config('SLOW_QUERY_MS', default=0.0, cast=float)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+# Every metric created anywhere in the app, in creation order
+ALL_METRICS = []
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        ALL_METRICS.append(self)
+
+    def _header(self):
+        return [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = self._header()
+        names = self.labels + ('le',)
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{self.name}_bucket{_format_labels(names, label_values + (bound,))} {cumulative}')
+                lines.append(f'{self.name}_bucket{_format_labels(names, label_values + ("+Inf",))} {count}')
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f'{self.name}_sum{labels} {total}')
+                lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests by route and status',
+                   ('method', 'route', 'status'))
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'HTTP request latency',
+                            ('method', 'route'))
+IN_FLIGHT = Gauge('http_requests_in_flight', 'HTTP requests currently being handled')
+REQUEST_QUERIES = Histogram('http_request_db_queries', 'SQL statements executed per request',
+                            ('route',), buckets=COUNT_BUCKETS)
+QUERY_LATENCY = Histogram('db_query_duration_seconds', 'SQL statement execution time',
+                          ('statement',))
+QUERY_ROWS = Counter('db_query_rows_total', 'Rows fetched by SQL statement', ('statement',))
+
+_request_stats = threading.local()
+
+
+# Statements that are not recorded: schema changes, PRAGMAs and transaction control
+UNRECORDED_VERBS = frozenset((
+    'ALTER', 'ANALYZE', 'ATTACH', 'BEGIN', 'COMMIT', 'CREATE', 'DETACH', 'DROP', 'END',
+    'EXPLAIN', 'PRAGMA', 'REINDEX', 'RELEASE', 'ROLLBACK', 'SAVEPOINT', 'VACUUM',
+))
+_WRITE_VERBS = ('INSERT', 'REPLACE', 'UPDATE', 'DELETE')
+_WRITE_TARGET = re.compile(r'\b(?:INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+([A-Za-z_]\w*)', re.IGNORECASE)
+_READ_SOURCE = re.compile(r'\bFROM\s+([A-Za-z_]\w*)', re.IGNORECASE)
+
+
+def _collapse(sql):
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+def statement_label(sql):
+    """Metric label for a statement: its verb and main table, e.g. 'SELECT contacts'
+
+    Labels only use names written in the app's SQL, never values, so there
+    are a bounded number of them however columns or clauses vary. Returns
+    None for statements in UNRECORDED_VERBS.
+    """
+    words = sql.split(None, 1)
+    verb = words[0].upper() if words else ''
+    if verb in UNRECORDED_VERBS:
+        return None
+    pattern = _WRITE_TARGET if verb in _WRITE_VERBS else _READ_SOURCE
+    match = pattern.search(sql)
+    return f'{verb} {match.group(1).lower()}' if match else verb
+
+
+def _log_slow_query(cursor, sql, params, elapsed):
+    plan = []
+    try:
+        # A plain cursor keeps EXPLAIN itself out of the metrics
+        explain = sqlite3.Cursor(cursor.connection)
+        explain.row_factory = None
+        for row in explain.execute(f'EXPLAIN QUERY PLAN {sql}', params):
+            plan.append(row[-1])
+    except sqlite3.Error as e:
+        plan.append(f'(no plan: {e})')
+    logger.warning("Slow query (%.1f ms): %s\n    %s", elapsed * 1000, _collapse(sql)[:500], '\n    '.join(plan))
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that records execution time, fetched rows and per-request query counts"""
+
+    _statement = None
+
+    def _record(self, sql, params, started):
+        elapsed = time.perf_counter() - started
+        self._statement = statement_label(sql)
+        if self._statement is not None:
+            QUERY_LATENCY.observe(elapsed, self._statement)
+        _request_stats.queries = getattr(_request_stats, 'queries', 0) + 1
+        if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+            _log_slow_query(self, sql, params, elapsed)
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._record(sql, parameters, started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._record(sql, (), started)
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            elapsed = time.perf_counter() - started
+            QUERY_LATENCY.observe(elapsed, 'executescript')
+
+    def _count_rows(self, n):
+        if self._statement and n:
+            QUERY_ROWS.inc(self._statement, amount=n)
+
+    def fetchone(self):
+        row = super().fetchone()
+        self._count_rows(row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._count_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._count_rows(len(rows))
+        return rows
+
+
+def render():
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    """Record per-route request metrics and serve them from GET /metrics"""
+
+    @app.before_request
+    def _start_request():
+        request._metrics_started = time.perf_counter()
+        _request_stats.queries = 0
+        IN_FLIGHT.inc()
+
+    @app.after_request
+    def _finish_request(response):
+        started = getattr(request, '_metrics_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            REQUESTS.inc(request.method, route, str(response.status_code))
+            REQUEST_LATENCY.observe(time.perf_counter() - started, request.method, route)
+            REQUEST_QUERIES.observe(getattr(_request_stats, 'queries', 0), route)
+        return response
+
+    @app.teardown_request
+    def _end_request(exc):
+        if getattr(request, '_metrics_started', None) is not None:
+            IN_FLIGHT.dec()
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,160 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION_TABLE = '''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+
+class Migration:
+    """One ordered schema step.
+
+    ``sql`` is a script of one or more statements, or a callable taking a
+    cursor. Steps must be idempotent so a half-applied step can be rerun;
+    long backfills may commit between batches to let other writers in.
+    Scripts get that for free except for ``ALTER TABLE ... ADD COLUMN``,
+    which SQLite cannot make conditional, so those statements are skipped
+    when the column already exists.
+    ``online`` steps (typically index builds) are not needed for correctness:
+    they run in the background after startup so the app can serve meanwhile.
+    Steps still apply in version order: see migrate().
+    """
+
+    def __init__(self, version, name, sql, online=False):
+        self.version = version
+        self.name = name
+        self.sql = sql
+        self.online = online
+
+    def apply(self, cursor):
+        if callable(self.sql):
+            self.sql(cursor)
+            return
+        for statement in split_statements(self.sql):
+            if not _column_exists(cursor, statement):
+                cursor.execute(statement)
+
+
+_ADD_COLUMN = re.compile(r'^\s*ALTER\s+TABLE\s+"?(\w+)"?\s+ADD\s+(?:COLUMN\s+)?"?(\w+)', re.IGNORECASE)
+
+
+def _column_exists(cursor, statement):
+    """Whether statement adds a column that the table already has"""
+    match = _ADD_COLUMN.match(statement)
+    if not match:
+        return False
+    table, column = match.groups()
+    columns = cursor.execute(f'PRAGMA table_info("{table}")').fetchall()
+    return any((row['name'] if isinstance(row, dict) else row[1]).lower() == column.lower()
+               for row in columns)
+
+
+def split_statements(script):
+    """Split a script into statements, keeping trigger bodies intact.
+
+    executescript() would commit the migration's transaction, so scripts are
+    run one statement at a time instead.
+    """
+    statements = []
+    pending = ''
+    for part in script.split(';'):
+        pending += part + ';'
+        if sqlite3.complete_statement(pending):
+            if pending.strip(' \t\n;'):
+                statements.append(pending.strip())
+            pending = ''
+    if pending.strip(' \t\n;'):
+        statements.append(pending.strip())
+    return statements
+
+
+def applied_versions(conn):
+    try:
+        rows = conn.execute('SELECT version FROM schema_version').fetchall()
+    except sqlite3.OperationalError:
+        return set()
+    return {row['version'] if isinstance(row, dict) else row[0] for row in rows}
+
+
+def _apply(conn, migration):
+    """Apply one step under the write lock unless another process beat us to it"""
+    # A plain cursor keeps schema changes and backfills out of the query metrics
+    cursor = sqlite3.Cursor(conn)
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        if migration.version in applied_versions(cursor):
+            conn.rollback()
+            return False
+        started = time.perf_counter()
+        migration.apply(cursor)
+        cursor.execute(
+            'INSERT INTO schema_version (version, name) VALUES (?, ?)',
+            (migration.version, migration.name)
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logger.info("Applied migration %s (%s) in %.2fs",
+                migration.version, migration.name, time.perf_counter() - started)
+    return True
+
+
+def pending_migrations(conn, migrations):
+    applied = applied_versions(conn)
+    return [m for m in sorted(migrations, key=lambda m: m.version) if m.version not in applied]
+
+
+def migrate(conn, migrations, online=True):
+    """Bring the schema up to date; returns the online steps still to run.
+
+    When every step is already recorded this is a single SELECT. Steps run
+    here in version order, each in its own transaction. Only online steps
+    after the last pending blocking one are returned for the background
+    (none if ``online`` is False): an online step followed by a blocking
+    one runs inline, so a later step may rely on every earlier one.
+    """
+    pending = pending_migrations(conn, migrations)
+    if not pending:
+        return []
+
+    conn.execute(SCHEMA_VERSION_TABLE)
+    inline = len(pending)
+    while online and inline and pending[inline - 1].online:
+        inline -= 1
+    for migration in pending[:inline]:
+        _apply(conn, migration)
+    return pending[inline:]
+
+
+def run_online(connection, migrations):
+    """Apply online steps on a background thread.
+
+    ``connection`` is a context-manager factory such as ``db_connection``.
+    Readers keep going while an index builds; writers wait on SQLite's busy
+    timeout only while each individual step holds the write lock.
+    """
+    if not migrations:
+        return None
+
+    def _run():
+        for migration in migrations:
+            try:
+                with connection() as conn:
+                    _apply(conn, migration)
+            except Exception:
+                logger.exception("Error applying migration %s (%s)", migration.version, migration.name)
+                return
+
+    thread = threading.Thread(target=_run, name='schema-migrations', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,92 @@
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import bcrypt
+from decouple import config
+
+logger = logging.getLogger(__name__)
+
+# bcrypt releases the GIL while hashing, so a small thread pool caps how many
+# cores auth bursts can take without blocking unrelated requests
+BCRYPT_ROUNDS = config('BCRYPT_ROUNDS', default=12, cast=int)
+PASSWORD_HASH_WORKERS = config('PASSWORD_HASH_WORKERS', default=max(1, (os.cpu_count() or 2) // 2), cast=int)
+# Hashes allowed to be running or waiting before new ones are refused
+PASSWORD_HASH_QUEUE_LIMIT = config('PASSWORD_HASH_QUEUE_LIMIT', default=PASSWORD_HASH_WORKERS * 8, cast=int)
+PASSWORD_HASH_TIMEOUT = config('PASSWORD_HASH_TIMEOUT', default=10.0, cast=float)
+# Seconds suggested to clients in Retry-After when the pool is saturated
+PASSWORD_HASH_RETRY_AFTER = config('PASSWORD_HASH_RETRY_AFTER', default=2, cast=int)
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_QUEUE_LIMIT)
+
+_COST_RE = re.compile(rb'^\$2[abxy]?\$(\d{2})\$')
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing queue is full; callers should answer 503"""
+
+    retry_after = PASSWORD_HASH_RETRY_AFTER
+
+
+def _submit(fn, *args, wait=True):
+    if not _slots.acquire(blocking=False):
+        raise PasswordHasherBusy('Password hashing queue is full')
+    try:
+        future = _executor.submit(fn, *args)
+    except Exception:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    if not wait:
+        return future
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except TimeoutError:
+        raise PasswordHasherBusy('Password hashing timed out')
+
+
+def _to_bytes(value):
+    return value.encode('utf-8') if isinstance(value, str) else value
+
+
+def hash_password(password, rounds=None):
+    """Hash a password on the worker pool"""
+    return _submit(_hash, _to_bytes(password), rounds or BCRYPT_ROUNDS)
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def check_password(password, hashed):
+    """Check a password against a stored hash on the worker pool"""
+    return _submit(bcrypt.checkpw, _to_bytes(password), _to_bytes(hashed))
+
+
+def needs_rehash(hashed):
+    """True if hashed was made with a different cost than BCRYPT_ROUNDS"""
+    match = _COST_RE.match(_to_bytes(hashed))
+    return match is None or int(match.group(1)) != BCRYPT_ROUNDS
+
+
+def rehash_in_background(password, on_done):
+    """Rehash with the configured cost and pass the new hash to on_done.
+
+    Best effort: skipped when the pool is saturated, since the next login
+    gets another chance.
+    """
+    try:
+        future = _submit(_hash, _to_bytes(password), BCRYPT_ROUNDS, wait=False)
+    except PasswordHasherBusy:
+        return None
+
+    def _store(done):
+        try:
+            on_done(done.result())
+        except Exception:
+            logger.exception("Error rehashing password")
+
+    future.add_done_callback(_store)
+    return future
@@ -0,0 +1,32 @@
+import re
+
+_NON_DIGITS = re.compile(r'\D')
+
+
+def to_e164(country_code, number):
+    """Normalize a country code and local number to E.164 ('+<digits>'), or None
+
+    A number written with a leading '+' or '00' is taken as already
+    international and the country code is ignored. Otherwise a single
+    national trunk prefix '0' is dropped, so '+44' and '07700 900123' give
+    '+447700900123'. Anything outside 7-15 digits returns None. Either part
+    may be a number, as JSON clients sometimes send them.
+    """
+    if not number:
+        return None
+    number = str(number).strip()
+    if number.startswith('+'):
+        digits = _NON_DIGITS.sub('', number)
+    elif number.startswith('00'):
+        digits = _NON_DIGITS.sub('', number)[2:]
+    else:
+        code = _NON_DIGITS.sub('', str(country_code or ''))
+        national = _NON_DIGITS.sub('', number)
+        if not code or not national:
+            return None
+        if national.startswith('0'):
+            national = national[1:]
+        digits = code + national
+    if not 7 <= len(digits) <= 15 or digits.startswith('0'):
+        return None
+    return '+' + digits
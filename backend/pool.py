@@ -0,0 +1,190 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection that goes back to its pool on close()"""
+
+    pool = None
+    last_used = 0.0
+    cursor_factory = sqlite3.Cursor
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or self.cursor_factory)
+
+    # sqlite3's shortcut methods build a plain Cursor internally; route them
+    # through cursor() so cursor_factory applies to them too
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            super().close()
+
+    def discard(self):
+        """Really close the underlying connection"""
+        self.pool = None
+        super().close()
+
+
+class ConnectionPool:
+    """Bounded pool of tuned SQLite connections.
+
+    Connections are created lazily up to ``size``. A thread that already holds
+    a connection gets the same one back from nested ``connection()`` blocks, so
+    helpers that call other helpers never need a second connection.
+    """
+
+    def __init__(self, path, size=8, timeout=10.0, pragmas=None,
+                 row_factory=None, cursor_factory=None, healthcheck_interval=30.0, init=None):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = pragmas or {}
+        self.row_factory = row_factory
+        self.cursor_factory = cursor_factory
+        self.healthcheck_interval = healthcheck_interval
+        # Called with each new connection, e.g. to register SQL functions
+        self.init = init
+        self.closed = False
+        self._reset()
+
+    def _reset(self):
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            factory=PooledConnection,
+        )
+        conn.row_factory = self.row_factory
+        if self.cursor_factory is not None:
+            conn.cursor_factory = self.cursor_factory
+        for name, value in self.pragmas.items():
+            if value is not None:
+                conn.execute(f'PRAGMA {name} = {value}')
+        if self.init is not None:
+            self.init(conn)
+        conn.pool = self
+        return conn
+
+    def _healthy(self, conn):
+        if time.monotonic() - conn.last_used < self.healthcheck_interval:
+            return True
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self):
+        """Check a connection out of the pool, blocking up to ``timeout``"""
+        if os.getpid() != self._pid:
+            # Forked worker: never share the parent's sqlite handles
+            self._reset()
+
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            self._local.depth += 1
+            return held
+
+        conn = None
+        while conn is None:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        conn = self._connect()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                    break
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise sqlite3.OperationalError('Connection pool exhausted')
+
+            if not self._healthy(conn):
+                self._drop(conn)
+                conn = None
+
+        self._local.conn = conn
+        self._local.depth = 1
+        return conn
+
+    def release(self, conn):
+        """Return a connection; only the outermost release hands it back"""
+        if getattr(self._local, 'conn', None) is conn:
+            self._local.depth -= 1
+            if self._local.depth > 0:
+                return
+            self._local.conn = None
+
+        if conn.pool is not self:
+            return
+        if self.closed:
+            self._drop(conn)
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._drop(conn)
+            return
+        conn.last_used = time.monotonic()
+        self._idle.put(conn)
+
+    def _drop(self, conn):
+        with self._lock:
+            self._created -= 1
+        try:
+            conn.discard()
+        except sqlite3.Error:
+            pass
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Stop keeping connections: idle ones close now, borrowed ones when released
+
+        A closed pool still hands out connections, it just doesn't keep them.
+        """
+        self.closed = True
+        self.dispose()
+
+    def dispose(self):
+        """Close every idle connection, e.g. before the database file is replaced"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._drop(conn)
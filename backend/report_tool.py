@@ -0,0 +1,80 @@
+"""Check and rebuild campaign report rollups.
+
+    python report_tool.py check
+    python report_tool.py rebuild --user 42
+    python report_tool.py rebuild --campaign 7 --campaign 9
+
+Rollups are kept by triggers, so these are only needed after editing
+campaign_messages by hand or restoring a partial backup. `check` compares
+them with the messages and exits 1 on any difference; `rebuild` recomputes
+them, one write transaction per campaign batch.
+"""
+import argparse
+import sys
+
+from db import init_db, shard_router
+from reports import campaign_stats_drift, rebuild_campaign_stats
+
+# Campaigns recomputed per transaction
+BATCH = 50
+
+
+def _campaigns(args):
+    """(shard, [campaign ids]) for each shard holding campaigns the arguments select"""
+    clauses, params = [], []
+    if args.user:
+        clauses.append(f"user_id IN ({', '.join('?' * len(args.user))})")
+        params.extend(args.user)
+    if args.campaign:
+        clauses.append(f"id IN ({', '.join('?' * len(args.campaign))})")
+        params.extend(args.campaign)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    for shard in shard_router.shard_names():
+        with shard_router.pool(shard).connection() as conn:
+            ids = [row['id'] for row in conn.execute(f'SELECT id FROM campaigns {where} ORDER BY id', params)]
+        if ids:
+            yield shard, ids
+
+
+def check(args):
+    drifted = 0
+    for shard, ids in _campaigns(args):
+        with shard_router.pool(shard).connection() as conn:
+            for start in range(0, len(ids), BATCH):
+                for campaign_id, grain, bucket, status, stored, actual in campaign_stats_drift(
+                        conn, ids[start:start + BATCH]):
+                    drifted += 1
+                    print(f"{shard}: campaign {campaign_id} {grain} {bucket} {status}: "
+                          f"{stored} stored, {actual} actual")
+    print(f'{drifted} rollup rows differ' if drifted else 'Rollups match')
+    return 1 if drifted else 0
+
+
+def rebuild(args):
+    rebuilt = 0
+    for shard, ids in _campaigns(args):
+        with shard_router.pool(shard).connection() as conn:
+            for start in range(0, len(ids), BATCH):
+                rebuild_campaign_stats(conn, ids[start:start + BATCH])
+        rebuilt += len(ids)
+        print(f'{shard}: rebuilt {len(ids)} campaigns')
+    print(f'Rebuilt {rebuilt} campaigns')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (('check', 'compare rollups with campaign messages'),
+                            ('rebuild', 'recompute rollups from campaign messages')):
+        sub = commands.add_parser(name, help=help_text)
+        sub.add_argument('--user', type=int, action='append', help='only this tenant (repeatable)')
+        sub.add_argument('--campaign', type=int, action='append', help='only this campaign (repeatable)')
+    args = parser.parse_args(argv)
+
+    init_db()
+    handler = {'check': check, 'rebuild': rebuild}[args.command]
+    return handler(args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+import json
+import math
+import time
+from decouple import config
+from db import (
+    REPORT_GRAINS, REPORT_MILESTONES, campaign_milestones_sql, campaign_stats_rebuild_sql, db_connection
+)
+from campaigns import parse_send_at
+
+REPORT_STATUSES = [status for status, _ in REPORT_MILESTONES]
+GRANULARITIES = {'hour': ('hourly', 3600), 'day': ('daily', 86400)}
+# Default time series windows
+REPORT_DEFAULT_HOURS = config('REPORT_DEFAULT_HOURS', default=48, cast=int)
+REPORT_DEFAULT_DAYS = config('REPORT_DEFAULT_DAYS', default=30, cast=int)
+# Longest series one request may ask for
+REPORT_MAX_BUCKETS = 1000
+
+_TOTALS_SQL = ', '.join(
+    f"COALESCE(SUM(s.count) FILTER (WHERE s.status = '{status}'), 0) AS {status}"
+    for status in REPORT_STATUSES
+)
+
+
+def parse_time(value):
+    """Unix time from unix seconds or ISO 8601 (naive means UTC); None stays None"""
+    if value is None or value == '':
+        return None
+    try:
+        moment = float(value)
+    except ValueError:
+        return parse_send_at(value)
+    if not math.isfinite(moment):
+        raise ValueError(f'Invalid time: {value}')
+    return moment
+
+
+def _rates(totals):
+    totals['delivery_rate'] = round(100.0 * totals['delivered'] / totals['sent'], 1) if totals['sent'] else None
+    totals['read_rate'] = round(100.0 * totals['read'] / totals['delivered'], 1) if totals['delivered'] else None
+    return totals
+
+
+def _grain(start, end):
+    """Daily rollups when both bounds fall on UTC midnight, hourly ones otherwise"""
+    if all(bound is None or bound % 86400 == 0 for bound in (start, end)):
+        return 'daily', 86400
+    return 'hourly', 3600
+
+
+def _range_sql(start, end, seconds):
+    """WHERE fragment and parameters for buckets overlapping [start, end)"""
+    clauses, params = [], []
+    if start is not None:
+        clauses.append('s.bucket >= ?')
+        params.append(int(start // seconds) * seconds)
+    if end is not None:
+        clauses.append('s.bucket < ?')
+        params.append(end)
+    return ''.join(f' AND {clause}' for clause in clauses), params
+
+
+def get_summary(user_id, start=None, end=None):
+    """Message milestones across all of a user's campaigns, optionally within [start, end)
+
+    Counts come from the rollups, so bounds are rounded out to whole hours,
+    or whole UTC days when both are at midnight.
+    """
+    grain, seconds = _grain(start, end)
+    where, params = _range_sql(start, end, seconds)
+    with db_connection(user_id) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT {_TOTALS_SQL}
+            FROM campaign_stats_{grain} s JOIN campaigns c ON c.id = s.campaign_id
+            WHERE c.user_id = ?{where}
+        ''', (user_id, *params))
+        totals = cursor.fetchone()
+        cursor.execute('SELECT COUNT(*) AS campaigns FROM campaigns WHERE user_id = ?', (user_id,))
+        totals['campaigns'] = cursor.fetchone()['campaigns']
+    return _rates(totals)
+
+
+def get_campaign_reports(user_id, campaign_id=None):
+    """Milestone totals for each of a user's campaigns, newest first"""
+    with db_connection(user_id) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT c.id, c.title, c.status, c.scheduled_at, c.completed_at, c.total_messages, {_TOTALS_SQL}
+            FROM campaigns c LEFT JOIN campaign_stats_daily s ON s.campaign_id = c.id
+            WHERE c.user_id = ? {'AND c.id = ?' if campaign_id is not None else ''}
+            GROUP BY c.id
+            ORDER BY c.id DESC
+        ''', (user_id,) if campaign_id is None else (user_id, campaign_id))
+        return [_rates(report) for report in cursor.fetchall()]
+
+
+def get_timeseries(user_id, granularity='day', start=None, end=None, campaign_id=None):
+    """Milestone counts per hour or UTC day, for all campaigns or one
+
+    Defaults to the last REPORT_DEFAULT_HOURS hours or REPORT_DEFAULT_DAYS
+    days. Every bucket in the range is listed, empty ones with zeros.
+    Raises ValueError for an unknown granularity or an overlong range;
+    returns None if the campaign is not the user's.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError('granularity must be hour or day')
+    grain, seconds = GRANULARITIES[granularity]
+    end = time.time() if end is None else end
+    if start is None:
+        start = end - (REPORT_DEFAULT_HOURS * 3600 if granularity == 'hour' else REPORT_DEFAULT_DAYS * 86400)
+    first = int(start // seconds) * seconds
+    buckets = range(first, math.ceil(end), seconds)
+    if len(buckets) > REPORT_MAX_BUCKETS:
+        raise ValueError(f'At most {REPORT_MAX_BUCKETS} {granularity}s per series')
+
+    with db_connection(user_id) as conn:
+        cursor = conn.cursor()
+        if campaign_id is not None:
+            cursor.execute('SELECT 1 FROM campaigns WHERE id = ? AND user_id = ?', (campaign_id, user_id))
+            if not cursor.fetchone():
+                return None
+        cursor.execute(f'''
+            SELECT s.bucket, s.status, SUM(s.count) AS count
+            FROM campaign_stats_{grain} s JOIN campaigns c ON c.id = s.campaign_id
+            WHERE c.user_id = ? {'AND c.id = ?' if campaign_id is not None else ''}
+              AND s.bucket >= ? AND s.bucket < ?
+            GROUP BY s.bucket, s.status
+        ''', (user_id, *(() if campaign_id is None else (campaign_id,)), first, end))
+        rows = cursor.fetchall()
+
+    series = {bucket: dict.fromkeys(REPORT_STATUSES, 0) for bucket in buckets}
+    for row in rows:
+        if row['bucket'] in series:
+            series[row['bucket']][row['status']] = row['count']
+    return {
+        'granularity': granularity,
+        'from': first,
+        'to': end,
+        'series': [{'bucket': bucket, **counts} for bucket, counts in series.items()],
+    }
+
+
+def rebuild_campaign_stats(conn, campaign_ids):
+    """Recompute the rollups of some campaigns from their messages, in one transaction"""
+    ids = json.dumps(list(campaign_ids))
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for statement in campaign_stats_rebuild_sql('SELECT value FROM json_each(:ids)'):
+            conn.execute(statement, {'ids': ids})
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def campaign_stats_drift(conn, campaign_ids):
+    """(campaign id, grain, bucket, status, stored, actual) wherever the rollups disagree with the messages"""
+    ids = json.dumps(list(campaign_ids))
+    drift = []
+    for grain, seconds in REPORT_GRAINS:
+        milestones = campaign_milestones_sql('SELECT value FROM json_each(:ids)')
+        rows = conn.execute(f'''
+            WITH actual AS (
+                SELECT campaign_id, CAST(at / {seconds} AS INTEGER) * {seconds} AS bucket, status,
+                       COUNT(*) AS count
+                FROM ({milestones})
+                GROUP BY campaign_id, bucket, status
+            ),
+            stored AS (
+                SELECT campaign_id, bucket, status, count FROM campaign_stats_{grain}
+                WHERE campaign_id IN (SELECT value FROM json_each(:ids)) AND count != 0
+            ),
+            keys AS (
+                SELECT campaign_id, bucket, status FROM actual
+                UNION SELECT campaign_id, bucket, status FROM stored
+            )
+            SELECT k.campaign_id, k.bucket, k.status,
+                   COALESCE(s.count, 0) AS stored, COALESCE(a.count, 0) AS actual
+            FROM keys k
+            LEFT JOIN stored s USING (campaign_id, bucket, status)
+            LEFT JOIN actual a USING (campaign_id, bucket, status)
+            WHERE COALESCE(s.count, 0) != COALESCE(a.count, 0)
+        ''', {'ids': ids}).fetchall()
+        drift.extend((row['campaign_id'], grain, row['bucket'], row['status'], row['stored'], row['actual'])
+                     for row in rows)
+    return drift
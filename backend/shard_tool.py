@@ -0,0 +1,95 @@
+"""Inspect and rebalance tenant shards.
+
+    python shard_tool.py list
+    python shard_tool.py move 42 shard-3
+    python shard_tool.py rebalance --dry-run
+
+`move` blocks the tenant for about SHARD_MAP_TTL seconds plus the copy, and
+resumes an interrupted move when run again. `rebalance` moves every tenant
+whose shard differs from where SHARD_STRATEGY would place it now, e.g. after
+enabling sharding on an existing database or changing SHARD_COUNT.
+"""
+import argparse
+import os
+import sys
+
+from db import init_db, shard_router
+from shards import CATALOG_SHARD, move_tenant
+
+
+def _tenant_counts():
+    with shard_router.catalog.connection() as conn:
+        rows = conn.execute('''
+            SELECT COALESCE(ts.shard, ?) AS shard, COUNT(*) AS tenants,
+                   SUM(ts.moving_to IS NOT NULL OR ts.moved_from IS NOT NULL) AS moving
+            FROM users u LEFT JOIN tenant_shards ts ON ts.user_id = u.id
+            GROUP BY 1
+        ''', (CATALOG_SHARD,)).fetchall()
+    return {row['shard']: row for row in rows}
+
+
+def list_shards(args):
+    counts = _tenant_counts()
+    print(f"{'shard':<24} {'tenants':>8} {'moving':>7} {'size MB':>9}")
+    for name in shard_router.shard_names():
+        path = shard_router.path(name)
+        size = sum(os.path.getsize(path + suffix) for suffix in ('', '-wal')
+                   if os.path.exists(path + suffix))
+        row = counts.get(name) or {'tenants': 0, 'moving': 0}
+        print(f"{name:<24} {row['tenants']:>8} {row['moving']:>7} {size / 1e6:>9.1f}")
+
+
+def move(args):
+    if not move_tenant(shard_router, args.user_id, args.shard, wait=args.wait):
+        print(f'Tenant {args.user_id} is already on {args.shard}')
+
+
+def rebalance(args):
+    with shard_router.catalog.connection() as conn:
+        placements = conn.execute('''
+            SELECT u.id, COALESCE(ts.shard, ?) AS shard, ts.moving_to, ts.moved_from
+            FROM users u LEFT JOIN tenant_shards ts ON ts.user_id = u.id
+            ORDER BY u.id
+        ''', (CATALOG_SHARD,)).fetchall()
+
+    failed = 0
+    for placement in placements:
+        target = placement['moving_to'] or shard_router.strategy(placement['id'])
+        if target == placement['shard'] and not placement['moved_from']:
+            continue
+        if args.dry_run:
+            print(f"Tenant {placement['id']}: {placement['shard']} -> {target}")
+            continue
+        try:
+            move_tenant(shard_router, placement['id'], target, wait=args.wait)
+        except ValueError as e:
+            failed += 1
+            print(f"Error moving tenant {placement['id']}: {str(e)}")
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='shards with tenant counts and file sizes')
+    move_parser = commands.add_parser('move', help='move one tenant to a shard')
+    move_parser.add_argument('user_id', type=int)
+    move_parser.add_argument('shard')
+    rebalance_parser = commands.add_parser('rebalance', help='move tenants to their SHARD_STRATEGY shard')
+    rebalance_parser.add_argument('--dry-run', action='store_true')
+    for sub in (move_parser, rebalance_parser):
+        sub.add_argument('--wait', type=float, help='seconds to let cached shard maps expire '
+                                                   '(default SHARD_MAP_TTL)')
+    args = parser.parse_args(argv)
+
+    init_db()
+    handler = {'list': list_shards, 'move': move, 'rebalance': rebalance}[args.command]
+    try:
+        return handler(args) or 0
+    except ValueError as e:
+        print(f"Error: {str(e)}")
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
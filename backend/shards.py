@@ -0,0 +1,431 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from decouple import config
+import fts
+
+# How new tenants are placed; see STRATEGIES. 'single' keeps everything in
+# the catalog file, which is how the app ran before sharding existed.
+SHARD_STRATEGY = config('SHARD_STRATEGY', default='single')
+# Number of shard files for the 'bucket' strategy
+SHARD_COUNT = config('SHARD_COUNT', default=4, cast=int)
+# Seconds a process trusts its cached tenant -> shard map; shard moves wait this long
+SHARD_MAP_TTL = config('SHARD_MAP_TTL', default=5.0, cast=float)
+SHARD_MAP_CACHE_USERS = config('SHARD_MAP_CACHE_USERS', default=100000, cast=int)
+# Shard pools a process keeps open; the least recently used beyond this are closed
+SHARD_POOLS_OPEN = config('SHARD_POOLS_OPEN', default=64, cast=int)
+
+# The catalog (DATABASE_PATH) doubles as the shard of unmapped and 'single' tenants
+CATALOG_SHARD = 'main'
+SHARD_NAME = re.compile(r'^[a-z0-9][a-z0-9_-]{0,62}$')
+
+# Each shard hands out ids from its own range (shard id << ID_RANGE_BITS) so a
+# tenant keeps its ids when moved. 32 bits per shard leaves 2**21 shards
+# before ids pass JavaScript's 2**53.
+ID_RANGE_BITS = 32
+ID_RANGE_TABLES = ('tags', 'contacts', 'import_jobs', 'campaigns', 'campaign_messages')
+
+# Catalog tables, created by a migration in every file but only used in the catalog
+CATALOG_SCHEMA = f'''
+    CREATE TABLE IF NOT EXISTS shards (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    INSERT OR IGNORE INTO shards (id, name) VALUES (0, '{CATALOG_SHARD}');
+
+    CREATE TABLE IF NOT EXISTS tenant_shards (
+        user_id INTEGER PRIMARY KEY,
+        shard TEXT NOT NULL,
+        moving_to TEXT,
+        moved_from TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE INDEX IF NOT EXISTS tenant_shards_shard_idx ON tenant_shards(shard);
+'''
+
+# Which shards have work for a background job (see ShardRouter.mark), so the
+# job need not open every shard to find out; catalog only
+SHARD_WORK_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS shard_work (
+        kind TEXT NOT NULL,
+        shard TEXT NOT NULL,
+        marked_at REAL NOT NULL,
+        PRIMARY KEY (kind, shard)
+    ) WITHOUT ROWID;
+'''
+
+
+class TenantMovingError(Exception):
+    """The tenant is being moved between shards; retry shortly"""
+
+
+def _single(user_id):
+    return CATALOG_SHARD
+
+
+def _bucket(user_id):
+    return f'shard-{user_id % SHARD_COUNT}'
+
+
+def _tenant(user_id):
+    return f'tenant-{user_id}'
+
+
+# name -> callable(user_id) returning the shard a new tenant is placed on
+STRATEGIES = {
+    'single': _single,
+    'bucket': _bucket,
+    'tenant': _tenant,
+}
+
+
+class ShardRouter:
+    """Maps tenants to SQLite files and hands out pooled connections to them.
+
+    The catalog holds users (credentials, lookups by email/number) and the
+    tenant -> shard map. Each shard file carries the full schema plus a copy
+    of its tenants' user rows, so foreign keys and cascades stay local and a
+    write only ever locks its own tenant's file. Tenants with no map entry
+    (created before sharding was enabled) live in the catalog.
+
+    ``open_pool(path)`` builds a ConnectionPool and ``prepare(pool)`` brings
+    its schema up to date; both come from db.py. Shards are opened, and
+    migrated, the first time a process uses them, and only the
+    SHARD_POOLS_OPEN most recently used stay open, so file handles and
+    memory do not grow with the number of tenants.
+    """
+
+    def __init__(self, catalog_path, shard_dir, open_pool, prepare, strategy=None):
+        strategy = strategy or SHARD_STRATEGY
+        if strategy not in STRATEGIES:
+            raise ValueError(f'Unknown SHARD_STRATEGY: {strategy}')
+        self.catalog_path = catalog_path
+        self.shard_dir = shard_dir
+        self.strategy = STRATEGIES[strategy]
+        self._open_pool = open_pool
+        self._prepare = prepare
+        self._catalog = open_pool(catalog_path)
+        # Open shard pools, least recently used first
+        self._pools = OrderedDict()
+        self._pools_lock = threading.Lock()
+        # Shards this process has registered and migrated
+        self._ready = set()
+        self._map = OrderedDict()
+        self._map_lock = threading.Lock()
+
+    @property
+    def catalog(self):
+        return self._catalog
+
+    def path(self, name):
+        if name == CATALOG_SHARD:
+            return self.catalog_path
+        if not SHARD_NAME.match(name):
+            raise ValueError(f'Invalid shard name: {name}')
+        return os.path.join(self.shard_dir, f'{name}.sqlite')
+
+    def pool(self, name):
+        """The pool for a shard, creating and migrating the file on first use"""
+        if name == CATALOG_SHARD:
+            return self._catalog
+        with self._pools_lock:
+            pool = self._pools.get(name)
+            if pool is not None:
+                self._pools.move_to_end(name)
+                return pool
+            pool = self._open_pool(self.path(name))
+            if name not in self._ready:
+                shard_id = self._register(name)
+                self._prepare(pool)
+                self._reserve_ids(pool, shard_id)
+                self._ready.add(name)
+            self._pools[name] = pool
+            while len(self._pools) > SHARD_POOLS_OPEN:
+                self._pools.popitem(last=False)[1].close()
+            return pool
+
+    def _register(self, name):
+        with self.catalog.connection() as conn:
+            conn.execute('INSERT OR IGNORE INTO shards (name) VALUES (?)', (name,))
+            conn.commit()
+            return conn.execute('SELECT id FROM shards WHERE name = ?', (name,)).fetchone()['id']
+
+    def _reserve_ids(self, pool, shard_id):
+        """Start the shard's AUTOINCREMENT counters at the bottom of its id range"""
+        base = shard_id << ID_RANGE_BITS
+        if not base:
+            return
+        with pool.connection() as conn:
+            for table in ID_RANGE_TABLES:
+                cursor = conn.execute(
+                    'UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?', (base, table)
+                )
+                if not cursor.rowcount:
+                    conn.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, base))
+            conn.commit()
+
+    def shard_names(self):
+        """Every registered shard, catalog first"""
+        with self.catalog.connection() as conn:
+            return [row['name'] for row in conn.execute('SELECT name FROM shards ORDER BY id').fetchall()]
+
+    def open_catalog(self):
+        """Migrate the catalog; shards are migrated as they are first opened"""
+        self._prepare(self.catalog)
+
+    # Work marks: a background job marks the shards it has work on, then
+    # visits only marked() shards instead of every one
+
+    def mark(self, shard, kind):
+        with self.catalog.connection() as conn:
+            conn.execute('''
+                INSERT INTO shard_work (kind, shard, marked_at) VALUES (?, ?, ?)
+                ON CONFLICT (kind, shard) DO UPDATE SET marked_at = excluded.marked_at
+            ''', (kind, shard, time.time()))
+            conn.commit()
+
+    def marked(self, kind):
+        """{shard: time last marked} for the shards marked for kind"""
+        with self.catalog.connection() as conn:
+            rows = conn.execute('SELECT shard, marked_at FROM shard_work WHERE kind = ?', (kind,)).fetchall()
+        return {row['shard']: row['marked_at'] for row in rows}
+
+    def unmark(self, shard, kind, marked_at):
+        """Clear a mark, unless it was renewed after marked_at"""
+        with self.catalog.connection() as conn:
+            conn.execute(
+                'DELETE FROM shard_work WHERE kind = ? AND shard = ? AND marked_at <= ?',
+                (kind, shard, marked_at)
+            )
+            conn.commit()
+
+    # Routing
+
+    def lookup(self, user_id):
+        """(shard, moving) for a tenant, cached for SHARD_MAP_TTL seconds"""
+        now = time.monotonic()
+        with self._map_lock:
+            entry = self._map.get(user_id)
+            if entry is not None and now - entry[2] < SHARD_MAP_TTL:
+                self._map.move_to_end(user_id)
+                return entry[0], entry[1]
+
+        with self.catalog.connection() as conn:
+            row = conn.execute(
+                'SELECT shard, moving_to FROM tenant_shards WHERE user_id = ?', (user_id,)
+            ).fetchone()
+        shard, moving = (row['shard'], row['moving_to'] is not None) if row else (CATALOG_SHARD, False)
+        with self._map_lock:
+            self._map[user_id] = (shard, moving, now)
+            self._map.move_to_end(user_id)
+            while len(self._map) > SHARD_MAP_CACHE_USERS:
+                self._map.popitem(last=False)
+        return shard, moving
+
+    def shard_for(self, user_id):
+        """Name of the shard holding a tenant's data; raises TenantMovingError mid-move"""
+        shard, moving = self.lookup(user_id)
+        if moving:
+            raise TenantMovingError(f'Tenant {user_id} is being moved')
+        return shard
+
+    def forget(self, user_id):
+        with self._map_lock:
+            self._map.pop(user_id, None)
+
+    def connection(self, user_id=None):
+        """Context manager for the tenant's shard, or the catalog when user_id is None"""
+        if user_id is None:
+            return self.catalog.connection()
+        return self.pool(self.shard_for(user_id)).connection()
+
+    def acquire(self, user_id=None):
+        if user_id is None:
+            return self.catalog.acquire()
+        return self.pool(self.shard_for(user_id)).acquire()
+
+    # Placement
+
+    def assign(self, conn, user_id):
+        """Place a new tenant; call inside the catalog transaction creating the user"""
+        shard = self.strategy(user_id)
+        self.path(shard)
+        conn.execute('INSERT OR IGNORE INTO shards (name) VALUES (?)', (shard,))
+        conn.execute(
+            'INSERT OR REPLACE INTO tenant_shards (user_id, shard) VALUES (?, ?)', (user_id, shard)
+        )
+        return shard
+
+    def add_user(self, shard, user):
+        """Copy a user row into its shard; credentials stay in the catalog"""
+        if shard == CATALOG_SHARD:
+            return
+        with self.pool(shard).connection() as conn:
+            conn.execute('''
+                INSERT OR IGNORE INTO users (
+                    id, email, password, full_name, country_code, whatsapp_number, created_at, updated_at
+                ) VALUES (?, ?, '', ?, ?, ?, ?, ?)
+            ''', (user['id'], user['email'], user['full_name'], user['country_code'],
+                  user['whatsapp_number'], user['created_at'], user['updated_at']))
+            conn.commit()
+
+
+# Moving tenants
+#
+# A move blocks the tenant (requests get TenantMovingError) and waits out
+# every process's cached map, copies the tenant's rows into the target under
+# the source's write lock, points the map at the target and only then deletes
+# the source copy. The catalog records each phase, so an interrupted move is
+# finished by running it again. Other tenants of both shards keep working.
+
+# (table, rows belonging to the tenant) in foreign-key order
+TENANT_TABLES = (
+    ('tags', 'user_id = :user_id'),
+    ('contacts', 'user_id = :user_id'),
+    ('contact_tags', 'contact_id IN (SELECT id FROM {db}.contacts WHERE user_id = :user_id)'),
+    ('import_jobs', 'user_id = :user_id'),
+    ('import_rejections', 'job_id IN (SELECT id FROM {db}.import_jobs WHERE user_id = :user_id)'),
+    ('campaigns', 'user_id = :user_id'),
+    ('campaign_messages', 'campaign_id IN (SELECT id FROM {db}.campaigns WHERE user_id = :user_id)'),
+    ('user_data_versions', 'user_id = :user_id'),
+)
+# Deleting these cascades to the rest; audience_changes is left to expire so
+# cached audience indexes replay the deletes. sync_changes goes last, taking
+# the tombstones the deletes just wrote: the target's triggers log the copy
+# afresh and sync tokens name their shard.
+TENANT_ROOTS = ('tags', 'contacts', 'import_jobs', 'campaigns', 'user_data_versions', 'sync_changes')
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=60.0, isolation_level=None)
+    conn.execute('PRAGMA foreign_keys = ON')
+    # The copy fires the target's contact index triggers
+    fts.register(conn)
+    return conn
+
+
+def _delete_tenant(conn, schema, user_id):
+    for table in TENANT_ROOTS:
+        conn.execute(f'DELETE FROM {schema}.{table} WHERE user_id = ?', (user_id,))
+
+
+def _copy_tenant(router, user_id, source, target):
+    conn = _connect(router.path(source))
+    try:
+        conn.execute('ATTACH DATABASE ? AS target', (router.path(target),))
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            active = conn.execute(
+                "SELECT COUNT(*) FROM import_jobs WHERE user_id = ? AND status IN ('queued', 'running')",
+                (user_id,)
+            ).fetchone()[0]
+            if active:
+                raise ValueError(f'Tenant {user_id} has an import in progress')
+            # Leftovers of an interrupted earlier copy
+            _delete_tenant(conn, 'target', user_id)
+            conn.execute('''
+                INSERT OR IGNORE INTO target.users (
+                    id, email, password, full_name, country_code, whatsapp_number, created_at, updated_at
+                )
+                SELECT id, email, '', full_name, country_code, whatsapp_number, created_at, updated_at
+                FROM main.users WHERE id = ?
+            ''', (user_id,))
+            for table, where in TENANT_TABLES:
+                conn.execute(
+                    f'INSERT INTO target.{table} SELECT * FROM main.{table} WHERE {where.format(db="main")}',
+                    {'user_id': user_id}
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.close()
+
+
+def _drop_tenant(router, user_id, shard):
+    conn = _connect(router.path(shard))
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        _delete_tenant(conn, 'main', user_id)
+        if shard != CATALOG_SHARD:
+            conn.execute('DELETE FROM users WHERE id = ?', (user_id,))
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+
+
+def _set_placement(router, user_id, **columns):
+    assignments = ', '.join(f'{name} = :{name}' for name in columns)
+    with router.catalog.connection() as conn:
+        conn.execute(
+            f'UPDATE tenant_shards SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE user_id = :user_id',
+            {**columns, 'user_id': user_id}
+        )
+        conn.commit()
+    router.forget(user_id)
+
+
+def move_tenant(router, user_id, target, wait=None, log=print):
+    """Move a tenant's data to the target shard, or finish an interrupted move
+
+    Returns False if the tenant already lives on target. Raises ValueError
+    for unknown users, bad shard names or a tenant with an import running.
+    """
+    router.path(target)
+    with router.catalog.connection() as conn:
+        if not conn.execute('SELECT 1 FROM users WHERE id = ?', (user_id,)).fetchone():
+            raise ValueError(f'Unknown user: {user_id}')
+        conn.execute(
+            'INSERT OR IGNORE INTO tenant_shards (user_id, shard) VALUES (?, ?)', (user_id, CATALOG_SHARD)
+        )
+        conn.commit()
+        placement = conn.execute(
+            'SELECT shard, moving_to, moved_from FROM tenant_shards WHERE user_id = ?', (user_id,)
+        ).fetchone()
+
+    source = placement['shard']
+    if placement['moved_from'] is not None:
+        _finish_move(router, user_id, placement['moved_from'], log)
+        if source == target:
+            return True
+    if placement['moving_to'] is None:
+        if source == target:
+            return False
+        _set_placement(router, user_id, moving_to=target)
+        delay = SHARD_MAP_TTL if wait is None else wait
+        log(f'Tenant {user_id}: blocked, waiting {delay:.0f}s for cached shard maps to expire')
+        time.sleep(delay)
+    else:
+        target = placement['moving_to']
+        log(f'Tenant {user_id}: resuming the interrupted move to {target}')
+
+    router.pool(target)
+    log(f'Tenant {user_id}: copying {source} -> {target}')
+    try:
+        _copy_tenant(router, user_id, source, target)
+    except ValueError:
+        _set_placement(router, user_id, moving_to=None)
+        raise
+    # Work marked on the source may have come with the tenant
+    with router.catalog.connection() as conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO shard_work (kind, shard, marked_at)
+            SELECT kind, ?, ? FROM shard_work WHERE shard = ?
+        ''', (target, time.time(), source))
+        conn.commit()
+    _set_placement(router, user_id, shard=target, moving_to=None, moved_from=source)
+    _finish_move(router, user_id, source, log)
+    return True
+
+
+def _finish_move(router, user_id, old_shard, log):
+    log(f'Tenant {user_id}: removing the old copy from {old_shard}')
+    _drop_tenant(router, user_id, old_shard)
+    _set_placement(router, user_id, moved_from=None)
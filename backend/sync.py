@@ -0,0 +1,90 @@
+import base64
+import json
+from decouple import config
+from db import db_connection, get_contacts_by_ids, shard_router
+
+# Changes returned per call when the client doesn't ask for a page size
+SYNC_PAGE_SIZE = config('SYNC_PAGE_SIZE', default=1000, cast=int)
+SYNC_MAX_PAGE_SIZE = 5000
+
+
+def encode_token(shard, seq):
+    """Build an opaque sync token for a position in a shard's change feed"""
+    raw = json.dumps([shard, seq], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_token(token):
+    """Decode a token from encode_token(), raising ValueError if it is malformed"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        shard, seq = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError('Invalid sync token')
+    if not isinstance(shard, str) or not isinstance(seq, int) or seq < 0:
+        raise ValueError('Invalid sync token')
+    return shard, seq
+
+
+def get_changes(user_id, since=None, limit=SYNC_PAGE_SIZE):
+    """Contacts and tags changed since a sync token, oldest change first
+
+    Without a token (or with one the feed can't continue from, e.g. issued
+    before the tenant moved shard) the result starts from scratch with
+    ``reset`` set, and holds every live contact and tag. Otherwise it holds
+    the ones created or updated since the token, in their current state,
+    plus the ids deleted since. Feed ``next_token`` back to continue; while
+    ``has_more`` is set there are further pages right away.
+    """
+    shard = shard_router.shard_for(user_id)
+    with db_connection(user_id) as conn:
+        # One snapshot for the change list and the rows it points at
+        conn.execute('BEGIN')
+        cursor = conn.cursor()
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'sync_changes'")
+        row = cursor.fetchone()
+        latest = row['seq'] if row else 0
+
+        reset = True
+        seq = 0
+        if since is not None:
+            token_shard, token_seq = decode_token(since)
+            if token_shard == shard and token_seq <= latest:
+                reset = False
+                seq = token_seq
+
+        cursor.execute(f'''
+            SELECT seq, kind, object_id, deleted FROM sync_changes
+            WHERE user_id = ? AND seq > ? {'AND deleted = 0' if reset else ''}
+            ORDER BY seq
+            LIMIT ?
+        ''', (user_id, seq, limit + 1))
+        changes = cursor.fetchall()
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+
+        live = {'contact': [], 'tag': []}
+        deleted = {'contact': [], 'tag': []}
+        for change in changes:
+            (deleted if change['deleted'] else live)[change['kind']].append(change['object_id'])
+
+        tags = []
+        if live['tag']:
+            cursor.execute('''
+                SELECT * FROM tags
+                WHERE user_id = ? AND id IN (SELECT value FROM json_each(?))
+            ''', (user_id, json.dumps(live['tag'])))
+            by_id = {tag['id']: tag for tag in cursor.fetchall()}
+            tags = [by_id[tag_id] for tag_id in live['tag'] if tag_id in by_id]
+        contacts = get_contacts_by_ids(user_id, live['contact']) if live['contact'] else []
+
+    # A complete answer covers everything up to the snapshot's latest change
+    next_seq = changes[-1]['seq'] if has_more else latest
+    return {
+        'contacts': contacts,
+        'tags': tags,
+        'deleted': {'contacts': deleted['contact'], 'tags': deleted['tag']},
+        'next_token': encode_token(shard, next_seq),
+        'has_more': has_more,
+        'reset': reset,
+    }
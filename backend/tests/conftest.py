@@ -0,0 +1,79 @@
+"""Shared fixtures: a scratch database and fast settings, fixed before the app is imported
+
+Settings are read once at import time, so they are set here first. The
+tenant shard strategy gives every test user a shard of their own, so tests
+don't see each other's data.
+"""
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+os.environ.update({
+    'DATABASE_PATH': os.path.join(tempfile.mkdtemp(prefix='tests-'), 'test.sqlite'),
+    'SHARD_STRATEGY': 'tenant',
+    'SHARD_MAP_TTL': '0',
+    'BCRYPT_ROUNDS': '4',
+    'CAMPAIGN_WORKERS': '0',
+    'CAMPAIGN_POLL_INTERVAL': '0.05',
+    'CAMPAIGN_MAX_ATTEMPTS': '3',
+    'CAMPAIGN_RETRY_BASE': '0.01',
+    'CAMPAIGN_RETRY_MAX': '0.05',
+    'WEBHOOK_APPLIER': 'false',
+    'WHATSAPP_APP_SECRET': 'test-secret',
+})
+
+import app as app_module  # noqa: E402
+
+_signups = itertools.count(1)
+
+
+@pytest.fixture
+def client():
+    """Test client logged in as a newly signed-up user, whose id is client.user_id"""
+    n = next(_signups)
+    client = app_module.app.test_client()
+    response = client.post('/api/auth/signup', json={
+        'email': f'user{n}@example.com', 'password': 'password',
+        'fullName': f'User {n}', 'countryCode': '+1', 'whatsappNumber': f'555{n:07d}',
+    })
+    assert response.status_code == 201, response.get_json()
+    client.user_id = response.get_json()['user']['id']
+    response = client.post('/api/auth/login', json={'email': f'user{n}@example.com', 'password': 'password'})
+    assert response.status_code == 200, response.get_json()
+    return client
+
+
+@pytest.fixture
+def add_contacts(client):
+    """add_contacts(names, tag_ids=()) creates contacts for the client's user and returns their ids"""
+    numbers = itertools.count(1)
+
+    def add(names, tag_ids=()):
+        ids = []
+        for name in names:
+            response = client.post('/api/contacts', json={
+                'name': name, 'country_code': '+91', 'whatsapp_number': f'98{next(numbers):08d}',
+                'tag_ids': list(tag_ids),
+            })
+            assert response.status_code == 201, response.get_json()
+            ids.append(response.get_json()['id'])
+        return ids
+
+    return add
+
+
+@pytest.fixture
+def add_tag(client):
+    """add_tag(name) creates a tag for the client's user and returns its id"""
+    def add(name):
+        response = client.post('/api/tags', json={'name': name})
+        assert response.status_code == 201, response.get_json()
+        return response.get_json()['id']
+
+    return add
@@ -0,0 +1,68 @@
+import pytest
+
+from audiences import parse_expression, resolve_audience
+
+
+def resolve(client, expression):
+    response = client.post('/api/audiences/resolve', json={'expression': expression})
+    assert response.status_code == 200, response.get_json()
+    return sorted(response.get_json()['ids'])
+
+
+@pytest.fixture
+def tagged(client, add_contacts, add_tag):
+    """Contacts tagged vip, lead, both or neither; name -> id"""
+    vip, lead, unsubscribed = add_tag('vip'), add_tag('lead'), add_tag('unsubscribed')
+    ids = {}
+    ids['vip'], = add_contacts(['Vip'], [vip])
+    ids['lead'], = add_contacts(['Lead'], [lead])
+    ids['both'], = add_contacts(['Both'], [vip, lead])
+    ids['gone'], = add_contacts(['Gone'], [vip, unsubscribed])
+    ids['none'], = add_contacts(['None'])
+    return ids
+
+
+def test_parse_precedence():
+    assert parse_expression('a OR b AND NOT c') == ('or', ('tag', 'a'), ('and', ('tag', 'b'), ('not', ('tag', 'c'))))
+    assert parse_expression('(a OR b) AND "not me"') == ('and', ('or', ('tag', 'a'), ('tag', 'b')), ('tag', 'not me'))
+
+
+@pytest.mark.parametrize('expression', ['', 'a AND', '(a', 'a b', 'NOT'])
+def test_parse_rejects_malformed(expression):
+    with pytest.raises(ValueError):
+        parse_expression(expression)
+
+
+def test_resolve_matches_set_algebra(client, tagged):
+    ids = tagged
+    assert resolve(client, 'vip') == sorted([ids['vip'], ids['both'], ids['gone']])
+    assert resolve(client, 'vip AND lead') == [ids['both']]
+    assert resolve(client, 'vip OR lead') == sorted([ids['vip'], ids['lead'], ids['both'], ids['gone']])
+    assert resolve(client, '(vip OR lead) AND NOT unsubscribed') == sorted([ids['vip'], ids['lead'], ids['both']])
+    assert resolve(client, 'NOT vip') == sorted([ids['lead'], ids['none']])
+
+
+def test_resolve_sees_later_changes(client, tagged, add_tag):
+    ids = tagged
+    assert resolve(client, 'lead') == sorted([ids['lead'], ids['both']])
+
+    lead = {tag['name']: tag['id'] for tag in client.get('/api/tags').get_json()['tags']}['lead']
+    client.post(f'/api/tags/{lead}/contacts', json={'contact_ids': [ids['none']]})
+    client.delete(f"/api/contacts/{ids['both']}")
+    assert resolve(client, 'lead') == sorted([ids['lead'], ids['none']])
+
+    add_tag('fresh')
+    assert resolve(client, 'fresh') == []
+
+
+def test_resolve_rejects_unknown_tags(client, tagged):
+    response = client.post('/api/audiences/resolve', json={'expression': 'vip AND nope'})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Unknown tag: nope'}
+    with pytest.raises(ValueError):
+        resolve_audience(client.user_id, 'nope')
+
+
+def test_count_only(client, tagged):
+    response = client.post('/api/audiences/resolve', json={'expression': 'vip', 'include_ids': False})
+    assert response.get_json() == {'count': 3}
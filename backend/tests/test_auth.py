@@ -0,0 +1,56 @@
+import time
+
+import jwt
+import pytest
+
+import app as app_module
+from auth import TokenCache
+
+SECRET = 'auth-test-secret'
+
+
+def with_token(token):
+    client = app_module.app.test_client()
+    client.set_cookie('token', token)
+    return client
+
+
+def logout(token):
+    return with_token(token).post('/api/auth/logout').status_code
+
+
+def test_forged_tokens_are_not_revoked():
+    cache = app_module.token_cache
+    before = len(cache._revoked)
+    for claims in ({'user_id': 1, 'exp': 'abc'}, {'user_id': 1}, {'user_id': 1, 'exp': time.time() + 60}):
+        assert logout(jwt.encode(claims, 'not-the-secret', algorithm='HS256')) == 200
+    assert logout('not-a-token') == 200
+    assert len(cache._revoked) == before
+
+
+def test_logout_revokes_the_token(client):
+    # The browser drops the cookie; a copy of a logged-out token no longer works either
+    token = jwt.encode({'user_id': client.user_id, 'exp': time.time() + 60},
+                       app_module.app.config['SECRET_KEY'], algorithm='HS256')
+    assert with_token(token).get('/api/tags').status_code == 200
+    assert logout(token) == 200
+    assert with_token(token).get('/api/tags').status_code == 401
+
+
+def test_signed_tokens_with_a_bad_exp_are_ignored():
+    cache = TokenCache(SECRET)
+    for exp in ('abc', True, time.time() - 1):
+        cache.revoke(jwt.encode({'user_id': 1, 'exp': exp}, SECRET, algorithm='HS256'))
+    assert len(cache._revoked) == 0
+
+
+def test_revocations_are_capped():
+    cache = TokenCache(SECRET, max_revoked=3)
+    tokens = [jwt.encode({'user_id': n}, SECRET, algorithm='HS256') for n in range(5)]
+    for token in tokens:
+        cache.revoke(token)
+    assert len(cache._revoked) == 3
+    cache.verify(tokens[0])
+    for token in tokens[2:]:
+        with pytest.raises(jwt.InvalidTokenError):
+            cache.verify(token)
@@ -0,0 +1,69 @@
+def tag_counts(client):
+    return {tag['name']: tag['contact_count'] for tag in client.get('/api/tags').get_json()['tags']}
+
+
+def tagged_ids(client, tag_id):
+    contacts = client.get(f'/api/contacts?tag_id={tag_id}&per_page=100').get_json()['contacts']
+    return sorted(contact['id'] for contact in contacts)
+
+
+def test_assign_by_ids_counts_only_new_links(client, add_contacts, add_tag):
+    vip = add_tag('vip')
+    ids = add_contacts(['Ann', 'Bob', 'Cat'])
+
+    response = client.post(f'/api/tags/{vip}/contacts', json={'contact_ids': ids[:2]})
+    assert response.get_json() == {'tag_id': vip, 'changed': 2}
+
+    response = client.post(f'/api/tags/{vip}/contacts', json={'contact_ids': ids})
+    assert response.get_json()['changed'] == 1
+    assert tagged_ids(client, vip) == sorted(ids)
+    assert tag_counts(client)['vip'] == 3
+
+
+def test_unassign_by_filter(client, add_contacts, add_tag):
+    vip = add_tag('vip')
+    lead = add_tag('lead')
+    leads = add_contacts(['Ann Lead', 'Bob Lead'], tag_ids=[vip, lead])
+    others = add_contacts(['Cat'], tag_ids=[vip])
+
+    response = client.delete(f'/api/tags/{vip}/contacts', json={'filter': {'tag_id': lead}})
+    assert response.get_json()['changed'] == 2
+    assert tagged_ids(client, vip) == others
+    assert tagged_ids(client, lead) == sorted(leads)
+    assert tag_counts(client) == {'lead': 2, 'vip': 1}
+
+
+def test_assign_by_search(client, add_contacts, add_tag):
+    vip = add_tag('vip')
+    ann = add_contacts(['Annabel'])
+    add_contacts(['Bob'])
+
+    response = client.post(f'/api/tags/{vip}/contacts', json={'filter': {'search': 'annabel'}})
+    assert response.get_json()['changed'] == 1
+    assert tagged_ids(client, vip) == ann
+
+
+def test_other_tenants_contacts_and_tags_are_untouched(client, add_contacts, add_tag):
+    import app as app_module
+
+    vip = add_tag('vip')
+    mine = add_contacts(['Ann'])
+
+    other = app_module.app.test_client()
+    other.post('/api/auth/signup', json={
+        'email': 'bulk-other@example.com', 'password': 'password',
+        'fullName': 'Other', 'countryCode': '+1', 'whatsappNumber': '5550999999',
+    })
+    other.post('/api/auth/login', json={'email': 'bulk-other@example.com', 'password': 'password'})
+    theirs = other.post('/api/contacts', json={'name': 'Zed'}).get_json()['id']
+
+    response = client.post(f'/api/tags/{vip}/contacts', json={'contact_ids': mine + [theirs]})
+    assert response.get_json()['changed'] == 1
+    assert other.post(f'/api/tags/{vip}/contacts', json={'contact_ids': [theirs]}).status_code == 404
+
+
+def test_rejects_bad_selections(client, add_tag):
+    vip = add_tag('vip')
+    assert client.post(f'/api/tags/{vip}/contacts', json={}).status_code == 400
+    assert client.post(f'/api/tags/{vip}/contacts', json={'contact_ids': ['1']}).status_code == 400
+    assert client.post(f'/api/tags/{vip}/contacts', json={'filter': {'tag_id': 'x'}}).status_code == 400
@@ -0,0 +1,116 @@
+import time
+
+import pytest
+
+import campaigns
+from campaigns import CAMPAIGN_MAX_ATTEMPTS
+from db import db_connection
+from whatsapp import WhatsAppError
+
+
+class FakeSender:
+    """Stands in for whatsapp.send_message: fails each message's first `failures` sends"""
+
+    def __init__(self, failures=0, permanent=False):
+        self.failures = failures
+        self.permanent = permanent
+        self.calls = {}
+
+    def __call__(self, from_number, to_number, body, media_url=None, idempotency_key=None):
+        attempt = self.calls[idempotency_key] = self.calls.get(idempotency_key, 0) + 1
+        if attempt <= self.failures:
+            raise WhatsAppError('Rejected' if self.permanent else 'Busy',
+                                status=400 if self.permanent else 503, permanent=self.permanent)
+        return f'wamid.{idempotency_key}'
+
+
+@pytest.fixture
+def send(monkeypatch):
+    """Install a FakeSender (send.fake) and run the pipeline for the test"""
+    def install(**kwargs):
+        fake = FakeSender(**kwargs)
+        monkeypatch.setattr(campaigns, 'send_message', fake)
+        campaigns.start_workers(2)
+        return fake
+
+    yield install
+    campaigns.stop_workers()
+
+
+def run_campaign(client, contact_ids, timeout=10.0):
+    campaign = client.post('/api/campaigns', json={
+        'title': 'Retries', 'message': 'Hello', 'contact_ids': contact_ids,
+    }).get_json()
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        campaign = client.get(f"/api/campaigns/{campaign['id']}").get_json()
+        if campaign['status'] == 'completed':
+            break
+        time.sleep(0.05)
+    assert campaign['status'] == 'completed', campaign
+    with db_connection(client.user_id) as conn:
+        messages = conn.execute('''
+            SELECT status, attempts, last_error, failed_at, provider_message_id
+            FROM campaign_messages WHERE campaign_id = ? ORDER BY id
+        ''', (campaign['id'],)).fetchall()
+    return campaign, messages
+
+
+def test_transient_failures_are_retried_until_sent(client, add_contacts, send):
+    fake = send(failures=CAMPAIGN_MAX_ATTEMPTS - 1)
+    campaign, messages = run_campaign(client, add_contacts(['Ann', 'Bob']))
+
+    assert campaign['messages'] == {'sent': 2}
+    assert [message['attempts'] for message in messages] == [CAMPAIGN_MAX_ATTEMPTS] * 2
+    assert all(message['last_error'] is None and message['provider_message_id'] for message in messages)
+    assert sorted(fake.calls.values()) == [CAMPAIGN_MAX_ATTEMPTS] * 2
+
+
+def test_messages_fail_after_max_attempts(client, add_contacts, send):
+    fake = send(failures=CAMPAIGN_MAX_ATTEMPTS)
+    campaign, messages = run_campaign(client, add_contacts(['Ann', 'Bob']))
+
+    assert campaign['messages'] == {'failed': 2}
+    for message in messages:
+        assert message['attempts'] == CAMPAIGN_MAX_ATTEMPTS
+        assert message['last_error'] == 'Busy'
+        assert message['failed_at'] is not None
+    assert sorted(fake.calls.values()) == [CAMPAIGN_MAX_ATTEMPTS] * 2
+
+
+def test_permanent_errors_are_not_retried(client, add_contacts, send):
+    fake = send(failures=1, permanent=True)
+    campaign, messages = run_campaign(client, add_contacts(['Ann']))
+
+    assert campaign['messages'] == {'failed': 1}
+    assert messages[0]['attempts'] == 1
+    assert list(fake.calls.values()) == [1]
+
+
+def test_expired_leases_requeue_until_the_last_attempt(client, add_contacts):
+    campaign = client.post('/api/campaigns', json={
+        'title': 'Leases', 'message': 'Hello', 'contact_ids': add_contacts(['Ann', 'Bob']),
+        'send_at': '2099-01-01T00:00:00Z',
+    }).get_json()
+    now = time.time()
+    with db_connection(client.user_id) as conn:
+        conn.execute('''
+            INSERT INTO campaign_messages (
+                campaign_id, contact_id, to_number, status, attempts, next_attempt_at,
+                locked_until, idempotency_key, enqueued_at
+            ) VALUES (:campaign, 1, '+1', 'sending', 1, :now, :expired, 'lease-1', :now),
+                     (:campaign, 2, '+1', 'sending', :max, :now, :expired, 'lease-2', :now),
+                     (:campaign, 3, '+1', 'sending', :max, :now, :held, 'lease-3', :now)
+        ''', {'campaign': campaign['id'], 'now': now, 'expired': now - 1, 'held': now + 60,
+              'max': CAMPAIGN_MAX_ATTEMPTS})
+        conn.commit()
+        campaigns._housekeeping(conn, now)
+        rows = conn.execute('''
+            SELECT idempotency_key, status, last_error, failed_at IS NOT NULL AS failed
+            FROM campaign_messages WHERE campaign_id = ? ORDER BY idempotency_key
+        ''', (campaign['id'],)).fetchall()
+
+    assert [(row['idempotency_key'], row['status'], row['failed']) for row in rows] == [
+        ('lease-1', 'queued', 0), ('lease-2', 'failed', 1), ('lease-3', 'sending', 0),
+    ]
+    assert rows[1]['last_error'] == 'Send lease expired'
@@ -0,0 +1,19 @@
+import csv
+import io
+import json
+
+from importer import split_tags
+
+
+def test_exports_carry_each_contacts_tags(client, add_contacts, add_tag):
+    vip, odd = add_tag('vip'), add_tag('semi;colon')
+    both, = add_contacts(['Both'], [vip, odd])
+    none, = add_contacts(['None'])
+
+    lines = client.get('/api/contacts/export?format=ndjson').get_data(as_text=True).splitlines()
+    tags = {row['id']: sorted(tag['id'] for tag in row['tags']) for row in map(json.loads, lines)}
+    assert tags == {both: sorted([vip, odd]), none: []}
+
+    rows = csv.DictReader(io.StringIO(client.get('/api/contacts/export?format=csv').get_data(as_text=True)))
+    names = {int(row['id']): sorted(split_tags(row['tags'])) for row in rows}
+    assert names == {both: ['semi;colon', 'vip'], none: []}
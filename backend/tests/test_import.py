@@ -0,0 +1,60 @@
+import io
+import time
+
+import importer
+from db import db_connection
+from importer import join_tags
+
+
+def import_csv(client, text, timeout=10.0):
+    response = client.post('/api/contacts/import', data=io.BytesIO(text.encode('utf-8')),
+                           content_type='text/csv')
+    assert response.status_code == 202, response.get_json()
+    job_id = response.get_json()['job_id']
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f'/api/contacts/import/{job_id}').get_json()
+        if job['status'] in ('completed', 'failed'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f'import {job_id} did not finish: {job}')
+
+
+def test_batched_rows_keep_their_own_tags(client, monkeypatch):
+    monkeypatch.setattr(importer, 'IMPORT_BATCH_SIZE', 7)
+    monkeypatch.setattr(importer, '_INSERT_ROWS', 3)
+    rows = ['name,country_code,whatsapp_number,tags']
+    for i in range(20):
+        rows.append(f'Person {i},+91,98{i:08d},{join_tags([f"t{i % 4}", f"n{i}"])}')
+    rows.append('Duplicate,+91,9800000003,t0')
+    rows.append(',+91,9899999999,t0')
+
+    job = import_csv(client, '\n'.join(rows) + '\n')
+    assert (job['status'], job['rows_imported'], job['rows_rejected']) == ('completed', 20, 2)
+
+    contacts = client.get('/api/contacts?per_page=100').get_json()['contacts']
+    assert len(contacts) == 20
+    for contact in contacts:
+        i = int(contact['name'].split()[1])
+        assert contact['whatsapp_number'] == f'98{i:08d}'
+        assert sorted(tag['name'] for tag in contact['tags']) == sorted([f'n{i}', f't{i % 4}'])
+
+
+def test_stale_jobs_are_failed_and_never_start(client):
+    with db_connection(client.user_id) as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT INTO import_jobs (user_id, status, updated_at) VALUES (?, ?, datetime('now', ?))",
+            [(client.user_id, 'running', '-1 hour'), (client.user_id, 'queued', '-1 hour'),
+             (client.user_id, 'running', '-1 second')]
+        )
+        conn.commit()
+        stale_running, stale_queued, live = [row['id'] for row in conn.execute(
+            'SELECT id FROM import_jobs WHERE user_id = ? ORDER BY id', (client.user_id,)
+        ).fetchall()]
+
+    importer.fail_stale_imports()
+    statuses = {job_id: client.get(f'/api/contacts/import/{job_id}').get_json()['status']
+                for job_id in (stale_running, stale_queued, live)}
+    assert statuses == {stale_running: 'failed', stale_queued: 'failed', live: 'running'}
+    assert importer._claim(stale_queued, client.user_id) is False
@@ -0,0 +1,119 @@
+import random
+
+import pytest
+
+from db import REPORT_MILESTONES, db_connection
+from reports import campaign_stats_drift, get_campaign_reports, get_summary, get_timeseries, rebuild_campaign_stats
+
+# 2024-01-01T00:00:00Z; the messages spread over the following three days
+START = 1704067200
+HOUR = 3600
+
+
+def raw_counts(conn, campaign_ids, start=None, end=None, seconds=None):
+    """Milestone counts straight from campaign_messages, per bucket when seconds is given"""
+    counts = {}
+    for status, column in REPORT_MILESTONES:
+        rows = conn.execute(f'''
+            SELECT {f'CAST({column} / {seconds} AS INTEGER) * {seconds}' if seconds else 'NULL'} AS bucket,
+                   COUNT(*) AS n
+            FROM campaign_messages
+            WHERE campaign_id IN ({','.join('?' * len(campaign_ids))}) AND {column} IS NOT NULL
+              AND {column} >= ? AND {column} < ?
+            GROUP BY bucket
+        ''', (*campaign_ids, start or 0, end or 2 ** 40)).fetchall()
+        for row in rows:
+            counts.setdefault(row['bucket'], dict.fromkeys(status for status, _ in REPORT_MILESTONES))
+            counts[row['bucket']][status] = row['n']
+    return {bucket: {status: n or 0 for status, n in statuses.items()} for bucket, statuses in counts.items()}
+
+
+@pytest.fixture
+def campaigns(client, add_contacts):
+    """Two campaigns whose messages reached random milestones, some updated later
+
+    A third campaign is deleted, with its messages and its rollups.
+    """
+    rng = random.Random(25)
+    contact_ids = add_contacts([f'C{i}' for i in range(3)])
+    campaign_ids = []
+    with db_connection(client.user_id) as conn:
+        for n in range(3):
+            campaign = client.post('/api/campaigns', json={
+                'title': f'Report {n}', 'message': 'Hello', 'contact_ids': contact_ids,
+                'send_at': '2099-01-01T00:00:00Z',
+            }).get_json()
+            campaign_ids.append(campaign['id'])
+            for i in range(200):
+                sent_at = START + rng.uniform(0, 72 * HOUR)
+                delivered_at = sent_at + rng.uniform(0, 6 * HOUR) if rng.random() < 0.8 else None
+                read_at = delivered_at + rng.uniform(0, 30 * HOUR) if delivered_at and rng.random() < 0.5 else None
+                failed_at = sent_at + 60 if delivered_at is None and rng.random() < 0.5 else None
+                conn.execute('''
+                    INSERT INTO campaign_messages (
+                        campaign_id, contact_id, to_number, status, attempts, next_attempt_at,
+                        idempotency_key, enqueued_at, sent_at, delivered_at, read_at, failed_at
+                    ) VALUES (?, ?, '+1', 'sent', 1, 0, ?, 0, ?, ?, ?, ?)
+                ''', (campaign['id'], 1000 + i, f'report-{campaign["id"]}-{i}',
+                      sent_at, delivered_at, read_at, failed_at))
+        conn.commit()
+
+        # Later milestones land, and one campaign goes away
+        conn.execute('''
+            UPDATE campaign_messages SET read_at = delivered_at + 7200
+            WHERE campaign_id = ? AND delivered_at IS NOT NULL AND read_at IS NULL AND contact_id % 3 = 0
+        ''', (campaign_ids[0],))
+        conn.execute('DELETE FROM campaigns WHERE id = ?', (campaign_ids[2],))
+        conn.commit()
+    return campaign_ids[:2]
+
+
+def test_rollups_have_no_drift(client, campaigns):
+    with db_connection(client.user_id) as conn:
+        assert campaign_stats_drift(conn, campaigns) == []
+        leftover = conn.execute(
+            'SELECT COUNT(*) AS n FROM campaign_stats_hourly WHERE campaign_id NOT IN (SELECT id FROM campaigns)'
+        ).fetchone()
+    assert leftover['n'] == 0
+
+
+def test_summary_and_campaign_reports_match_raw_counts(client, campaigns):
+    with db_connection(client.user_id) as conn:
+        total = raw_counts(conn, campaigns)[None]
+        per_campaign = {campaign_id: raw_counts(conn, [campaign_id])[None] for campaign_id in campaigns}
+        window = raw_counts(conn, campaigns, START + 24 * HOUR, START + 48 * HOUR)[None]
+
+    summary = get_summary(client.user_id)
+    assert {status: summary[status] for status in total} == total
+    day_two = get_summary(client.user_id, START + 24 * HOUR, START + 48 * HOUR)
+    assert {status: day_two[status] for status in window} == window
+    for report in get_campaign_reports(client.user_id):
+        assert {status: report[status] for status in total} == per_campaign[report['id']]
+
+
+@pytest.mark.parametrize('granularity, seconds', [('hour', HOUR), ('day', 24 * HOUR)])
+def test_timeseries_matches_raw_counts(client, campaigns, granularity, seconds):
+    end = START + 5 * 24 * HOUR
+    with db_connection(client.user_id) as conn:
+        expected = raw_counts(conn, campaigns, START, end, seconds)
+
+    series = get_timeseries(client.user_id, granularity, START, end)['series']
+    actual = {point.pop('bucket'): point for point in series if any(point[s] for s, _ in REPORT_MILESTONES)}
+    assert actual == expected
+
+
+def test_rebuild_restores_tampered_rollups(client, campaigns):
+    with db_connection(client.user_id) as conn:
+        conn.execute('UPDATE campaign_stats_hourly SET count = count + 5 WHERE campaign_id = ?', (campaigns[0],))
+        conn.execute('DELETE FROM campaign_stats_daily WHERE campaign_id = ?', (campaigns[1],))
+        conn.commit()
+        assert campaign_stats_drift(conn, campaigns)
+
+        rebuild_campaign_stats(conn, campaigns)
+        assert campaign_stats_drift(conn, campaigns) == []
+
+
+def test_overlong_series_are_refused_before_listing_buckets(client):
+    response = client.get('/api/reports/timeseries?granularity=hour&from=0&to=1e15')
+    assert response.status_code == 400
+    assert 'At most' in response.get_json()['error']
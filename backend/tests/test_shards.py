@@ -0,0 +1,85 @@
+import itertools
+
+import pytest
+
+import shards
+from db import _migrate_pool, _open_pool, db_connection, shard_router
+from shards import ShardRouter, move_tenant
+
+_targets = itertools.count(1)
+
+
+def tenant_rows(shard, user_id):
+    with shard_router.pool(shard).connection() as conn:
+        return {
+            table: conn.execute(f'SELECT COUNT(*) AS n FROM {table} WHERE user_id = ?', (user_id,)).fetchone()['n']
+            for table in ('tags', 'contacts', 'campaigns', 'sync_changes')
+        }
+
+
+@pytest.fixture
+def moved(client, add_contacts, add_tag):
+    """Moves the client's tenant, with a tag, contacts and a scheduled campaign, to a new shard"""
+    vip = add_tag('vip')
+    contact_ids = add_contacts(['Ann', 'Bob'], [vip])
+    campaign = client.post('/api/campaigns', json={
+        'title': 'Later', 'message': 'Hello', 'audience': 'vip', 'send_at': '2099-01-01T00:00:00Z',
+    }).get_json()
+    token = client.get('/api/sync').get_json()['next_token']
+    source = shard_router.shard_for(client.user_id)
+    target = f'moved-{next(_targets)}'
+
+    assert move_tenant(shard_router, client.user_id, target, wait=0, log=lambda message: None)
+    return {'source': source, 'target': target, 'tag': vip, 'contacts': contact_ids,
+            'campaign': campaign, 'token': token}
+
+
+def test_move_carries_the_tenants_data(client, moved):
+    assert shard_router.shard_for(client.user_id) == moved['target']
+    assert tenant_rows(moved['source'], client.user_id) == {'tags': 0, 'contacts': 0, 'campaigns': 0, 'sync_changes': 0}
+
+    contacts = client.get('/api/contacts').get_json()['contacts']
+    assert sorted(contact['id'] for contact in contacts) == moved['contacts']
+    assert all(contact['tags'][0]['id'] == moved['tag'] for contact in contacts)
+    assert client.get(f"/api/campaigns/{moved['campaign']['id']}").get_json()['status'] == 'scheduled'
+    audience = client.post('/api/audiences/resolve', json={'expression': 'vip'}).get_json()
+    assert sorted(audience['ids']) == moved['contacts']
+
+
+def test_new_rows_after_a_move_get_fresh_ids(client, moved, add_contacts):
+    new_id, = add_contacts(['Cat'])
+    assert new_id not in moved['contacts']
+    with db_connection(client.user_id) as conn:
+        assert conn.execute('SELECT COUNT(*) AS n FROM contacts WHERE id = ?', (new_id,)).fetchone()['n'] == 1
+
+
+def test_sync_tokens_from_the_old_shard_start_over(client, moved):
+    changes = client.get(f"/api/sync?since={moved['token']}").get_json()
+    assert changes['reset'] is True
+    assert sorted(contact['id'] for contact in changes['contacts']) == moved['contacts']
+
+
+def test_campaign_work_follows_the_tenant(client, moved):
+    assert moved['target'] in shard_router.marked('campaigns')
+
+
+def test_moving_to_the_current_shard_is_a_no_op(client, moved):
+    assert move_tenant(shard_router, client.user_id, moved['target'], wait=0, log=lambda message: None) is False
+
+
+def test_shards_open_lazily_and_least_recently_used_close(client, moved, monkeypatch):
+    router = ShardRouter(shard_router.catalog_path, shard_router.shard_dir, _open_pool, _migrate_pool)
+    router.open_catalog()
+    assert list(router._pools) == []
+
+    monkeypatch.setattr(shards, 'SHARD_POOLS_OPEN', 1)
+    first = router.pool(moved['source'])
+    second = router.pool(moved['target'])
+    assert first.closed and not second.closed
+    assert list(router._pools) == [moved['target']]
+
+    # A closed pool still works for borrowers; reopening gives a fresh pool
+    with first.connection() as conn:
+        assert conn.execute('SELECT 1 AS one').fetchone()['one'] == 1
+    reopened = router.pool(moved['source'])
+    assert reopened is not first and second.closed
@@ -0,0 +1,77 @@
+def sync(client, token=None, limit=None):
+    query = []
+    if token:
+        query.append(f'since={token}')
+    if limit:
+        query.append(f'limit={limit}')
+    response = client.get('/api/sync' + ('?' + '&'.join(query) if query else ''))
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def ids(objects):
+    return sorted(item['id'] for item in objects)
+
+
+def test_first_sync_lists_live_objects_only(client, add_contacts, add_tag):
+    vip = add_tag('vip')
+    kept, dropped = add_contacts(['Kept', 'Dropped'], [vip])
+    client.delete(f'/api/contacts/{dropped}')
+
+    changes = sync(client)
+    assert changes['reset'] is True
+    assert ids(changes['contacts']) == [kept]
+    assert ids(changes['tags']) == [vip]
+    assert changes['deleted'] == {'contacts': [], 'tags': []}
+
+
+def test_deletes_after_a_token_come_back_as_tombstones(client, add_contacts, add_tag):
+    add_tag('vip')
+    old = add_tag('old')
+    kept, dropped = add_contacts(['Kept', 'Dropped'])
+    token = sync(client)['next_token']
+
+    client.delete(f'/api/contacts/{dropped}')
+    client.delete(f'/api/tags/{old}')
+    client.put(f'/api/contacts/{kept}', json={'notes': 'edited'})
+    changes = sync(client, token)
+    assert changes['reset'] is False
+    assert ids(changes['contacts']) == [kept]
+    assert changes['contacts'][0]['notes'] == 'edited'
+    assert changes['deleted'] == {'contacts': [dropped], 'tags': [old]}
+
+    # Nothing new since: an empty page, and the tombstones are not repeated
+    again = sync(client, changes['next_token'])
+    assert (again['contacts'], again['tags'], again['deleted']) == ([], [], {'contacts': [], 'tags': []})
+
+
+def test_contact_created_and_deleted_between_syncs_is_only_a_tombstone(client, add_contacts):
+    token = sync(client)['next_token']
+    brief, = add_contacts(['Brief'])
+    client.delete(f'/api/contacts/{brief}')
+
+    changes = sync(client, token)
+    assert changes['contacts'] == []
+    assert changes['deleted']['contacts'] == [brief]
+
+
+def test_tombstones_page_like_other_changes(client, add_contacts):
+    token = sync(client)['next_token']
+    created = add_contacts([f'C{i}' for i in range(5)])
+    for contact_id in created[:3]:
+        client.delete(f'/api/contacts/{contact_id}')
+
+    seen, deleted = [], []
+    while True:
+        page = sync(client, token, limit=2)
+        seen += [contact['id'] for contact in page['contacts']]
+        deleted += page['deleted']['contacts']
+        token = page['next_token']
+        if not page['has_more']:
+            break
+    assert sorted(seen) == created[3:]
+    assert sorted(deleted) == created[:3]
+
+
+def test_rejects_malformed_tokens(client):
+    assert client.get('/api/sync?since=not-a-token').status_code == 400
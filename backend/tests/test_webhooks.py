@@ -0,0 +1,145 @@
+import hashlib
+import hmac
+import json
+import time
+
+import pytest
+
+import webhooks
+from db import db_connection, shard_router
+
+
+def callback(*statuses):
+    """Cloud API callback body for (message id, status, timestamp) triples"""
+    return json.dumps({'entry': [{'changes': [{'value': {'statuses': [
+        {'id': message_id, 'status': status, 'timestamp': str(timestamp)}
+        for message_id, status, timestamp in statuses
+    ]}}]}]}).encode('utf-8')
+
+
+def signed(body, secret='test-secret'):
+    return {'Content-Type': 'application/json',
+            'X-Hub-Signature-256': 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()}
+
+
+def post(client, body, headers):
+    return client.post('/api/webhooks/whatsapp', data=body, headers=headers).status_code
+
+
+def drain(retry_pending=False):
+    while webhooks.apply_callbacks(retry_pending=retry_pending):
+        retry_pending = False
+
+
+def pending_ids():
+    with shard_router.catalog.connection() as conn:
+        return {row['message_id'] for row in conn.execute('SELECT message_id FROM delivery_status_pending')}
+
+
+@pytest.fixture
+def sent(client, add_contacts):
+    """Provider ids of two sent campaign messages of the client's user, with their routes"""
+    contact_ids = add_contacts(['Ann', 'Bob'])
+    campaign = client.post('/api/campaigns', json={
+        'title': 'Sent', 'message': 'Hello', 'contact_ids': contact_ids, 'send_at': '2099-01-01T00:00:00Z',
+    }).get_json()
+    message_ids = [f'wamid.{client.user_id}.{contact_id}' for contact_id in contact_ids]
+    now = time.time()
+    with db_connection(client.user_id) as conn:
+        conn.executemany('''
+            INSERT INTO campaign_messages (
+                campaign_id, contact_id, to_number, status, attempts, next_attempt_at,
+                idempotency_key, provider_message_id, enqueued_at, sent_at
+            ) VALUES (?, ?, '+15550000000', 'sent', 1, ?, ?, ?, ?, ?)
+        ''', [(campaign['id'], contact_id, now, message_id, message_id, now, now)
+              for contact_id, message_id in zip(contact_ids, message_ids)])
+        conn.commit()
+    webhooks.record_routes([(message_id, client.user_id, now) for message_id in message_ids])
+    return message_ids
+
+
+def delivery(client, message_id):
+    with db_connection(client.user_id) as conn:
+        row = conn.execute('''
+            SELECT delivery_status, delivery_status_at, delivered_at, read_at
+            FROM campaign_messages WHERE provider_message_id = ?
+        ''', (message_id,)).fetchone()
+    return tuple(row.values())
+
+
+def test_signature_is_required(client):
+    body = callback(('wamid.x', 'sent', 1))
+    assert post(client, body, signed(body)) == 200
+    assert post(client, body, signed(body, secret='wrong')) == 401
+    assert post(client, body, {'Content-Type': 'application/json'}) == 401
+    assert post(client, b'{"entry": ', signed(b'{"entry": ')) == 400
+
+
+def test_without_an_app_secret_every_callback_is_rejected(client, monkeypatch):
+    monkeypatch.setattr(webhooks, 'WHATSAPP_APP_SECRET', '')
+    body = callback(('wamid.x', 'sent', 1))
+    assert post(client, body, {'Content-Type': 'application/json'}) == 401
+    assert post(client, body, signed(body, secret='')) == 401
+
+
+def test_latest_status_wins_whatever_the_order(client, sent):
+    first, second = sent
+    for body in (callback((first, 'read', 30), (second, 'sent', 10)),
+                 callback((first, 'delivered', 20)),
+                 callback((first, 'sent', 10), (second, 'delivered', 25))):
+        post(client, body, signed(body))
+    drain()
+
+    # Delivered at the earliest delivery seen, though read arrived first
+    assert delivery(client, first) == ('read', 30.0, 20.0, 30.0)
+    assert delivery(client, second) == ('delivered', 25.0, 25.0, None)
+
+
+def test_applying_again_changes_nothing(client, sent):
+    first, second = sent
+    body = callback((first, 'delivered', 20), (second, 'read', 40), (first, 'delivered', 20))
+    post(client, body, signed(body))
+    post(client, body, signed(body))
+    drain()
+    settled = [delivery(client, message_id) for message_id in sent]
+
+    webhooks.replay_from(0)
+    drain()
+    assert [delivery(client, message_id) for message_id in sent] == settled
+    assert not pending_ids() & set(sent)
+
+
+def test_unknown_ids_wait_until_their_route_is_recorded(client, sent):
+    late = f'wamid.{client.user_id}.late'
+    body = callback((late, 'delivered', 50))
+    post(client, body, signed(body))
+    drain()
+    assert late in pending_ids()
+
+    with db_connection(client.user_id) as conn:
+        conn.execute('''
+            INSERT INTO campaign_messages (
+                campaign_id, contact_id, to_number, status, attempts, next_attempt_at,
+                idempotency_key, provider_message_id, enqueued_at, sent_at
+            )
+            SELECT campaign_id, 999, to_number, 'sent', 1, 0, ?, ?, 0, 0
+            FROM campaign_messages WHERE provider_message_id = ?
+        ''', (late, late, sent[0]))
+        conn.commit()
+    webhooks.record_routes([(late, client.user_id, time.time())])
+    drain(retry_pending=True)
+
+    assert delivery(client, late)[0] == 'delivered'
+    assert late not in pending_ids()
+
+
+def test_unmatched_statuses_expire(client, monkeypatch):
+    stray = f'wamid.{client.user_id}.stray'
+    body = callback((stray, 'delivered', 50))
+    post(client, body, signed(body))
+    drain()
+    assert stray in pending_ids()
+
+    monkeypatch.setattr(webhooks, 'WEBHOOK_PENDING_TTL', -1.0)
+    drain(retry_pending=True)
+    assert stray not in pending_ids()
@@ -0,0 +1,314 @@
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+from decouple import config
+from db import shard_router
+from group_commit import GroupCommitWriter
+from metrics import Counter, Histogram
+from shards import CATALOG_SHARD
+
+# Token WhatsApp echoes back when the webhook subscription is verified
+WHATSAPP_WEBHOOK_VERIFY_TOKEN = config('WHATSAPP_WEBHOOK_VERIFY_TOKEN', default='')
+# App secret for X-Hub-Signature-256; every callback is rejected when empty
+WHATSAPP_APP_SECRET = config('WHATSAPP_APP_SECRET', default='')
+# Whether this process runs the applier thread
+WEBHOOK_APPLIER = config('WEBHOOK_APPLIER', default=True, cast=bool)
+WEBHOOK_POLL_INTERVAL = config('WEBHOOK_POLL_INTERVAL', default=0.5, cast=float)
+# Logged callbacks folded into message statuses per transaction
+WEBHOOK_APPLY_BATCH = config('WEBHOOK_APPLY_BATCH', default=2000, cast=int)
+# Statuses for unknown message ids are retried this often, and dropped after the TTL
+WEBHOOK_RETRY_INTERVAL = config('WEBHOOK_RETRY_INTERVAL', default=5.0, cast=float)
+WEBHOOK_PENDING_TTL = config('WEBHOOK_PENDING_TTL', default=3600.0, cast=float)
+# Sent message ids are routed to their tenant this many seconds; later statuses go unmatched
+WEBHOOK_ROUTE_RETENTION = config('WEBHOOK_ROUTE_RETENTION', default=30 * 86400.0, cast=float)
+# Applied callbacks are kept this many seconds for replays, then pruned
+WEBHOOK_LOG_RETENTION = config('WEBHOOK_LOG_RETENTION', default=7 * 86400.0, cast=float)
+
+# Later statuses win; a repeated or out-of-order callback never moves a message back
+STATUS_RANKS = {'sent': 1, 'delivered': 2, 'read': 3, 'failed': 4}
+_RANK_SQL = '''CASE {column} WHEN 'sent' THEN 1 WHEN 'delivered' THEN 2
+                   WHEN 'read' THEN 3 WHEN 'failed' THEN 4 ELSE 0 END'''
+
+CURSOR_NAME = 'delivery_status'
+
+STATUSES = Counter('webhook_statuses_total', 'WhatsApp status callbacks by outcome', ('result',))
+APPLY_LAG = Histogram('webhook_apply_lag_seconds', 'Time from a callback being logged to its statuses applied',
+                      buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0))
+
+logger = logging.getLogger(__name__)
+
+# Callbacks arrive in floods: their log inserts are committed together
+_log_writer = GroupCommitWriter(
+    lambda shard: shard_router.pool(shard).connection(),
+    max_ops=config('WEBHOOK_COMMIT_BATCH', default=256, cast=int),
+    window=config('WEBHOOK_COMMIT_WINDOW_MS', default=2.0, cast=float) / 1000,
+)
+_wake = threading.Event()
+_stop = threading.Event()
+_thread = None
+
+
+def verify_signature(body, signature):
+    """Check X-Hub-Signature-256 against the app secret (always false without one)"""
+    if not WHATSAPP_APP_SECRET:
+        return False
+    expected = 'sha256=' + hmac.new(WHATSAPP_APP_SECRET.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature or '')
+
+
+def record_callback(body):
+    """Append a raw callback body to the log; returns once it is committed"""
+    received_at = time.time()
+    _log_writer.submit(CATALOG_SHARD, lambda conn: conn.execute(
+        'INSERT INTO webhook_events (received_at, body) VALUES (?, ?)', (received_at, body)
+    ))
+    _wake.set()
+
+
+def record_routes(routes):
+    """Remember the tenant of sent messages: (provider message id, user id, sent at) tuples"""
+    with shard_router.catalog.connection() as conn:
+        conn.executemany('''
+            INSERT OR IGNORE INTO provider_message_routes (provider_message_id, user_id, sent_at)
+            VALUES (?, ?, ?)
+        ''', routes)
+        conn.commit()
+
+
+def _route(message_ids):
+    """{shard: message ids} for the ids of sent messages whose tenant is not mid-move"""
+    with shard_router.catalog.connection() as conn:
+        rows = conn.execute('''
+            SELECT provider_message_id, user_id FROM provider_message_routes
+            WHERE provider_message_id IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(message_ids),)).fetchall()
+    by_shard = {}
+    for row in rows:
+        shard, moving = shard_router.lookup(row['user_id'])
+        if not moving:
+            by_shard.setdefault(shard, []).append(row['provider_message_id'])
+    return by_shard
+
+
+def parse_statuses(body):
+    """(message id, status, unix time, error) for each status in a Cloud API callback body"""
+    statuses = []
+    for entry in json.loads(body).get('entry') or []:
+        for change in entry.get('changes') or []:
+            for status in (change.get('value') or {}).get('statuses') or []:
+                if status.get('status') not in STATUS_RANKS or not status.get('id'):
+                    continue
+                errors = status.get('errors') or []
+                error = errors[0].get('title') or errors[0].get('message') if errors else None
+                timestamp = status.get('timestamp')
+                statuses.append((
+                    str(status['id']), status['status'],
+                    float(timestamp) if timestamp is not None else None,
+                    error,
+                ))
+    return statuses
+
+
+def _merge(latest, message_id, status, status_at, error):
+    """Keep the furthest status per message; ties go to the later timestamp
+
+    The earliest delivered or read time seen is kept alongside as the
+    delivery time, so a batch holding both still reports when it arrived.
+    """
+    current = latest.get(message_id)
+    delivered_at = status_at if status in ('delivered', 'read') else None
+    if current is not None and current[4] is not None:
+        delivered_at = min(current[4], delivered_at or current[4])
+    candidate = (STATUS_RANKS[status], status_at or 0.0, status, error, delivered_at)
+    if current is None or candidate[:2] > current[:2]:
+        latest[message_id] = candidate
+        return True
+    if delivered_at != current[4]:
+        latest[message_id] = current[:4] + (delivered_at,)
+    return False
+
+
+def _apply_to_shard(conn, latest, now):
+    """Apply statuses to the shard's messages; returns the ids found there"""
+    payload = json.dumps([[message_id, status, status_at or now, error, delivered_at]
+                          for message_id, (_, status_at, status, error, delivered_at) in latest.items()])
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        UPDATE campaign_messages AS m
+        SET delivery_status = s.status, delivery_status_at = s.status_at, delivery_error = s.error,
+            -- Milestone times for the report rollups; read implies delivered
+            delivered_at = COALESCE(m.delivered_at, s.delivered_at,
+                                    CASE WHEN s.status IN ('delivered', 'read') THEN s.status_at END),
+            read_at = CASE WHEN s.status = 'read' THEN COALESCE(m.read_at, s.status_at) ELSE m.read_at END,
+            failed_at = CASE WHEN s.status = 'failed' THEN COALESCE(m.failed_at, s.status_at) ELSE m.failed_at END
+        FROM (
+            SELECT json_extract(value, '$[0]') AS message_id, json_extract(value, '$[1]') AS status,
+                   json_extract(value, '$[2]') AS status_at, json_extract(value, '$[3]') AS error,
+                   json_extract(value, '$[4]') AS delivered_at
+            FROM json_each(?)
+        ) AS s
+        WHERE m.provider_message_id = s.message_id
+          AND {_RANK_SQL.format(column='m.delivery_status')} < {_RANK_SQL.format(column='s.status')}
+        RETURNING provider_message_id
+    ''', (payload,))
+    updated = {row['provider_message_id'] for row in cursor.fetchall()}
+    rest = [message_id for message_id in latest if message_id not in updated]
+    duplicates = set()
+    if rest:
+        # Already at this status or further along: duplicates, not strangers
+        cursor.execute('''
+            SELECT provider_message_id FROM campaign_messages
+            WHERE provider_message_id IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(rest),))
+        duplicates = {row['provider_message_id'] for row in cursor.fetchall()}
+    conn.commit()
+    STATUSES.inc('applied', amount=len(updated))
+    STATUSES.inc('duplicate', amount=len(duplicates))
+    return updated | duplicates
+
+
+def apply_callbacks(retry_pending=False):
+    """Fold the next batch of logged callbacks (and due retries) into message statuses
+
+    Statuses are deduplicated per message, routed to the shard of the
+    tenant that sent it (provider_message_routes) and applied shard by shard
+    in one statement each. Statuses for message ids not known yet, e.g. a
+    'sent' callback racing the send's own write-back or a tenant mid-move,
+    wait in delivery_status_pending, are retried with retry_pending and
+    expire after WEBHOOK_PENDING_TTL. Applying is idempotent, so a crash
+    before the cursor moves only repeats work. Returns whether there was
+    anything to do.
+    """
+    catalog = shard_router.catalog
+    now = time.time()
+    with catalog.connection() as conn:
+        cursor = conn.cursor()
+        if retry_pending:
+            # Expire before retrying, so statuses that never match are not looked up again
+            cursor.execute('DELETE FROM delivery_status_pending WHERE first_seen < ?',
+                           (now - WEBHOOK_PENDING_TTL,))
+            STATUSES.inc('expired', amount=cursor.rowcount)
+            cursor.execute('DELETE FROM provider_message_routes WHERE sent_at < ?',
+                           (now - WEBHOOK_ROUTE_RETENTION,))
+            conn.commit()
+        cursor.execute('SELECT last_id FROM webhook_cursors WHERE name = ?', (CURSOR_NAME,))
+        row = cursor.fetchone()
+        last_id = row['last_id'] if row else 0
+        cursor.execute('''
+            SELECT id, received_at, body FROM webhook_events WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, WEBHOOK_APPLY_BATCH))
+        events = cursor.fetchall()
+        pending = []
+        if retry_pending:
+            cursor.execute('''
+                SELECT message_id, status, status_at, error FROM delivery_status_pending
+                ORDER BY first_seen LIMIT ?
+            ''', (WEBHOOK_APPLY_BATCH,))
+            pending = cursor.fetchall()
+    if not events and not pending:
+        return False
+
+    latest = {}
+    for event in events:
+        try:
+            statuses = parse_statuses(event['body'])
+        except (ValueError, TypeError, AttributeError, IndexError):
+            STATUSES.inc('malformed')
+            continue
+        for status in statuses:
+            if not _merge(latest, *status):
+                STATUSES.inc('duplicate')
+    for row in pending:
+        _merge(latest, row['message_id'], row['status'], row['status_at'], row['error'])
+
+    unmatched = dict(latest)
+    for shard, message_ids in _route(list(latest)).items():
+        with shard_router.pool(shard).connection() as conn:
+            statuses = {message_id: latest[message_id] for message_id in message_ids}
+            for message_id in _apply_to_shard(conn, statuses, now):
+                del unmatched[message_id]
+
+    retried = {row['message_id'] for row in pending}
+    with catalog.connection() as conn:
+        cursor = conn.cursor()
+        if retried:
+            cursor.execute('''
+                DELETE FROM delivery_status_pending
+                WHERE message_id IN (SELECT value FROM json_each(?))
+            ''', (json.dumps([message_id for message_id in retried if message_id not in unmatched]),))
+        cursor.executemany(f'''
+            INSERT INTO delivery_status_pending (message_id, status, status_at, error, first_seen)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (message_id) DO UPDATE
+            SET status = excluded.status, status_at = excluded.status_at, error = excluded.error
+            WHERE {_RANK_SQL.format(column='excluded.status')} > {_RANK_SQL.format(column='status')}
+        ''', [(message_id, status, status_at or None, error, now)
+              for message_id, (_, status_at, status, error, _) in unmatched.items()])
+        if events:
+            # max(): an applier in another process may already be further along
+            cursor.execute('''
+                INSERT INTO webhook_cursors (name, last_id) VALUES (?, ?)
+                ON CONFLICT (name) DO UPDATE SET last_id = max(last_id, excluded.last_id)
+            ''', (CURSOR_NAME, events[-1]['id']))
+        if retry_pending:
+            cursor.execute('DELETE FROM webhook_events WHERE id <= ? AND received_at < ?',
+                           (events[-1]['id'] if events else last_id, now - WEBHOOK_LOG_RETENTION))
+        conn.commit()
+
+    STATUSES.inc('unmatched', amount=len(unmatched.keys() - retried))
+    for event in events:
+        APPLY_LAG.observe(max(0.0, now - event['received_at']))
+    return bool(events)
+
+
+def replay_from(event_id):
+    """Re-apply logged callbacks after event_id (e.g. 0 for everything still retained)"""
+    with shard_router.catalog.connection() as conn:
+        conn.execute('''
+            INSERT INTO webhook_cursors (name, last_id) VALUES (?, ?)
+            ON CONFLICT (name) DO UPDATE SET last_id = excluded.last_id
+        ''', (CURSOR_NAME, event_id))
+        conn.commit()
+    _wake.set()
+
+
+def _apply_loop():
+    last_retry = 0.0
+    while not _stop.is_set():
+        _wake.clear()
+        now = time.time()
+        retry = now - last_retry >= WEBHOOK_RETRY_INTERVAL
+        if retry:
+            last_retry = now
+        try:
+            busy = apply_callbacks(retry_pending=retry)
+        except Exception:
+            logger.exception("Error applying WhatsApp status callbacks")
+            busy = False
+        if not busy:
+            _wake.wait(WEBHOOK_POLL_INTERVAL)
+
+
+def start_applier():
+    """Start the applier thread once per process (no-op when WEBHOOK_APPLIER is off)"""
+    global _thread
+    if _thread is not None or not WEBHOOK_APPLIER:
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_apply_loop, name='webhook-applier', daemon=True)
+    _thread.start()
+
+
+def stop_applier(timeout=10.0):
+    """Stop the applier; anything logged but not applied is picked up on the next start"""
+    global _thread
+    if _thread is None:
+        return
+    _stop.set()
+    _wake.set()
+    _thread.join(timeout)
+    _thread = None
+    _log_writer.stop()
@@ -0,0 +1,87 @@
+import http.client
+import json
+import threading
+from urllib.parse import urlsplit
+from decouple import config
+
+# Base URL of the WhatsApp messaging API; point it at benchmarks/whatsapp_stub.py locally
+WHATSAPP_API_URL = config('WHATSAPP_API_URL', default='http://127.0.0.1:8025')
+WHATSAPP_API_TOKEN = config('WHATSAPP_API_TOKEN', default='')
+WHATSAPP_API_TIMEOUT = config('WHATSAPP_API_TIMEOUT', default=10.0, cast=float)
+
+
+class WhatsAppError(Exception):
+    """A send that did not succeed.
+
+    ``permanent`` errors (bad number, rejected payload) must not be retried;
+    ``retry_after`` carries the server's hint in seconds when it sent one.
+    """
+
+    def __init__(self, message, status=None, permanent=False, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.permanent = permanent
+        self.retry_after = retry_after
+
+
+_local = threading.local()
+
+
+def _connection():
+    # One keep-alive connection per sending thread
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        url = urlsplit(WHATSAPP_API_URL)
+        connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        conn = _local.conn = connection_class(url.hostname, url.port, timeout=WHATSAPP_API_TIMEOUT)
+        _local.prefix = url.path.rstrip('/')
+    return conn
+
+
+def _reset_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+    _local.conn = None
+
+
+def send_message(from_number, to_number, body, media_url=None, idempotency_key=None):
+    """Send one message and return the provider's message id.
+
+    The idempotency key makes retries safe: the API answers a repeated key
+    with the original message instead of sending it again.
+    """
+    payload = {'from': from_number, 'to': to_number, 'type': 'text', 'text': {'body': body}}
+    if media_url:
+        payload['media'] = {'link': media_url}
+    headers = {'Content-Type': 'application/json'}
+    if WHATSAPP_API_TOKEN:
+        headers['Authorization'] = f'Bearer {WHATSAPP_API_TOKEN}'
+    if idempotency_key:
+        headers['Idempotency-Key'] = idempotency_key
+
+    conn = _connection()
+    try:
+        conn.request('POST', f'{_local.prefix}/v1/messages', body=json.dumps(payload), headers=headers)
+        response = conn.getresponse()
+        data = response.read()
+    except (OSError, http.client.HTTPException) as e:
+        _reset_connection()
+        raise WhatsAppError(f'Connection error: {e}')
+
+    if 200 <= response.status < 300:
+        try:
+            return json.loads(data)['id']
+        except (ValueError, KeyError, TypeError):
+            raise WhatsAppError('Malformed response from WhatsApp API', status=response.status)
+
+    retry_after = response.getheader('Retry-After')
+    try:
+        retry_after = float(retry_after) if retry_after else None
+    except ValueError:
+        retry_after = None
+    permanent = 400 <= response.status < 500 and response.status not in (408, 409, 429)
+    raise WhatsAppError(
+        f'WhatsApp API returned {response.status}: {data[:200].decode("utf-8", "replace")}',
+        status=response.status, permanent=permanent, retry_after=retry_after
+    )
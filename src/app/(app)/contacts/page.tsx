@@ -27,6 +27,9 @@ import { contactsApi } from '@/lib/api/contacts';
 import { tagsApi } from '@/lib/api/tags';
 import type { Tag } from '@/lib/api/tags';
 
+// Fields the contact cards render; notes and other details load on the contact page
+const LIST_FIELDS = ['name', 'email', 'phone', 'company', 'avatar_url', 'created_at', 'tags'];
+
 interface CustomField {
   label: string;
   value: string | number | boolean;
@@ -108,10 +111,11 @@ export default function ContactsPage() {
         const result = await contactsApi.getContacts({
           page,
           search: searchTerm || undefined,
-          tag_id: selectedTag === 'all' ? undefined : Number(selectedTag)
+          tag_id: selectedTag === 'all' ? undefined : Number(selectedTag),
+          fields: LIST_FIELDS
         });
         setContacts(result.contacts);
-        setTotalPages(result.total_pages);
+        setTotalPages(result.total_pages ?? 1);
       } catch (err) {
         console.error('Failed to load contacts:', err);
         setError('Failed to load contacts. Please try again later.');
@@ -133,10 +137,11 @@ export default function ContactsPage() {
       const result = await contactsApi.getContacts({
         page,
         search: searchTerm || undefined,
-        tag_id: selectedTag === 'all' ? undefined : Number(selectedTag)
+        tag_id: selectedTag === 'all' ? undefined : Number(selectedTag),
+        fields: LIST_FIELDS
       });
       setContacts(result.contacts);
-      setTotalPages(result.total_pages);
+      setTotalPages(result.total_pages ?? 1);
     } catch (err) {
       console.error('Failed to delete contact:', err);
       toast({
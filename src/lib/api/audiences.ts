@@ -0,0 +1,28 @@
+const API_URL = 'http://localhost:5000/api';
+
+export interface ResolvedAudience {
+  count: number;
+  ids?: number[];
+}
+
+export const audiencesApi = {
+  // expression combines tag names with AND / OR / NOT and parentheses,
+  // e.g. '(vip OR lead) AND NOT unsubscribed'
+  async resolveAudience(expression: string, includeIds = true): Promise<ResolvedAudience> {
+    const response = await fetch(`${API_URL}/audiences/resolve`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({ expression, include_ids: includeIds }),
+      credentials: 'include',
+    });
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.error || 'Failed to resolve audience');
+    }
+
+    return response.json();
+  },
+};
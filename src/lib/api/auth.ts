@@ -55,4 +55,16 @@ export const authApi = {
 
     return response.json();
   },
-}; 
\ No newline at end of file
+
+  async logout(): Promise<void> {
+    const response = await fetch(`${API_URL}/auth/logout`, {
+      method: 'POST',
+      credentials: 'include',
+    });
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.error || 'Failed to logout');
+    }
+  },
+};
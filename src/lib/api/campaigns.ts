@@ -0,0 +1,91 @@
+const API_URL = 'http://localhost:5000/api';
+
+export type CampaignStatus = 'scheduled' | 'sending' | 'completed' | 'cancelled' | 'failed';
+
+export interface Campaign {
+  id: number;
+  title: string;
+  message: string;
+  media_url: string | null;
+  sender_number: string;
+  audience: string | null;
+  contact_ids: number[] | null;
+  status: CampaignStatus;
+  scheduled_at: number;
+  completed_at: number | null;
+  total_messages: number;
+  error: string | null;
+  messages?: Record<string, number>;
+  queue_lag_seconds?: number;
+  send_rate?: number | null;
+}
+
+export interface CreateCampaignData {
+  title: string;
+  message: string;
+  media_url?: string;
+  // A tag expression such as 'vip AND NOT unsubscribed', or explicit contact ids
+  audience?: string;
+  contact_ids?: number[];
+  // ISO 8601; omit to send immediately
+  send_at?: string;
+}
+
+export const campaignsApi = {
+  async getCampaigns(): Promise<Campaign[]> {
+    const response = await fetch(`${API_URL}/campaigns`, {
+      credentials: 'include',
+    });
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.error || 'Failed to fetch campaigns');
+    }
+
+    const data = await response.json();
+    return data.campaigns;
+  },
+
+  async getCampaign(id: number): Promise<Campaign> {
+    const response = await fetch(`${API_URL}/campaigns/${id}`, {
+      credentials: 'include',
+    });
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.error || 'Failed to fetch campaign');
+    }
+
+    return response.json();
+  },
+
+  async createCampaign(data: CreateCampaignData): Promise<Campaign> {
+    const response = await fetch(`${API_URL}/campaigns`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify(data),
+      credentials: 'include',
+    });
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.error || 'Failed to create campaign');
+    }
+
+    return response.json();
+  },
+
+  async cancelCampaign(id: number): Promise<void> {
+    const response = await fetch(`${API_URL}/campaigns/${id}/cancel`, {
+      method: 'POST',
+      credentials: 'include',
+    });
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.error || 'Failed to cancel campaign');
+    }
+  },
+};
@@ -7,6 +7,8 @@ export interface Contact {
   phone?: string;
   country_code?: string;
   whatsapp_number?: string;
+  // WhatsApp number normalized to E.164, e.g. +919876543210
+  phone_e164?: string | null;
   company?: string;
   avatar_url?: string;
   notes?: string;
@@ -23,10 +25,28 @@ export interface Tag {
 
 export interface ContactsResponse {
   contacts: Contact[];
-  total: number;
-  page: number;
   per_page: number;
-  total_pages: number;
+  // Offset pagination
+  page?: number;
+  // Present unless the count was skipped
+  total?: number;
+  total_pages?: number;
+  // Cursor pagination
+  has_more?: boolean;
+  next_cursor?: string | null;
+}
+
+export interface ImportJob {
+  id: number;
+  filename?: string;
+  status: 'queued' | 'running' | 'completed' | 'failed';
+  rows_processed: number;
+  rows_imported: number;
+  rows_rejected: number;
+  error?: string;
+  rejected: { line: number; reason: string; row: string[] }[];
+  created_at: string;
+  updated_at: string;
 }
 
 export const contactsApi = {
@@ -35,12 +55,19 @@ export const contactsApi = {
     per_page?: number;
     search?: string;
     tag_id?: number;
+    after?: string;
+    count?: boolean;
+    // Only return these fields (id and name are always included)
+    fields?: string[];
   } = {}): Promise<ContactsResponse> {
     const searchParams = new URLSearchParams();
     if (params.page) searchParams.append('page', params.page.toString());
     if (params.per_page) searchParams.append('per_page', params.per_page.toString());
     if (params.search) searchParams.append('search', params.search);
     if (params.tag_id) searchParams.append('tag_id', params.tag_id.toString());
+    if (params.after !== undefined) searchParams.append('after', params.after);
+    if (params.count !== undefined) searchParams.append('count', params.count ? 'true' : 'false');
+    if (params.fields) searchParams.append('fields', params.fields.join(','));
 
     const response = await fetch(`${API_URL}/contacts?${searchParams.toString()}`, {
       credentials: 'include',
@@ -67,6 +94,60 @@ export const contactsApi = {
     return response.json();
   },
 
+  async lookupContact(number: string, countryCode?: string): Promise<Contact | null> {
+    const searchParams = new URLSearchParams({ number });
+    if (countryCode) searchParams.append('country_code', countryCode);
+    const response = await fetch(`${API_URL}/contacts/lookup?${searchParams.toString()}`, {
+      credentials: 'include',
+    });
+
+    if (response.status === 404) return null;
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.error || 'Failed to look up contact');
+    }
+
+    return response.json();
+  },
+
+  async lookupContacts(numbers: string[], countryCode?: string): Promise<{ number: string; contact: Contact | null }[]> {
+    const response = await fetch(`${API_URL}/contacts/lookup`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({ numbers, country_code: countryCode }),
+      credentials: 'include',
+    });
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.error || 'Failed to look up contacts');
+    }
+
+    const data = await response.json();
+    return data.results;
+  },
+
+  // Up to 5000 ids; contacts come back in the order asked for
+  async batchGetContacts(ids: number[], fields?: string[]): Promise<{ contacts: Contact[]; missing: number[] }> {
+    const response = await fetch(`${API_URL}/contacts/batch-get`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({ ids, fields }),
+      credentials: 'include',
+    });
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.error || 'Failed to fetch contacts');
+    }
+
+    return response.json();
+  },
+
   async createContact(data: Partial<Contact> & { name: string }): Promise<Contact> {
     const response = await fetch(`${API_URL}/contacts`, {
       method: 'POST',
@@ -114,4 +195,39 @@ export const contactsApi = {
       throw new Error(error.error || 'Failed to delete contact');
     }
   },
-}; 
\ No newline at end of file
+
+  async importContacts(file: File): Promise<{ job_id: number; status: string }> {
+    const formData = new FormData();
+    formData.append('file', file);
+
+    const response = await fetch(`${API_URL}/contacts/import`, {
+      method: 'POST',
+      body: formData,
+      credentials: 'include',
+    });
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.error || 'Failed to import contacts');
+    }
+
+    return response.json();
+  },
+
+  async getImportJob(jobId: number, params: { limit?: number; offset?: number } = {}): Promise<ImportJob> {
+    const searchParams = new URLSearchParams();
+    if (params.limit) searchParams.append('limit', params.limit.toString());
+    if (params.offset) searchParams.append('offset', params.offset.toString());
+
+    const response = await fetch(`${API_URL}/contacts/import/${jobId}?${searchParams.toString()}`, {
+      credentials: 'include',
+    });
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.error || 'Failed to fetch import job');
+    }
+
+    return response.json();
+  },
+};
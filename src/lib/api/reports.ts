@@ -0,0 +1,113 @@
+import type { CampaignStatus } from './campaigns';
+
+const API_URL = 'http://localhost:5000/api';
+
+// Messages that reached each milestone; read messages also count as delivered
+export interface MilestoneCounts {
+  sent: number;
+  delivered: number;
+  read: number;
+  failed: number;
+}
+
+export interface ReportRates {
+  // Percentages, null when there is nothing to divide by
+  delivery_rate: number | null;
+  read_rate: number | null;
+}
+
+export interface ReportSummary extends MilestoneCounts, ReportRates {
+  campaigns: number;
+}
+
+export interface CampaignReport extends MilestoneCounts, ReportRates {
+  id: number;
+  title: string;
+  status: CampaignStatus;
+  scheduled_at: number;
+  completed_at: number | null;
+  total_messages: number;
+}
+
+export interface ReportTimeseries {
+  granularity: 'hour' | 'day';
+  from: number;
+  to: number;
+  // One entry per hour or UTC day in the range; bucket is its unix start time
+  series: (MilestoneCounts & { bucket: number })[];
+}
+
+// Unix seconds or ISO 8601
+type Moment = number | string;
+
+function rangeParams(from?: Moment, to?: Moment): URLSearchParams {
+  const searchParams = new URLSearchParams();
+  if (from !== undefined) searchParams.append('from', from.toString());
+  if (to !== undefined) searchParams.append('to', to.toString());
+  return searchParams;
+}
+
+export const reportsApi = {
+  async getSummary(params: { from?: Moment; to?: Moment } = {}): Promise<ReportSummary> {
+    const searchParams = rangeParams(params.from, params.to);
+    const response = await fetch(`${API_URL}/reports/summary?${searchParams.toString()}`, {
+      credentials: 'include',
+    });
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.error || 'Failed to fetch report summary');
+    }
+
+    return response.json();
+  },
+
+  async getCampaignReports(): Promise<CampaignReport[]> {
+    const response = await fetch(`${API_URL}/reports/campaigns`, {
+      credentials: 'include',
+    });
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.error || 'Failed to fetch campaign reports');
+    }
+
+    const data = await response.json();
+    return data.campaigns;
+  },
+
+  async getCampaignReport(id: number): Promise<CampaignReport> {
+    const response = await fetch(`${API_URL}/reports/campaigns/${id}`, {
+      credentials: 'include',
+    });
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.error || 'Failed to fetch campaign report');
+    }
+
+    return response.json();
+  },
+
+  async getTimeseries(params: {
+    granularity?: 'hour' | 'day';
+    from?: Moment;
+    to?: Moment;
+    campaign_id?: number;
+  } = {}): Promise<ReportTimeseries> {
+    const searchParams = rangeParams(params.from, params.to);
+    if (params.granularity) searchParams.append('granularity', params.granularity);
+    if (params.campaign_id) searchParams.append('campaign_id', params.campaign_id.toString());
+
+    const response = await fetch(`${API_URL}/reports/timeseries?${searchParams.toString()}`, {
+      credentials: 'include',
+    });
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.error || 'Failed to fetch report time series');
+    }
+
+    return response.json();
+  },
+};
@@ -0,0 +1,35 @@
+import type { Contact, Tag } from './contacts';
+
+const API_URL = 'http://localhost:5000/api';
+
+export interface SyncChanges {
+  // Created or updated since the token, in their current state
+  contacts: Contact[];
+  tags: Tag[];
+  deleted: { contacts: number[]; tags: number[] };
+  // Pass back as `since` on the next call
+  next_token: string;
+  // More changes are waiting; call again straight away
+  has_more: boolean;
+  // Everything is being sent from scratch: drop the local copy first
+  reset: boolean;
+}
+
+export const syncApi = {
+  async getChanges(since?: string | null, limit?: number): Promise<SyncChanges> {
+    const searchParams = new URLSearchParams();
+    if (since) searchParams.append('since', since);
+    if (limit) searchParams.append('limit', limit.toString());
+
+    const response = await fetch(`${API_URL}/sync?${searchParams.toString()}`, {
+      credentials: 'include',
+    });
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.error || 'Failed to sync');
+    }
+
+    return response.json();
+  },
+};
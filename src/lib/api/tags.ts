@@ -4,8 +4,13 @@ export interface Tag {
   id: number;
   name: string;
   color: string;
+  contact_count?: number;
 }
 
+export type ContactSelection =
+  | { contact_ids: number[] }
+  | { filter: { search?: string; tag_id?: number } };
+
 export const tagsApi = {
   async getTags(): Promise<Tag[]> {
     const response = await fetch(`${API_URL}/tags`, {
@@ -66,4 +71,30 @@ export const tagsApi = {
       throw new Error(error.error || 'Failed to delete tag');
     }
   },
-}; 
\ No newline at end of file
+
+  async assignContacts(id: number, selection: ContactSelection): Promise<{ tag_id: number; changed: number }> {
+    return bulkTagRequest(id, 'POST', selection);
+  },
+
+  async unassignContacts(id: number, selection: ContactSelection): Promise<{ tag_id: number; changed: number }> {
+    return bulkTagRequest(id, 'DELETE', selection);
+  },
+};
+
+async function bulkTagRequest(id: number, method: 'POST' | 'DELETE', selection: ContactSelection) {
+  const response = await fetch(`${API_URL}/tags/${id}/contacts`, {
+    method,
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify(selection),
+    credentials: 'include',
+  });
+
+  if (!response.ok) {
+    const error = await response.json();
+    throw new Error(error.error || 'Failed to update tagged contacts');
+  }
+
+  return response.json();
+}